@@ -0,0 +1,206 @@
+"""
+Aggregation pipeline benchmark.
+
+For each ``--patients`` count, generates a synthetic population with the
+``generate_population`` command and runs ``aggregate_vitals`` the way beat
+does. Celery runs in eager mode, so every ``aggregate_patients`` batch runs
+inline, one after another, as on a single worker. OpenAI is replaced by a
+stub that answers after ``--llm-latency-ms``, and the clock is fixed so each
+patient has exactly ``--windows`` windows due.
+
+Each population is aggregated twice from the same watermarks: once for wall
+time and queries, once under tracemalloc for peak memory (tracemalloc slows
+the run, so its times aren't reported). Both are broken down by the
+``profiling.section`` blocks of the pipeline:
+
+* ``load vitals``: the history query and its DataFrame
+* ``per patient``: signal quality, HRV, features and the summary call
+* ``predict risk``: one model call for every window
+* ``write aggregates``: aggregate, watermark and snapshot writes
+* ``other``: dispatch, watermarks and batching outside those blocks
+
+Needs the model files. Runs against a test database created from the
+configured one and dropped afterwards:
+
+    python benchmarks/aggregation.py
+    python benchmarks/aggregation.py --patients 500 5000 --windows 3 --llm-latency-ms 800
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager, redirect_stdout
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'patient_vitals_backend.settings')
+
+STAGES = ['load vitals', 'per patient', 'predict risk', 'write aggregates', 'other']
+
+
+class StageRecorder:
+    """Stands in for ``profiling.section``, adding queries and peak memory per stage."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stage = 'other'
+        self.seconds = defaultdict(float)
+        self.queries = Counter()
+        self.peak_bytes = defaultdict(int)
+        self.baseline = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries[self.stage] += 1
+        return execute(sql, params, many, context)
+
+    def fold_peak(self):
+        # Charge the peak since the last boundary to the current stage
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] - self.baseline
+            self.peak_bytes[self.stage] = max(self.peak_bytes[self.stage], peak)
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def section(self, label):
+        stage = 'per patient' if label.startswith('patient ') else label
+        self.fold_peak()
+        outer, self.stage = self.stage, stage
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - started
+            self.fold_peak()
+            self.stage = outer
+
+
+def stub_openai(latency):
+    response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(
+        content="Vitals stable over the window; no intervention indicated.",
+    ))])
+
+    def create(**kwargs):
+        time.sleep(latency)
+        return response
+
+    completions = SimpleNamespace(create=create)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    client.with_options = lambda **kwargs: client
+    return client
+
+
+def reset(windows, closed_end, length):
+    """Delete earlier results and leave ``windows`` windows due for every patient."""
+    from patient_vitals_api import summarizer
+    from patient_vitals_api.models import Aggregate, AggregationWatermark, Patient
+
+    Aggregate.objects.all().delete()
+    AggregationWatermark.objects.all().delete()
+    AggregationWatermark.objects.bulk_create([
+        AggregationWatermark(patient_id=patient_id, window_end=closed_end - length * windows)
+        for patient_id in Patient.objects.values_list('id', flat=True)
+    ])
+    summarizer.breaker.cache_clear()
+
+
+def aggregate(recorder, moment, llm_latency):
+    from django.db import connections
+
+    from patient_vitals_api import pipeline, summarizer, tasks
+
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder.count_query))
+        stack.enter_context(mock.patch.object(pipeline, 'section', recorder.section))
+        stack.enter_context(mock.patch.object(tasks, 'section', recorder.section))
+        stack.enter_context(mock.patch.object(tasks, 'now', lambda: moment))
+        stack.enter_context(mock.patch.object(summarizer, 'openai_client', lambda: stub_openai(llm_latency)))
+        # The pipeline's progress and per-patient errors would bury the table
+        stack.enter_context(redirect_stdout(io.StringIO()))
+        started = time.perf_counter()
+        tasks.aggregate_vitals()
+        elapsed = time.perf_counter() - started
+    recorder.seconds['other'] += elapsed - sum(recorder.seconds.values())
+    return elapsed
+
+
+def main():
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment
+    from django.utils.timezone import now
+
+    from patient_vitals_api.aggregation import last_closed_boundary
+    from patient_vitals_api.models import Aggregate, Vital
+    from patient_vitals_api.risk_model import load_risk_model
+    from patient_vitals_api.scheduling import evaluation_interval
+    from patient_vitals_backend.celery import app
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--windows', type=int, default=1, help="Windows due per patient")
+    parser.add_argument('--interval', type=float, default=2, help="Seconds between generated readings")
+    parser.add_argument('--llm-latency-ms', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app.conf.update(task_always_eager=True, task_eager_propagates=True)
+    load_risk_model()
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    databases = runner.setup_databases()
+
+    # New patients start on the default cadence
+    length = evaluation_interval('')
+    moment = now()
+    closed_end = last_closed_boundary(moment, length)
+    span = length * args.windows
+    reading = timedelta(seconds=args.interval)
+    try:
+        print(f"{'patients':>8} {'stage':>16} {'seconds':>9} {'share':>6} {'queries':>8} {'peak MB':>8}")
+        for patients in args.patients:
+            started = time.perf_counter()
+            call_command(
+                'generate_population', patients=patients, days=span / timedelta(days=1),
+                interval=args.interval, end=(closed_end - reading).isoformat(),
+                replace=True, seed=args.seed, stdout=io.StringIO(),
+            )
+            generated = time.perf_counter() - started
+
+            reset(args.windows, closed_end, length)
+            timed = StageRecorder()
+            elapsed = aggregate(timed, moment, args.llm_latency_ms / 1000)
+            windows = Aggregate.objects.count()
+
+            reset(args.windows, closed_end, length)
+            tracemalloc.start()
+            try:
+                traced = StageRecorder(trace_memory=True)
+                aggregate(traced, moment, args.llm_latency_ms / 1000)
+                traced.fold_peak()
+            finally:
+                tracemalloc.stop()
+
+            for stage in STAGES:
+                print(f"{patients:>8} {stage:>16} {timed.seconds[stage]:>9.2f} "
+                      f"{timed.seconds[stage] / elapsed:>6.0%} {timed.queries[stage]:>8} "
+                      f"{traced.peak_bytes[stage] / 2 ** 20:>8.1f}")
+            print(f"{patients:>8} {'total':>16} {elapsed:>9.2f} {1:>6.0%} {sum(timed.queries.values()):>8} "
+                  f"{max(traced.peak_bytes.values()) / 2 ** 20:>8.1f}")
+            print(f"{'':>8} {Vital.objects.count()} readings, {windows} windows, "
+                  f"{elapsed / max(windows, 1) * 1000:.1f} ms per window, generated in {generated:.1f}s\n")
+    finally:
+        runner.teardown_databases(databases)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Database connection pooling benchmark.
+
+Creates a test database from the configured one and fills it with a
+``generate_population`` population. Then, for each ``--concurrency`` and
+with ``DB_POOL_ENABLED`` off and on, it starts a fresh interpreter that
+sends ``--uploads`` uploads to the ASGI application, ``--concurrency`` at a
+time, as Daphne would. (Django's test client keeps connections open between
+requests, so it would hide the cost being measured.) Reports upload
+throughput, latency percentiles and how many Postgres connections were
+opened.
+
+Rate limiting and live risk are turned off so uploads only wait on the
+database and Redis. Needs Postgres and Redis. Connection cost grows with
+TLS and network distance, so point it at the real database host:
+
+    python benchmarks/db_pool.py
+    python benchmarks/db_pool.py --concurrency 1 16 64 --uploads 2000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'patient_vitals_backend.settings')
+
+
+def payload(device_id, index):
+    return {
+        'device_id': device_id,
+        'heart_rate': 60 + index % 40,
+        'spo2': 95 + index % 5,
+        'temperature': 98.2,
+        'ecg': 0.1,
+        'accel_x': 0.1,
+        'accel_y': -0.2,
+        'accel_z': 9.8,
+        'systolic': 120,
+        'diastolic': 80,
+        'resp': 16,
+        'motion_status': 'Normal Activity',
+    }
+
+
+async def post(application, path, body):
+    """One HTTP request through ``application``; returns the status and body."""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [
+            (b'host', b'localhost'),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {'body': b''}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client stays connected; Django stops listening once it responds
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    await application(scope, receive, send)
+    return response['status'], response['body']
+
+
+async def send_uploads(application, device_ids, uploads, concurrency):
+    pending = iter(range(uploads))
+    latencies = []
+
+    async def upload_loop():
+        for index in pending:
+            body = json.dumps(payload(device_ids[index % len(device_ids)], index)).encode()
+            began = time.perf_counter()
+            status, content = await post(application, '/api/vitals/upload/', body)
+            latencies.append(time.perf_counter() - began)
+            if status != 201:
+                raise SystemExit(f"Upload failed with {status}: {content[:500]!r}")
+
+    began = time.perf_counter()
+    await asyncio.gather(*(upload_loop() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - began
+
+
+def child(uploads, concurrency):
+    """Runs in the fresh interpreter; prints one JSON line."""
+    import django
+    django.setup()
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+
+    from patient_vitals_api import db_pool
+    from patient_vitals_api.models import Device
+    from patient_vitals_backend.asgi import application
+
+    device_ids = list(Device.objects.filter(assigned_to__isnull=False).values_list('device_id', flat=True))
+    created = []
+    connection.close()
+    connection_created.connect(lambda **kwargs: created.append(1), weak=False)
+
+    # Warm up imports, caches and (when pooled) the pool's minimum connections
+    asyncio.run(send_uploads(application, device_ids, concurrency * 2, concurrency))
+    created.clear()
+    pool = db_pool.pools().get('default')
+    before = pool.get_stats() if pool else {}
+    latencies, elapsed = asyncio.run(send_uploads(application, device_ids, uploads, concurrency))
+
+    if pool:
+        after = pool.get_stats()
+
+        def grew(counter):
+            return after.get(counter, 0) - before.get(counter, 0)
+
+        opened = grew('connections_num')
+        waited = grew('requests_wait_ms') / max(grew('requests_num'), 1)
+    else:
+        # Without a pool every connect is a new Postgres connection
+        opened, waited = len(created), None
+    latencies.sort()
+    print(json.dumps({
+        'per_second': uploads / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'opened': opened,
+        'pool_wait_ms': waited,
+    }))
+
+
+def run_child(database, pooled, uploads, concurrency):
+    env = {
+        **os.environ,
+        'DB_NAME': database,
+        'DB_POOL_ENABLED': 'true' if pooled else 'false',
+        'PROCESS_TYPE': 'web',
+        'INGEST_RATE_LIMIT_ENABLED': 'false',
+        'LIVE_RISK_ENABLED': 'false',
+    }
+    result = subprocess.run(
+        [sys.executable, __file__, '--child', '--uploads', str(uploads), '--concurrency', str(concurrency)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Upload run failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--uploads', type=int, default=500, help="Timed uploads per run")
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.uploads, args.concurrency[0])
+        return
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment
+
+    if connection.vendor != 'postgresql':
+        raise SystemExit("Needs a PostgreSQL default database")
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    databases = runner.setup_databases()
+    try:
+        call_command('generate_population', patients=args.patients, days=0.01, stdout=io.StringIO())
+        database = connection.settings_dict['NAME']
+        connection.close()
+
+        print(f"{'mode':>8} {'uploads':>7} {'concurrent':>10} {'uploads/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'opened':>7} {'wait ms':>8}")
+        for concurrency in args.concurrency:
+            for pooled in (False, True):
+                result = run_child(database, pooled, args.uploads, concurrency)
+                wait = '-' if result['pool_wait_ms'] is None else f"{result['pool_wait_ms']:.2f}"
+                print(f"{'pooled' if pooled else 'direct':>8} {args.uploads:>7} {concurrency:>10} "
+                      f"{result['per_second']:>9.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                      f"{result['opened']:>7} {wait:>8}")
+    finally:
+        runner.teardown_databases(databases)
+
+
+if __name__ == '__main__':
+    main()
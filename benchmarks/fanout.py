@@ -0,0 +1,177 @@
+"""
+Channel-layer fan-out benchmark.
+
+For each backend in ``CHANNEL_LAYER_BACKENDS`` and each group size, starts
+``--processes`` subscriber processes (standing in for Daphne workers) that
+share the group's subscribers between them, then broadcasts ``--messages``
+frames to the group from this process, the way ``VitalsUploadView`` does.
+Reports send rate, delivery rate, broadcast latency percentiles (send to
+receive) and, when the server reports them, Redis commands per broadcast.
+
+Needs a Redis the benchmark may write to (keys use the ``bench-asgi``
+prefix, not the application's):
+
+    python benchmarks/fanout.py
+    python benchmarks/fanout.py --backend pubsub --subscribers 1 100 500 --rate 20
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'patient_vitals_backend.settings')
+
+GROUP = 'bench_patient_1'
+PREFIX = 'bench-asgi'
+
+
+def make_layer(backend, hosts, messages):
+    from django.utils.module_loading import import_string
+    layer_class = import_string(backend)
+    config = {'hosts': hosts, 'prefix': PREFIX}
+    if backend.endswith('.RedisChannelLayer'):
+        # Room for every frame, so slow receivers show up as latency, not drops
+        config['capacity'] = messages + 10
+    return layer_class(**config)
+
+
+def subscriber(backend, hosts, count, messages, timeout, ready, results):
+    async def run():
+        layer = make_layer(backend, hosts, messages)
+        channels = [await layer.new_channel() for _ in range(count)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        ready.release()
+
+        latencies = []
+
+        async def receive(channel):
+            for _ in range(messages):
+                message = await layer.receive(channel)
+                latencies.append(time.time() - message['sent_at'])
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(receive(channel) for channel in channels)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for channel in channels:
+            await layer.group_discard(GROUP, channel)
+        results.put((latencies, time.time()))
+        if hasattr(layer, 'close_pools'):
+            await layer.close_pools()
+        elif hasattr(layer, 'flush'):
+            await layer.flush()
+
+    asyncio.run(run())
+
+
+def command_count(url):
+    import redis
+    try:
+        stats = redis.Redis.from_url(url).info('commandstats')
+    except redis.RedisError:
+        return None
+    return sum(entry['calls'] for entry in stats.values()) if stats else None
+
+
+def bench(backend, hosts, subscribers, processes, messages, payload, rate, timeout):
+    context = multiprocessing.get_context('spawn')
+    ready = context.Semaphore(0)
+    results = context.Queue()
+    processes = min(processes, subscribers)
+    shares = [subscribers // processes + (index < subscribers % processes) for index in range(processes)]
+    workers = [
+        context.Process(target=subscriber, args=(backend, hosts, share, messages, timeout, ready, results))
+        for share in shares
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.acquire()
+
+    async def send():
+        layer = make_layer(backend, hosts, messages)
+        frame = 'x' * payload
+        started = time.time()
+        for index in range(messages):
+            if rate:
+                await asyncio.sleep(max(0, started + index / rate - time.time()))
+            await layer.group_send(GROUP, {'type': 'vitals.update', 'text': frame, 'sent_at': time.time()})
+        finished = time.time()
+        if hasattr(layer, 'close_pools'):
+            await layer.close_pools()
+        return started, finished
+
+    commands_before = command_count(hosts[0])
+    started, finished = asyncio.run(send())
+    latencies, last_received = [], started
+    for _ in workers:
+        worker_latencies, received_at = results.get()
+        latencies += worker_latencies
+        last_received = max(last_received, received_at if worker_latencies else started)
+    for worker in workers:
+        worker.join()
+    commands_after = command_count(hosts[0])
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000 if latencies else float('nan')
+
+    return {
+        'sends_per_second': messages / max(finished - started, 1e-9),
+        'deliveries_per_second': len(latencies) / max(last_received - started, 1e-9),
+        'delivered': len(latencies) / (messages * subscribers),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else float('nan'),
+        'commands_per_send': (
+            (commands_after - commands_before) / messages
+            if commands_before is not None and commands_after is not None else None
+        ),
+    }
+
+
+def main():
+    import django
+    django.setup()
+    from django.conf import settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(settings.CHANNEL_LAYER_BACKENDS), action='append')
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500])
+    parser.add_argument('--processes', type=int, default=4, help="Subscriber processes (web workers)")
+    parser.add_argument('--messages', type=int, default=100, help="Broadcasts per run")
+    parser.add_argument('--payload', type=int, default=8192, help="Frame size in bytes")
+    parser.add_argument('--rate', type=float, default=0, help="Broadcasts per second; 0 sends as fast as possible")
+    parser.add_argument('--timeout', type=float, default=60, help="Seconds subscribers wait for all frames")
+    parser.add_argument('--redis-url', action='append', dest='hosts',
+                        help="Redis to use; repeat to shard (default: CHANNEL_REDIS_URLS)")
+    args = parser.parse_args()
+    hosts = args.hosts or settings.CHANNEL_REDIS_URLS
+
+    print(f"{len(hosts)} Redis host(s), {args.processes} subscriber processes, "
+          f"{args.messages} x {args.payload} B broadcasts" + (f" at {args.rate}/s" if args.rate else ""))
+    print(f"{'backend':8} {'subs':>5} {'sends/s':>9} {'deliv/s':>10} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'cmds/send':>9} {'delivered':>9}")
+    for name in args.backend or sorted(settings.CHANNEL_LAYER_BACKENDS):
+        for subscribers in args.subscribers:
+            result = bench(
+                settings.CHANNEL_LAYER_BACKENDS[name], hosts, subscribers, args.processes,
+                args.messages, args.payload, args.rate, args.timeout,
+            )
+            commands = result['commands_per_send']
+            print(f"{name:8} {subscribers:>5} {result['sends_per_second']:>9.0f} {result['deliveries_per_second']:>10.0f} "
+                  f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                  f"{'-' if commands is None else f'{commands:.1f}':>9} {result['delivered']:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Live risk scoring benchmark.
+
+Creates a test database from the configured one and fills it with a
+``generate_population`` population. Then, for each ``--concurrency`` and
+with ``LIVE_RISK_ENABLED`` off and on, it starts a fresh interpreter that
+sends ``--uploads`` uploads to ``asgi.application``, ``--concurrency`` at a
+time, as Daphne would. Uploads only queue their reading for the scoring
+thread, which scores whatever has queued up during its previous call.
+
+Reports upload throughput, latency percentiles, the mean batch size, the
+share of uploads scored, and how long scoring ran on after the last upload
+returned. Rate limiting is turned off. Needs the model files, a database and
+Redis:
+
+    python benchmarks/live_risk.py
+    python benchmarks/live_risk.py --concurrency 1 32 64 --uploads 2000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'patient_vitals_backend.settings')
+
+# The ASGI upload driver of the pooling benchmark next to this file
+from db_pool import send_uploads  # noqa: E402
+
+
+def child(uploads, concurrency):
+    """Runs in the fresh interpreter; prints one JSON line."""
+    import django
+    django.setup()
+    from django.conf import settings
+
+    from patient_vitals_api import live_risk
+    from patient_vitals_api.models import Device
+    from patient_vitals_api.risk_model import load_risk_model
+    from patient_vitals_backend.asgi import application
+
+    device_ids = list(Device.objects.filter(assigned_to__isnull=False).values_list('device_id', flat=True))
+    batcher = None
+    if settings.LIVE_RISK_ENABLED:
+        # Load the model before the scoring thread needs it, as a warm process has
+        load_risk_model()
+        batcher = live_risk.batcher()
+
+    def settled(count, timeout=60):
+        deadline = time.monotonic() + timeout
+        while batcher.scored < count and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    warm_up = concurrency * 2
+    asyncio.run(send_uploads(application, device_ids, warm_up, concurrency))
+    if batcher:
+        settled(warm_up)
+    batches, before = (batcher.batches, batcher.scored) if batcher else (0, 0)
+    latencies, elapsed = asyncio.run(send_uploads(application, device_ids, uploads, concurrency))
+    scored, mean_batch, drain = 0, None, 0
+    if batcher:
+        finished = time.perf_counter()
+        settled(before + uploads)
+        drain = time.perf_counter() - finished
+        scored = batcher.scored - before
+        mean_batch = scored / max(batcher.batches - batches, 1)
+
+    latencies.sort()
+    print(json.dumps({
+        'per_second': uploads / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'batch': mean_batch,
+        'scored': scored / uploads,
+        'drain_ms': drain * 1000,
+    }))
+
+
+def run_child(database, enabled, uploads, concurrency):
+    env = {
+        **os.environ,
+        'DB_NAME': database,
+        'INGEST_RATE_LIMIT_ENABLED': 'false',
+        'LIVE_RISK_ENABLED': 'true' if enabled else 'false',
+    }
+    result = subprocess.run(
+        [sys.executable, __file__, '--child', '--uploads', str(uploads), '--concurrency', str(concurrency)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Upload run failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--uploads', type=int, default=500, help="Timed uploads per run")
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.uploads, args.concurrency[0])
+        return
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment
+
+    if connection.vendor == 'sqlite':
+        raise SystemExit("Needs a database the upload processes can share")
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    databases = runner.setup_databases()
+    try:
+        call_command('generate_population', patients=args.patients, days=0.01, stdout=io.StringIO())
+        database = connection.settings_dict['NAME']
+        connection.close()
+
+        print(f"{'live risk':>9} {'uploads':>7} {'concurrent':>10} {'uploads/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'batch':>6} {'scored':>6} {'drain ms':>8}")
+        for concurrency in args.concurrency:
+            for enabled in (False, True):
+                result = run_child(database, enabled, args.uploads, concurrency)
+                batch = '-' if result['batch'] is None else f"{result['batch']:.1f}"
+                print(f"{'on' if enabled else 'off':>9} {args.uploads:>7} {concurrency:>10} "
+                      f"{result['per_second']:>9.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                      f"{batch:>6} {result['scored']:>6.0%} {result['drain_ms']:>8.1f}")
+    finally:
+        runner.teardown_databases(databases)
+
+
+if __name__ == '__main__':
+    main()
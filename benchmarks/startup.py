@@ -0,0 +1,132 @@
+"""
+Cold-start benchmark per process type.
+
+Starts a fresh interpreter for each process type (Daphne web, Celery beat,
+Celery worker) with ``-X importtime``, and reports wall time, import time,
+peak RSS and the slowest top-level imports. Exits non-zero when a process
+exceeds its budget or when web/beat load any of the ML/LLM stack.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 5 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROCESS_TYPES = {
+    'web': """
+import django
+django.setup()
+from patient_vitals_backend.asgi import application
+import patient_vitals_backend.urls
+""",
+    'beat': """
+from patient_vitals_backend.celery import app
+app.loader.import_default_modules()
+""",
+    'worker': """
+from patient_vitals_backend.celery import app
+app.loader.import_default_modules()
+from patient_vitals_api.tasks import preload_pipeline, preload_risk_model
+preload_pipeline()
+preload_risk_model()
+""",
+}
+
+REPORT = """
+import resource, sys, json
+print(json.dumps({
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': sorted(sys.modules),
+}))
+"""
+
+# Only workers may load these
+WORKER_ONLY_MODULES = ['pandas', 'neurokit2', 'joblib', 'openai', 'matplotlib', 'scipy', 'sklearn', 'xgboost']
+
+# Median wall seconds / peak RSS MB allowed per process type
+BUDGETS = {
+    'web': {'seconds': 3.0, 'rss_mb': 150},
+    'beat': {'seconds': 3.0, 'rss_mb': 150},
+    'worker': {'seconds': 15.0, 'rss_mb': 600},
+}
+
+
+def run_once(process_type):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'patient_vitals_backend.settings')
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROCESS_TYPES[process_type] + REPORT],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise SystemExit(f"{process_type} failed to start:\n{result.stderr[-2000:]}")
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # Lines look like "import time:  self [us] | cumulative | imported package";
+    # top-level imports are the ones with a single space of indentation
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        if name.startswith('  ') or not cumulative.strip().isdigit():
+            continue
+        top_level.append((int(cumulative) / 1e6, name.strip()))
+
+    return {
+        'seconds': elapsed,
+        'import_seconds': sum(seconds for seconds, _ in top_level),
+        'rss_mb': report['rss_mb'],
+        'modules': set(report['modules']),
+        'slowest': sorted(top_level, reverse=True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10, help="Slowest top-level imports to list")
+    parser.add_argument('--only', choices=sorted(PROCESS_TYPES), action='append')
+    args = parser.parse_args()
+
+    failures = []
+    for process_type in args.only or PROCESS_TYPES:
+        runs = [run_once(process_type) for _ in range(args.repeat)]
+        seconds = statistics.median(run['seconds'] for run in runs)
+        import_seconds = statistics.median(run['import_seconds'] for run in runs)
+        rss_mb = max(run['rss_mb'] for run in runs)
+        budget = BUDGETS[process_type]
+
+        print(f"{process_type}: {seconds:.2f}s wall, {import_seconds:.2f}s importing, {rss_mb:.0f} MB peak RSS "
+              f"(budget {budget['seconds']}s, {budget['rss_mb']} MB)")
+        for cumulative, name in runs[-1]['slowest'][:args.top]:
+            print(f"    {cumulative * 1000:8.1f} ms  {name}")
+
+        if seconds > budget['seconds']:
+            failures.append(f"{process_type} took {seconds:.2f}s")
+        if rss_mb > budget['rss_mb']:
+            failures.append(f"{process_type} peaked at {rss_mb:.0f} MB")
+        if process_type != 'worker':
+            leaked = sorted(module for module in WORKER_ONLY_MODULES if module in runs[-1]['modules'])
+            if leaked:
+                failures.append(f"{process_type} imported {', '.join(leaked)}")
+
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == '__main__':
+    main()
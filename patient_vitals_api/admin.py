@@ -1,7 +1,162 @@
+# admin.py
+"""
+Admins for the large tables (``Vital``, ``Aggregate``) avoid work that
+grows with the table:
+
+* counts come from planner statistics instead of ``COUNT(*)``
+  (``EstimatedCountPaginator``), and the unfiltered total isn't counted;
+* pages are fetched by keyset (``?after=<time>,<id>``) instead of OFFSET;
+* the date hierarchy builds its links from the first and last row of the
+  current range instead of a DISTINCT over every row (see
+  ``templatetags/admin_keyset.py``), and its ranges hit the
+  ``(patient, timestamp)`` index when searching by patient ID;
+* foreign keys are raw-id widgets and listed relations are joined up front.
+
+GET requests go to a read replica when one is configured (see
+``replicas.py``).
+"""
+import json
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
 from .models import Patient, Device, Vital, Aggregate
+from .snapshots import refresh_snapshots
+
+CURSOR_VAR = 'after'
+# Below this many rows an exact count is cheap enough
+EXACT_COUNT_BELOW = 100000
+
+
+def estimated_count(queryset):
+    """
+    ``(count, estimated)`` for ``queryset``: PostgreSQL's row estimate for
+    large results, an exact count otherwise.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        queryset = queryset.order_by()
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                estimate = cursor.fetchone()[0]
+            else:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = plan[0]['Plan']['Plan Rows']
+        if estimate >= EXACT_COUNT_BELOW:
+            return int(estimate), True
+    return queryset.count(), False
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        count, self.estimated = estimated_count(self.object_list)
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    """Newest first by ``(keyset_field, id)``; each page starts after the last row of the previous one."""
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        super().__init__(request, *args, **kwargs)
+        # Filter and date links start again from the newest rows
+        self.params.pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        field = self.model_admin.keyset_field
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        queryset = self.queryset.order_by(f'-{field}', '-pk')
+        if self.cursor:
+            value, _, pk = self.cursor.rpartition(',')
+            moment = parse_datetime(value)
+            if moment is None or not pk.isdigit():
+                raise admin.options.IncorrectLookupParameters
+            # The OR alone isn't an index range; the redundant bound is, so a
+            # deep page starts at the cursor instead of scanning down to it
+            queryset = queryset.filter(**{f'{field}__lte': moment}).filter(
+                Q(**{f'{field}__lt': moment}) | Q(**{field: moment, 'pk__lt': int(pk)})
+            )
+
+        rows = list(queryset[:self.list_per_page + 1])
+        self.result_list = rows[:self.list_per_page]
+        self.next_page_query = None
+        if len(rows) > self.list_per_page:
+            last = self.result_list[-1]
+            self.next_page_query = self.get_query_string({CURSOR_VAR: f"{getattr(last, field).isoformat()},{last.pk}"})
+        self.first_page_query = self.get_query_string(remove=[CURSOR_VAR]) if self.cursor else None
+
+        self.result_count = paginator.count
+        self.result_count_estimated = paginator.estimated
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = bool(self.next_page_query or self.cursor)
+        self.paginator = paginator
+
+
+class KeysetAdmin(admin.ModelAdmin):
+    keyset_field = None
+    change_list_template = 'admin/patient_vitals_api/keyset_change_list.html'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Any other order would defeat the keyset
+    sortable_by = ()
+    list_per_page = 50
+    # An exact match on the patient, so ranges use the (patient, time) index
+    search_fields = ('=patient__patient_id',)
+    search_help_text = "Exact patient ID"
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+@admin.register(Vital)
+class VitalAdmin(KeysetAdmin):
+    keyset_field = 'timestamp'
+    date_hierarchy = 'timestamp'
+    list_display = ('timestamp', 'patient', 'device', 'heart_rate', 'spo2', 'temperature', 'systolic', 'diastolic', 'resp', 'motion_status')
+    list_select_related = ('patient', 'device')
+    raw_id_fields = ('patient', 'device')
+
+
+@admin.register(Aggregate)
+class AggregateAdmin(KeysetAdmin):
+    keyset_field = 'start_time'
+    date_hierarchy = 'start_time'
+    list_display = ('start_time', 'end_time', 'patient', 'risk_level', 'confidence', 'signal_quality', 'avg_heart_rate', 'avg_spo2')
+    list_select_related = ('patient',)
+    raw_id_fields = ('patient',)
+
+    # Deleting aggregates sends no signal (see signals.py)
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: refresh_snapshots([obj.patient_id]))
+
+    def delete_queryset(self, request, queryset):
+        patient_ids = set(queryset.values_list('patient_id', flat=True))
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(lambda: refresh_snapshots(patient_ids))
+
 
 admin.site.register(Patient)
 admin.site.register(Device)
-admin.site.register(Vital)
-admin.site.register(Aggregate)
\ No newline at end of file
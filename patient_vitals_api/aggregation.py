@@ -0,0 +1,50 @@
+# aggregation.py
+"""
+Aligned aggregation windows.
+
+Window boundaries are multiples of ``AGGREGATION_WINDOW_SECONDS`` since the
+epoch, so the periodic task and the backfill command always agree on where a
+window starts and ends. A window counts as closed once its end plus
+``AGGREGATION_GRACE_SECONDS`` has passed, which gives late commits a chance to
+land before the window is scored.
+
+A window is scored on the readings of ``scoring_span`` ending with it, which
+can reach back past its start: a High-risk patient gets an aggregate every
+minute, each scored on the last five minutes. The periodic task and the
+backfill command share this definition.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def window_length():
+    return timedelta(seconds=settings.AGGREGATION_WINDOW_SECONDS)
+
+
+def align(ts, length=None):
+    """Floor ``ts`` to the window grid."""
+    length = length or window_length()
+    return EPOCH + ((ts - EPOCH) // length) * length
+
+
+def align_up(ts, length=None):
+    """Ceil ``ts`` to the window grid."""
+    length = length or window_length()
+    floored = align(ts, length)
+    return floored if floored == ts else floored + length
+
+
+def scoring_span(length=None):
+    """Span of readings, ending with a window of ``length``, that it is scored on."""
+    length = length or window_length()
+    return max(length, timedelta(seconds=settings.SCORING_WINDOW_SECONDS))
+
+
+def last_closed_boundary(now=None, length=None):
+    """End of the most recent window that is safe to aggregate."""
+    now = now or timezone.now()
+    return align(now - timedelta(seconds=settings.AGGREGATION_GRACE_SECONDS), length)
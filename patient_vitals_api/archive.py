@@ -0,0 +1,295 @@
+# archive.py
+"""
+Cold storage for old vitals.
+
+Once a UTC day is older than ``VITALS_ARCHIVE_AFTER_DAYS``, each patient's
+``Vital`` rows for that day are written to one columnar file,
+``VITALS_ARCHIVE_DIR/<patient pk>/<YYYY-MM-DD>.npz``, with one typed NumPy
+array per column. The file is read back and compared with the rows, and
+only then are the rows deleted from the database.
+
+By default the arrays are stored uncompressed and memory-mapped on read,
+so a time-range read only touches the pages it slices. With
+``VITALS_ARCHIVE_COMPRESS`` the files are smaller but have to be
+decompressed in full.
+
+``load_history`` merges archived and live rows into one frame, so exports,
+backfills and model retraining don't need to know where a reading lives.
+
+Like ``pipeline``, this module needs numpy and pandas. Import it inside the
+task or command that uses it.
+"""
+import os
+import struct
+import zipfile
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils.timezone import now
+
+from .models import Vital
+
+# Stored columns and their dtypes. Nullable integer vitals become floats so
+# a missing reading can be NaN; every value they hold is exact in float32,
+# and every upload counter in float64.
+COLUMNS = {
+    'id': np.int64,
+    'timestamp': np.int64,  # microseconds since the Unix epoch, UTC
+    'device_id': np.int64,
+    'sequence': np.float64,
+    'device_timestamp': np.int64,  # like timestamp; NaT when the device sent none
+    'heart_rate': np.float32,
+    'spo2': np.float32,
+    'temperature': np.float64,
+    'ecg': np.float64,
+    'accel_x': np.float64,
+    'accel_y': np.float64,
+    'accel_z': np.float64,
+    'systolic': np.float32,
+    'diastolic': np.float32,
+    'resp': np.float32,
+}
+TIME_COLUMNS = ['timestamp', 'device_timestamp']
+# Stored as int16 codes (-1 for none) into a separate array of labels
+CATEGORY_COLUMNS = ['motion_status']
+FIELDS = [*COLUMNS, *CATEGORY_COLUMNS]
+
+DELETE_BATCH_SIZE = 5000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class ArchiveMismatch(Exception):
+    pass
+
+
+def archive_path(patient_id, day):
+    return os.path.join(settings.VITALS_ARCHIVE_DIR, str(patient_id), f"{day.isoformat()}.npz")
+
+
+def day_bounds(day):
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def to_micros(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def rows_to_frame(rows, fields=FIELDS):
+    frame = pd.DataFrame.from_records(list(rows), columns=fields)
+    for field in fields:
+        if field in TIME_COLUMNS:
+            frame[field] = pd.to_datetime(frame[field], utc=True)
+        elif field == 'patient_id' or COLUMNS.get(field) == np.int64:
+            frame[field] = frame[field].astype(np.int64)
+        elif field in COLUMNS:
+            frame[field] = frame[field].astype(np.float64)
+    return frame
+
+
+def frame_to_arrays(frame):
+    arrays = {}
+    for column, dtype in COLUMNS.items():
+        if column in TIME_COLUMNS:
+            arrays[column] = frame[column].dt.as_unit('us').astype(np.int64).to_numpy()
+        else:
+            arrays[column] = frame[column].to_numpy(dtype)
+    for column in CATEGORY_COLUMNS:
+        codes, labels = pd.factorize(frame[column])
+        arrays[column] = codes.astype(np.int16)
+        arrays[f'{column}_labels'] = np.asarray(labels, dtype=str)
+    return arrays
+
+
+def arrays_to_frame(arrays, start=0, stop=None):
+    """Rows ``[start, stop)`` of an archived day; only that slice is copied."""
+    rows = len(arrays['id'][start:stop])
+    columns = {}
+    for column, dtype in COLUMNS.items():
+        if column in arrays:
+            columns[column] = arrays[column][start:stop].astype(np.int64 if dtype == np.int64 else np.float64)
+        else:
+            # A day archived before sequence and device_timestamp were kept
+            columns[column] = np.full(rows, np.iinfo(np.int64).min if column in TIME_COLUMNS else np.nan)
+    frame = pd.DataFrame(columns)
+    for column in TIME_COLUMNS:
+        frame[column] = pd.to_datetime(frame[column], unit='us', utc=True)
+    for column in CATEGORY_COLUMNS:
+        labels = np.asarray(arrays[f'{column}_labels'], dtype=object)
+        codes = np.asarray(arrays[column][start:stop])
+        values = np.full(len(codes), None, dtype=object)
+        values[codes >= 0] = labels[codes[codes >= 0]]
+        frame[column] = values
+    return frame
+
+
+def write_day(path, arrays):
+    """Write atomically: a crash leaves either the old file or the new one."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.partial"
+    save = np.savez_compressed if settings.VITALS_ARCHIVE_COMPRESS else np.savez
+    with open(partial, 'wb') as output:
+        save(output, **arrays)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(partial, path)
+
+
+def _memmap_member(path, info):
+    with open(path, 'rb') as archive:
+        # Skip the zip local file header to the start of the .npy data
+        archive.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', archive.read(30)[26:30])
+        archive.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(archive)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(archive)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(archive)
+        offset = archive.tell()
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+def read_day(path):
+    """Arrays of one archived day, memory-mapped where stored uncompressed."""
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            column = info.filename.removesuffix('.npy')
+            if info.compress_type == zipfile.ZIP_STORED:
+                arrays[column] = _memmap_member(path, info)
+            else:
+                with archive.open(info) as member:
+                    arrays[column] = np.lib.format.read_array(member)
+    return arrays
+
+
+def same_rows(stored, expected):
+    if len(stored) != len(expected):
+        return False
+    for column in COLUMNS:
+        if column in TIME_COLUMNS:
+            equal = stored[column].equals(expected[column])
+        else:
+            equal = np.array_equal(stored[column].to_numpy(np.float64), expected[column].to_numpy(np.float64), equal_nan=True)
+        if not equal:
+            return False
+    return all(
+        stored[column].where(stored[column].notna(), None).tolist()
+        == expected[column].where(expected[column].notna(), None).tolist()
+        for column in CATEGORY_COLUMNS
+    )
+
+
+def archive_patient_day(patient_id, day):
+    """
+    Move one patient's readings for ``day`` into the archive and return how
+    many rows were deleted. Rows already archived (a rerun, or late readings
+    for a day archived before) are merged into the existing file.
+    """
+    start, end = day_bounds(day)
+    rows = Vital.objects.filter(
+        patient_id=patient_id, timestamp__gte=start, timestamp__lt=end,
+    ).values_list(*FIELDS)
+    live = rows_to_frame(rows)
+    if live.empty:
+        return 0
+
+    path = archive_path(patient_id, day)
+    frame = live
+    if os.path.exists(path):
+        frame = pd.concat([arrays_to_frame(read_day(path)), live], ignore_index=True)
+        frame = frame.drop_duplicates('id', keep='first')
+    frame = frame.sort_values(['timestamp', 'id'], ignore_index=True)
+
+    write_day(path, frame_to_arrays(frame))
+    if not same_rows(arrays_to_frame(read_day(path)), frame):
+        raise ArchiveMismatch(f"Archive {path} does not match the rows it was written from")
+
+    ids = live['id'].tolist()
+    with transaction.atomic():
+        for offset in range(0, len(ids), DELETE_BATCH_SIZE):
+            Vital.objects.filter(id__in=ids[offset:offset + DELETE_BATCH_SIZE]).delete()
+    return len(ids)
+
+
+def archive_closed_days(before=None, patient_ids=None):
+    """Archive every patient/day before ``before`` (by default the retention cutoff)."""
+    if before is None:
+        before = now().date() - timedelta(days=settings.VITALS_ARCHIVE_AFTER_DAYS)
+    cutoff, _ = day_bounds(before)
+
+    vitals = Vital.objects.filter(timestamp__lt=cutoff)
+    if patient_ids is not None:
+        vitals = vitals.filter(patient_id__in=patient_ids)
+    pending = vitals.annotate(
+        day=TruncDate('timestamp', tzinfo=dt_timezone.utc),
+    ).values_list('patient_id', 'day').distinct().order_by('day', 'patient_id')
+
+    archived = 0
+    for patient_id, day in pending:
+        archived += archive_patient_day(patient_id, day)
+    return archived
+
+
+def archived_days(start, end, patient_ids=None):
+    """``(patient_id, path)`` for every archive file overlapping ``[start, end)``."""
+    root = settings.VITALS_ARCHIVE_DIR
+    if not os.path.isdir(root):
+        return []
+    if patient_ids is None:
+        patient_ids = sorted(int(name) for name in os.listdir(root) if name.isdigit())
+    days = []
+    day = start.astimezone(dt_timezone.utc).date()
+    last = (end.astimezone(dt_timezone.utc) - timedelta(microseconds=1)).date()
+    while day <= last:
+        days.append(day)
+        day += timedelta(days=1)
+    return [
+        (patient_id, archive_path(patient_id, day))
+        for patient_id in patient_ids
+        for day in days
+        if os.path.exists(archive_path(patient_id, day))
+    ]
+
+
+def load_history(start, end, patient_ids=None, fields=FIELDS):
+    """
+    Every reading in ``[start, end)`` as one frame sorted by patient and
+    time, whether it is archived or still in the database. ``fields`` picks
+    the columns; ``id``, ``patient_id`` and ``timestamp`` are always included.
+    """
+    columns = ['id', 'patient_id', 'timestamp']
+    columns += [field for field in fields if field not in columns]
+
+    frames = []
+    archived_ids = set()
+    first, last = to_micros(start), to_micros(end)
+    for patient_id, path in archived_days(start, end, patient_ids):
+        arrays = read_day(path)
+        lower, upper = np.searchsorted(arrays['timestamp'], [first, last])
+        if upper > lower:
+            frame = arrays_to_frame(arrays, lower, upper)
+            frame['patient_id'] = patient_id
+            archived_ids.update(frame['id'].tolist())
+            frames.append(frame[columns])
+
+    vitals = Vital.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    if patient_ids is not None:
+        vitals = vitals.filter(patient_id__in=patient_ids)
+    live = rows_to_frame(vitals.values_list(*columns), columns)
+    if archived_ids:
+        # Rows archived but not yet deleted
+        live = live[~live['id'].isin(archived_ids)]
+    if not live.empty or not frames:
+        frames.append(live)
+
+    frame = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return frame.sort_values(['patient_id', 'timestamp', 'id'], ignore_index=True)
@@ -35,12 +35,29 @@ class PatientConsumer(AsyncWebsocketConsumer):
 
     # Handle messages from group (e.g., vitals.update from view)
     async def vitals_update(self, event):
+        # Uploads send the frame already encoded
+        if 'text' in event:
+            await self.send(text_data=event['text'])
+            return
         data = event['data']
         await self.send(text_data=json.dumps({
             'type': 'vitals_update',
             'data': data
         }))
 
+    async def device_offline(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'device_offline',
+            'data': event['data']
+        }))
+
+    # Provisional risk of a reading already broadcast (see live_risk.py)
+    async def risk_update(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'risk_update',
+            'data': event['data']
+        }))
+
     # Helper to check patient
     @database_sync_to_async
     def patient_exists(self):
@@ -0,0 +1,72 @@
+# db_pool.py
+"""
+Pooled Postgres connections.
+
+With ``DB_POOL_ENABLED``, settings give every database Django's psycopg 3
+pool (``OPTIONS['pool']``). A request or task then borrows an open
+connection and returns it when Django would otherwise close it, instead of
+paying for TCP, TLS and authentication every time. Each process keeps at
+most the ``max_size`` of its ``PROCESS_TYPE`` per database, so Postgres
+connections are bounded by processes rather than by concurrent requests.
+Every checkout is health-checked. A query that finds all connections busy
+waits up to ``DB_POOL_TIMEOUT`` and then fails with ``PoolTimeout``.
+
+``stats()`` reports each pool's size and wait times for this process, and
+``MetricsView`` includes them.
+
+Pools are created on first use. A prefork worker child forgets any pool it
+inherited from the parent rather than closing it, because the sockets are
+still the parent's.
+"""
+from celery.signals import worker_process_init
+from django.db import connections
+
+
+def pools():
+    """``{alias: ConnectionPool}`` for the pooled databases of this process."""
+    found = {}
+    for alias in connections:
+        # Only the PostgreSQL backend has one, and only when configured
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is not None:
+            found[alias] = pool
+    return found
+
+
+def stats():
+    report = {}
+    for alias, pool in pools().items():
+        counters = pool.get_stats()
+        requests = counters.get('requests_num', 0)
+        queued = counters.get('requests_queued', 0)
+        wait_ms = counters.get('requests_wait_ms', 0)
+        report[alias] = {
+            'size': counters.get('pool_size', 0),
+            'available': counters.get('pool_available', 0),
+            'min_size': pool.min_size,
+            'max_size': pool.max_size,
+            'waiting': counters.get('requests_waiting', 0),
+            'checkouts': requests,
+            # Checkouts that found no idle connection, and how long they waited
+            'queued': queued,
+            'mean_wait_ms': wait_ms / requests if requests else None,
+            'mean_queued_wait_ms': wait_ms / queued if queued else None,
+            'timeouts': counters.get('requests_errors', 0),
+            'connections_opened': counters.get('connections_num', 0),
+            'mean_connect_ms': (
+                counters.get('connections_ms', 0) / counters['connections_num']
+                if counters.get('connections_num') else None
+            ),
+            'connections_lost': counters.get('connections_lost', 0),
+            'bad_returns': counters.get('returns_bad', 0),
+        }
+    return report
+
+
+@worker_process_init.connect
+def forget_inherited_pools(**kwargs):
+    for connection in connections.all():
+        # Django keeps pools on the backend class, shared by every thread
+        inherited = getattr(type(connection), '_connection_pools', None)
+        if inherited:
+            inherited.clear()
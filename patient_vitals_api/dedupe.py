@@ -0,0 +1,32 @@
+# dedupe.py
+"""
+Duplicate detection for retried uploads.
+
+Devices may send a ``sequence`` with each reading: a per-device counter that
+only ever grows, including across reboots (keep it in NVS, or put a boot
+counter in the high bits). A retry resends the same sequence.
+
+Redis keeps each device's highest sequence in one sorted set. ``ZADD GT``
+raises it and reports in one command whether the upload is above it, which
+is the usual case for new readings. Only uploads at or below it (retries,
+or readings that arrive out of order) cost a lookup on the
+``(device, sequence)`` unique index. That index is also the backstop when
+Redis is unavailable or two copies of an upload race.
+"""
+import redis
+from django.conf import settings
+
+from .models import Vital
+from .redis_client import get_redis
+
+HIGH_WATER_KEY = 'dedupe:high_water'
+
+
+def is_duplicate(device, sequence):
+    if settings.UPLOAD_DEDUPE_ENABLED:
+        try:
+            if get_redis().zadd(HIGH_WATER_KEY, {device.device_id: sequence}, gt=True, ch=True):
+                return False
+        except redis.RedisError as e:
+            print(f"Upload dedupe unavailable for device {device.device_id}: {e}")
+    return Vital.objects.filter(device=device, sequence=sequence).exists()
@@ -2,6 +2,7 @@ import requests
 import time
 import random
 import json
+from datetime import datetime, timezone
 
 # Endpoint URL - replace with your actual URL, e.g., 'http://localhost:8000/api/vitals/upload/' or deployed URL
 URL = 'http://127.0.0.1:8000/api/vitals/upload/'  # Change this
@@ -15,6 +16,9 @@ HEADERS = {
     # 'Authorization': 'Bearer your_token'  # If using auth
 }
 
+# Upload counter; real firmware keeps it in NVS so it survives reboots
+sequence = int(time.time())
+
 def generate_sample_payload():
     # Generate realistic sample data mimicking the device
     # Heart rate: 60-100 BPM
@@ -52,16 +56,25 @@ def generate_sample_payload():
         'systolic': int(systolic),
         'diastolic': int(diastolic),
         'resp': int(resp),
-        'motion_status': motion_status
+        'motion_status': motion_status,
+        'sequence': sequence,
+        'device_timestamp': datetime.now(timezone.utc).isoformat(),
     }
 
 def send_payload():
+    global sequence
+    sequence += 1
     payload = generate_sample_payload()
-    try:
-        response = requests.post(URL, headers=HEADERS, data=json.dumps(payload))
-        print(f"Response: {response.status_code} - {response.text}")
-    except Exception as e:
-        print(f"Error sending payload: {e}")
+    # Retries resend the same sequence, so the server stores the reading once
+    for attempt in range(5):
+        try:
+            response = requests.post(URL, headers=HEADERS, data=json.dumps(payload), timeout=5)
+            print(f"Response: {response.status_code} - {response.text}")
+            if response.status_code < 500 and response.status_code != 429:
+                return
+        except Exception as e:
+            print(f"Error sending payload: {e}")
+        time.sleep(2 ** attempt)
 
 # Mimic device sending every 5 seconds (run indefinitely)
 while True:
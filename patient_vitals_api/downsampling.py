@@ -0,0 +1,83 @@
+# downsampling.py
+"""
+Chart series reduced to a point budget.
+
+A chart can't draw more points than it has pixels, so series responses take
+a ``max_points`` and return at most that many, however many readings the
+span holds:
+
+* ``lttb`` (Largest-Triangle-Three-Buckets) keeps, from each bucket, the
+  point forming the largest triangle with the point kept before it and the
+  mean of the next bucket. A waveform keeps its visual shape (QRS peaks
+  survive), so it is used for the ECG.
+* ``min_max`` keeps the lowest and the highest point of each bucket, so a
+  desaturation or a heart-rate spike is never averaged away. It is used for
+  the other vitals.
+
+Both return the indices of the kept points in order, so timestamps and
+values are picked together. Buckets hold equal numbers of readings and
+LTTB measures areas by reading position, which at a steady upload rate is
+the same as by time.
+"""
+import numpy as np
+
+WAVEFORM_FIELDS = {'ecg'}
+
+# LTTB always keeps the first and last points plus one per bucket
+MIN_POINTS = 3
+
+
+def lttb(x, y, max_points):
+    count = len(y)
+    if max_points >= count:
+        return np.arange(count)
+    if max_points < MIN_POINTS:
+        raise ValueError(f"LTTB needs max_points >= {MIN_POINTS}")
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # max_points - 2 buckets between the first and last points
+    edges = np.linspace(1, count - 1, max_points - 1).astype(int)
+    kept = np.empty(max_points, dtype=int)
+    kept[0], kept[-1] = 0, count - 1
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        following = slice(end, edges[bucket + 2]) if bucket + 2 < len(edges) else slice(count - 1, count)
+        next_x, next_y = x[following].mean(), y[following].mean()
+        last_x, last_y = x[kept[bucket]], y[kept[bucket]]
+        # Twice the triangle's area; the factor doesn't change the argmax
+        area = np.abs((last_x - next_x) * (y[start:end] - last_y) - (last_x - x[start:end]) * (next_y - last_y))
+        kept[bucket + 1] = start + np.argmax(area)
+    return kept
+
+
+def min_max(y, max_points):
+    count = len(y)
+    if max_points >= count:
+        return np.arange(count)
+    y = np.asarray(y, dtype=float)
+    buckets = max(max_points // 2, 1)
+    edges = np.linspace(0, count, buckets + 1).astype(int)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    kept = []
+    for extreme in (np.minimum, np.maximum):
+        hits = np.flatnonzero(y == extreme.reduceat(y, edges[:-1])[bucket])
+        # The first hit in each bucket
+        kept.append(hits[np.unique(bucket[hits], return_index=True)[1]])
+    return np.unique(np.concatenate(kept))
+
+
+def downsample(timestamps, values, max_points, waveform=False):
+    """
+    ``(timestamps, values)`` lists of at most ``max_points`` readings, picked
+    by ``lttb`` when ``waveform`` and by ``min_max`` otherwise. Missing
+    readings (``None``) are left out.
+    """
+    y = np.array(values, dtype=float)
+    present = np.flatnonzero(~np.isnan(y))
+    if len(present) > max_points:
+        if waveform:
+            picked = lttb(present, y[present], max_points)
+        else:
+            picked = min_max(y[present], max_points)
+        present = present[picked]
+    return [timestamps[index] for index in present], y[present].tolist()
@@ -0,0 +1,123 @@
+# live_risk.py
+"""
+Provisional risk for live dashboards, between aggregation runs.
+
+Each web process runs one scoring thread (``RiskBatcher``). An upload hands
+it the new reading and returns at once; the vitals broadcast goes out
+without waiting for a score. The thread collects readings for up to
+``LIVE_RISK_LINGER_MS`` after the first (at most ``LIVE_RISK_MAX_BATCH``),
+scores them with one scaler and one model call, and sends each patient's
+group a ``risk_update`` message naming the reading it scored. Batches grow
+with the upload rate rather than with how many uploads happen to overlap in
+the view, and the linger delays only the ``risk_update``.
+
+The score uses the reading itself and an HRV estimate from the recent heart
+rates, so it is provisional. The risk level of the last ``Aggregate`` is
+still the one the dashboard keeps.
+
+The thread imports the model stack (see ``risk_model``) when it starts, so
+web start-up stays light. Readings that can't be scored, because the model
+failed to load or the call raised, get no ``risk_update``.
+"""
+import queue
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+
+class RiskBatcher:
+    def __init__(self, max_batch, linger=0):
+        self.max_batch = max_batch
+        self.linger = linger
+        self.requests = queue.SimpleQueue()
+        self.batches = 0
+        self.scored = 0
+        self.thread = threading.Thread(target=self.run, name='live-risk', daemon=True)
+        self.thread.start()
+
+    def submit(self, patient, vital, averages, heart_rates):
+        self.requests.put((patient, vital, averages, heart_rates))
+
+    def collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.requests.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        from .risk_model import build_features, estimate_hrv, load_risk_model, predict_risk_batch
+        try:
+            load_risk_model()
+        except Exception as e:
+            print(f"Error loading the risk model for live scoring: {e}")
+
+        while True:
+            batch = self.collect()
+            try:
+                results = predict_risk_batch([
+                    build_features(patient, averages, estimate_hrv(heart_rates))
+                    for patient, _, averages, heart_rates in batch
+                ])
+            except Exception as e:
+                print(f"Error scoring live risk for {len(batch)} readings: {e}")
+                continue
+            try:
+                broadcast([(vital, *result) for (_, vital, _, _), result in zip(batch, results)])
+            except Exception as e:
+                print(f"Error broadcasting live risk: {e}")
+            self.batches += 1
+            self.scored += len(batch)
+
+
+@lru_cache(maxsize=1)
+def batcher():
+    return RiskBatcher(settings.LIVE_RISK_MAX_BATCH, settings.LIVE_RISK_LINGER_MS / 1000)
+
+
+def reading_averages(vital):
+    # A single reading stands in for the window averages the model expects
+    return {
+        'avg_heart_rate': vital.heart_rate,
+        'avg_spo2': vital.spo2,
+        'avg_temperature': vital.temperature,
+        'avg_resp': vital.resp,
+        'avg_systolic': vital.systolic,
+        'avg_diastolic': vital.diastolic,
+    }
+
+
+def submit(patient, vital, heart_rates):
+    """Queue ``vital`` for scoring; its ``risk_update`` follows the upload's broadcast."""
+    if not settings.LIVE_RISK_ENABLED:
+        return
+    heart_rates = [rate for rate in heart_rates if rate]
+    batcher().submit(patient, vital, reading_averages(vital), heart_rates)
+
+
+def risk_message(vital, risk_level, confidence):
+    return {
+        'type': 'risk.update',
+        'data': {
+            'patient_id': vital.patient_id,
+            'vital_id': vital.id,
+            'timestamp': vital.timestamp.isoformat(),
+            'provisional_risk_level': risk_level,
+            'provisional_confidence': None if confidence is None else float(confidence) * 100,
+        },
+    }
+
+
+@async_to_sync
+async def broadcast(scores):
+    """One ``risk_update`` per ``(vital, risk_level, confidence)``, from one event loop."""
+    channel_layer = get_channel_layer()
+    for vital, risk_level, confidence in scores:
+        await channel_layer.group_send(f'patient_{vital.patient_id}', risk_message(vital, risk_level, confidence))
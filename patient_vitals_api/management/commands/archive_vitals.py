@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils.timezone import now
+
+from patient_vitals_api.archive import archive_closed_days
+from patient_vitals_api.models import Patient
+
+
+class Command(BaseCommand):
+    help = "Move whole days of vitals older than the retention cutoff into the archive, then delete them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help="Archive days before this date (UTC) instead of the retention cutoff")
+        parser.add_argument('--patient', action='append', dest='patients', metavar='PATIENT_ID',
+                            help="Limit to this patient_id; repeat for several")
+
+    def handle(self, *args, **options):
+        before = now().date() - timedelta(days=settings.VITALS_ARCHIVE_AFTER_DAYS)
+        if options['before']:
+            before = parse_date(options['before'])
+            if before is None:
+                raise CommandError(f"Not a date: {options['before']!r}")
+            if before > now().date():
+                raise CommandError("Only closed days can be archived")
+
+        patient_ids = None
+        if options['patients']:
+            patient_ids = list(Patient.objects.filter(
+                patient_id__in=options['patients']
+            ).values_list('id', flat=True))
+            if not patient_ids:
+                raise CommandError("No matching patients")
+
+        archived = archive_closed_days(before, patient_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} vitals before {before} to {settings.VITALS_ARCHIVE_DIR}"
+        ))
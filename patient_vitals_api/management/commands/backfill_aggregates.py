@@ -0,0 +1,141 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils.dateparse import parse_date, parse_datetime
+
+from patient_vitals_api import db_pool
+from patient_vitals_api.aggregation import align, align_up, last_closed_boundary, window_length
+from patient_vitals_api.models import Aggregate, Patient
+from patient_vitals_api.replicas import read_scope
+from patient_vitals_api.snapshots import refresh_snapshots
+from patient_vitals_api.pipeline import build_aggregates
+from patient_vitals_api.tasks import AGGREGATE_VALUE_FIELDS
+
+
+def parse_moment(value):
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        # Well formed but impossible, e.g. February 30th
+        raise CommandError(f"Not a valid date or datetime: {value!r}")
+    if moment is None:
+        if day is None:
+            raise CommandError(f"Not a date or datetime: {value!r}")
+        moment = datetime.combine(day, time.min)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_timezone.utc)
+    return moment
+
+
+def init_worker():
+    django.setup()
+    # Never share a connection or pool inherited from the parent across
+    # processes; the pool's idle sockets are still the parent's
+    db_pool.forget_inherited_pools()
+    connections.close_all()
+
+
+def backfill_chunk(start, end, patient_ids, summarize):
+    """Recompute one chunk of windows, replacing whatever was stored there."""
+    patients = Patient.objects.all()
+    if patient_ids is not None:
+        patients = patients.filter(id__in=patient_ids)
+    patients = list(patients)
+
+    with read_scope():
+        aggregates = build_aggregates(patients, start, end, summarize=summarize)
+    with transaction.atomic():
+        # A single DELETE, since nothing listens for aggregate deletes;
+        # handle() refreshes the snapshots once at the end
+        Aggregate.objects.filter(
+            patient__in=patients,
+            start_time__gte=start,
+            start_time__lt=end,
+        ).delete()
+        # aggregate_patients may write the same window between the two
+        # statements; whichever comes second overwrites it
+        Aggregate.objects.bulk_create(
+            aggregates,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['patient', 'start_time'],
+            update_fields=AGGREGATE_VALUE_FIELDS,
+        )
+    return len(aggregates)
+
+
+class Command(BaseCommand):
+    help = "Recompute aggregates for a date range in aligned windows, spread across a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', help="Start date or datetime (inclusive, UTC unless an offset is given)")
+        parser.add_argument('end', help="End date or datetime (exclusive)")
+        parser.add_argument('--patient', action='append', dest='patients', metavar='PATIENT_ID',
+                            help="Limit to this patient_id; repeat for several")
+        parser.add_argument('--chunk-hours', type=int, default=6,
+                            help="Span of vitals loaded and processed per job")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes; 1 runs everything in this process")
+        parser.add_argument('--with-summary', action='store_true',
+                            help="Also generate LLM summaries (slow and billed per window)")
+
+    def handle(self, *args, **options):
+        length = window_length()
+        start = align(parse_moment(options['start']), length)
+        end = align_up(parse_moment(options['end']), length)
+        # Windows still open, or in their grace period, would be written
+        # from partial data
+        closed = last_closed_boundary(length=length)
+        if end > closed:
+            self.stdout.write(f"Stopping at {closed}, the end of the last closed window")
+            end = closed
+        if start >= end:
+            raise CommandError("start must be before end and the last closed window")
+
+        patient_ids = None
+        if options['patients']:
+            patient_ids = list(Patient.objects.filter(
+                patient_id__in=options['patients']
+            ).values_list('id', flat=True))
+            if not patient_ids:
+                raise CommandError("No matching patients")
+
+        # Keep chunks on the window grid so no window straddles two jobs
+        chunk = max(timedelta(hours=options['chunk_hours']) // length, 1) * length
+        chunks = []
+        cursor = start
+        while cursor < end:
+            chunks.append((cursor, min(cursor + chunk, end)))
+            cursor += chunk
+
+        summarize = options['with_summary']
+        written = 0
+        if options['workers'] <= 1:
+            for chunk_start, chunk_end in chunks:
+                count = backfill_chunk(chunk_start, chunk_end, patient_ids, summarize)
+                written += count
+                self.stdout.write(f"{chunk_start:%Y-%m-%d %H:%M} → {chunk_end:%Y-%m-%d %H:%M}: {count} aggregates")
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+                jobs = {
+                    pool.submit(backfill_chunk, chunk_start, chunk_end, patient_ids, summarize): (chunk_start, chunk_end)
+                    for chunk_start, chunk_end in chunks
+                }
+                for job in as_completed(jobs):
+                    chunk_start, chunk_end = jobs[job]
+                    count = job.result()
+                    written += count
+                    self.stdout.write(f"{chunk_start:%Y-%m-%d %H:%M} → {chunk_end:%Y-%m-%d %H:%M}: {count} aggregates")
+
+        # bulk_create skips the signals that normally keep snapshots fresh
+        refresh_snapshots(patient_ids or Patient.objects.values_list('id', flat=True))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {written} aggregates across {len(chunks)} chunks from {start} to {end}"
+        ))
@@ -0,0 +1,52 @@
+import sys
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patient_vitals_api.archive import FIELDS, load_history
+from patient_vitals_api.management.commands.backfill_aggregates import parse_moment
+from patient_vitals_api.models import Patient
+
+
+class Command(BaseCommand):
+    help = "Export vitals for a date range as CSV, reading archived and live rows alike."
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', help="Start date or datetime (inclusive, UTC unless an offset is given)")
+        parser.add_argument('end', help="End date or datetime (exclusive)")
+        parser.add_argument('--patient', action='append', dest='patients', metavar='PATIENT_ID',
+                            help="Limit to this patient_id; repeat for several")
+        parser.add_argument('--output', help="File to write; defaults to stdout")
+        parser.add_argument('--chunk-hours', type=int, default=24,
+                            help="Span loaded into memory at a time")
+
+    def handle(self, *args, **options):
+        start = parse_moment(options['start'])
+        end = parse_moment(options['end'])
+        if start >= end:
+            raise CommandError("start must be before end")
+
+        patient_ids = None
+        if options['patients']:
+            patient_ids = list(Patient.objects.filter(
+                patient_id__in=options['patients']
+            ).values_list('id', flat=True))
+            if not patient_ids:
+                raise CommandError("No matching patients")
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        rows = 0
+        header = True
+        try:
+            chunk = timedelta(hours=options['chunk_hours'])
+            cursor = start
+            while cursor < end:
+                frame = load_history(cursor, min(cursor + chunk, end), patient_ids, fields=FIELDS)
+                frame.to_csv(output, header=header, index=False, date_format='%Y-%m-%dT%H:%M:%S.%fZ')
+                header = False
+                rows += len(frame)
+                cursor += chunk
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(f"Exported {rows} vitals from {start} to {end}")
@@ -0,0 +1,213 @@
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from patient_vitals_api.models import Device, Patient, Vital
+
+# The pipeline reads a window's consecutive ECG values as one trace at this rate
+ECG_SAMPLING_RATE = 100
+
+# (offset from the R peak in seconds, amplitude in mV, width in seconds)
+PQRST = [
+    (-0.20, 0.12, 0.025),
+    (-0.04, -0.10, 0.010),
+    (0.00, 1.00, 0.012),
+    (0.04, -0.25, 0.010),
+    (0.28, 0.30, 0.045),
+]
+
+MOTION_LEVELS = ['Low Activity', 'Normal Activity', 'High Activity']
+
+
+@contextmanager
+def explicit_timestamps():
+    """Let bulk_create keep the timestamps we set instead of ``auto_now_add``."""
+    field = Vital._meta.get_field('timestamp')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def ar1(rng, size, timescale, scale=1.0):
+    """A stationary AR(1) series with ``timescale`` rows of memory."""
+    phi = np.exp(-1 / max(timescale, 1))
+    shocks = rng.normal(0, scale * np.sqrt(1 - phi ** 2), size)
+    series = np.empty(size)
+    series[0] = rng.normal(0, scale)
+    for index in range(1, size):
+        series[index] = phi * series[index - 1] + shocks[index]
+    return series
+
+
+def synthesize_ecg(rng, heart_rate, activity):
+    """
+    One ECG sample per row: a PQRST trace at ``ECG_SAMPLING_RATE`` whose beat
+    intervals follow ``heart_rate``, with sensor noise, baseline wander and
+    motion artifacts where ``activity`` is high.
+    """
+    rows = len(heart_rate)
+    seconds = np.arange(rows) / ECG_SAMPLING_RATE
+    rates = np.clip(heart_rate, 35, 200)
+    # Each beat interval follows the heart rate of the row it starts in
+    peaks = [rng.uniform(0, 60 / rates[0])]
+    while peaks[-1] <= seconds[-1]:
+        row = min(int(peaks[-1] * ECG_SAMPLING_RATE), rows - 1)
+        peaks.append(peaks[-1] + 60 / rates[row] * (1 + rng.normal(0, 0.03)))
+    peaks = np.array([peaks[0] - 60 / rates[0], *peaks])
+
+    following = np.clip(np.searchsorted(peaks, seconds), 1, len(peaks) - 1)
+    trace = np.zeros(rows)
+    for neighbour in (peaks[following - 1], peaks[following]):
+        offset = seconds - neighbour
+        for centre, amplitude, width in PQRST:
+            trace += amplitude * np.exp(-((offset - centre) ** 2) / (2 * width ** 2))
+
+    trace += 0.05 * np.sin(2 * np.pi * 0.3 * seconds + rng.uniform(0, 2 * np.pi))
+    trace += rng.normal(0, 0.02, rows)
+    trace += rng.normal(0, 0.4, rows) * np.clip(activity - 1, 0, None)
+    return trace
+
+
+def synthesize_vitals(rng, rows, interval, deteriorating):
+    """Correlated vitals for one patient as ``{field: array}``; NaN is a missing reading."""
+    # Shared physiological stress: drives HR, BP and breathing up, SpO₂ down
+    stress = ar1(rng, rows, timescale=1800 / interval, scale=0.6)
+    if deteriorating:
+        onset = rng.integers(rows // 2, rows)
+        stress[onset:] += np.linspace(0, rng.uniform(1.5, 3), rows - onset)
+    activity = np.clip(1 + ar1(rng, rows, timescale=300 / interval, scale=0.6), 0, 2.5)
+
+    base_hr = rng.normal(76, 8)
+    base_systolic = rng.normal(122, 10)
+    base_diastolic = base_systolic * 0.65 + rng.normal(0, 4)
+    heart_rate = base_hr + 14 * stress + 10 * (activity - 1) + rng.normal(0, 2, rows)
+    vitals = {
+        'heart_rate': np.round(heart_rate),
+        'spo2': np.round(np.clip(98 - 2.5 * np.clip(stress, 0, None) + rng.normal(0, 0.7, rows), 70, 100)),
+        'temperature': 98.2 + 0.8 * np.clip(stress, 0, None) + rng.normal(0, 0.1, rows),
+        'resp': np.round(16 + 4 * stress + 2 * (activity - 1) + rng.normal(0, 1, rows)),
+        'systolic': np.round(base_systolic + 12 * stress + rng.normal(0, 4, rows)),
+        'diastolic': np.round(base_diastolic + 6 * stress + rng.normal(0, 3, rows)),
+        'accel_x': rng.normal(0, 0.1 + 0.8 * activity, rows),
+        'accel_y': rng.normal(0, 0.1 + 0.8 * activity, rows),
+        'accel_z': 9.81 + rng.normal(0, 0.1 + 0.8 * activity, rows),
+        'ecg': synthesize_ecg(rng, heart_rate, activity),
+    }
+    # Dropped readings, roughly 1% per sensor
+    for field in ['heart_rate', 'spo2', 'temperature', 'resp', 'systolic', 'diastolic']:
+        vitals[field][rng.random(rows) < 0.01] = np.nan
+    vitals['motion_status'] = np.array(MOTION_LEVELS)[np.digitize(activity, [0.6, 1.6])]
+    return vitals
+
+
+def value(array, index, cast):
+    item = array[index]
+    return None if item != item else cast(item)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create a synthetic population for load testing: patients, one assigned device each, and "
+        "correlated vitals with a realistic ECG trace at the upload interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, required=True)
+        parser.add_argument('--days', type=float, default=1, help="Span of vitals per patient")
+        parser.add_argument('--interval', type=float, default=2, help="Seconds between readings")
+        parser.add_argument('--end', help="Last reading time (default: now)")
+        parser.add_argument('--deteriorating', type=float, default=0.1,
+                            help="Fraction of patients whose vitals worsen during the span")
+        parser.add_argument('--prefix', default='SYN', help="patient_id/device_id prefix of the generated rows")
+        parser.add_argument('--replace', action='store_true',
+                            help="Delete patients and devices with this prefix first")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        end = now()
+        if options['end']:
+            end = parse_datetime(options['end'])
+            if end is None:
+                raise CommandError(f"Not a datetime: {options['end']!r}")
+        interval = timedelta(seconds=options['interval'])
+        rows = int(timedelta(days=options['days']) / interval)
+        if options['patients'] < 1 or rows < 2:
+            raise CommandError("Need at least one patient and two readings each")
+        prefix = options['prefix']
+        rng = np.random.default_rng(options['seed'])
+
+        if options['replace']:
+            Device.objects.filter(device_id__startswith=f"{prefix}-").delete()
+            Patient.objects.filter(patient_id__startswith=f"{prefix}-").delete()
+
+        offset = Patient.objects.filter(patient_id__startswith=f"{prefix}-").count()
+        with transaction.atomic():
+            Patient.objects.bulk_create([
+                Patient(
+                    patient_id=f"{prefix}-{offset + index:06d}",
+                    name=f"Synthetic Patient {offset + index}",
+                    age=int(rng.integers(18, 95)),
+                    room=f"Ward-{index % 200}",
+                    weight=float(np.clip(rng.normal(75, 14), 40, 160)),
+                    height=float(np.clip(rng.normal(1.7, 0.1), 1.4, 2.05)),
+                    gender=str(rng.choice(['Male', 'Female'])),
+                    condition="Synthetic load test",
+                )
+                for index in range(options['patients'])
+            ])
+            # Not every backend returns primary keys from bulk_create
+            patients = list(Patient.objects.filter(
+                patient_id__startswith=f"{prefix}-",
+            ).order_by('-id')[:options['patients']])[::-1]
+            Device.objects.bulk_create([
+                Device(device_id=f"{prefix}-ESP-{patient.patient_id[len(prefix) + 1:]}", assigned_to=patient)
+                for patient in patients
+            ])
+        devices = {device.assigned_to_id: device for device in Device.objects.filter(assigned_to__in=patients)}
+
+        timestamps = [end - interval * (rows - 1 - step) for step in range(rows)]
+        created = 0
+        batch = []
+        with explicit_timestamps():
+            for patient in patients:
+                vitals = synthesize_vitals(rng, rows, options['interval'], rng.random() < options['deteriorating'])
+                device = devices[patient.id]
+                for step, moment in enumerate(timestamps):
+                    batch.append(Vital(
+                        patient=patient,
+                        device=device,
+                        timestamp=moment,
+                        device_timestamp=moment,
+                        sequence=step,
+                        heart_rate=value(vitals['heart_rate'], step, int),
+                        spo2=value(vitals['spo2'], step, int),
+                        temperature=value(vitals['temperature'], step, float),
+                        ecg=float(vitals['ecg'][step]),
+                        accel_x=float(vitals['accel_x'][step]),
+                        accel_y=float(vitals['accel_y'][step]),
+                        accel_z=float(vitals['accel_z'][step]),
+                        systolic=value(vitals['systolic'], step, int),
+                        diastolic=value(vitals['diastolic'], step, int),
+                        resp=value(vitals['resp'], step, int),
+                        motion_status=str(vitals['motion_status'][step]),
+                    ))
+                    if len(batch) >= options['batch_size']:
+                        Vital.objects.bulk_create(batch)
+                        created += len(batch)
+                        batch = []
+            if batch:
+                Vital.objects.bulk_create(batch)
+                created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(patients)} patients with {created} vitals "
+            f"from {timestamps[0].isoformat()} to {end.isoformat()}"
+        ))
@@ -0,0 +1,22 @@
+# metrics.py
+"""
+Process-independent counters kept in a Redis hash, so every web process and
+worker adds to the same totals. Lua scripts may bump ``COUNTERS_KEY``
+directly to avoid an extra round trip.
+"""
+import redis
+
+from .redis_client import get_redis
+
+COUNTERS_KEY = 'metrics:counters'
+
+
+def incr(name, amount=1):
+    try:
+        get_redis().hincrby(COUNTERS_KEY, name, amount)
+    except redis.RedisError as e:
+        print(f"Error recording metric {name}: {e}")
+
+
+def snapshot():
+    return {name: int(value) for name, value in get_redis().hgetall(COUNTERS_KEY).items()}
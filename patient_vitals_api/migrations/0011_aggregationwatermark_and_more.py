@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:40
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The vital and aggregate tables keep taking writes while their indexes
+    # build; CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('patient_vitals_api', '0010_alter_aggregate_confidence_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregationWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_end', models.DateTimeField(help_text='Every window ending at or before this time has been aggregated')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        AddIndexConcurrently(
+            model_name='vital',
+            index=models.Index(fields=['patient', 'timestamp'], name='vital_patient_timestamp_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='vital',
+            index=models.Index(fields=['timestamp'], name='vital_timestamp_idx'),
+        ),
+        # Build the unique index without blocking writes, then attach it as
+        # the constraint, which only takes a brief lock. A failed build leaves
+        # an INVALID index to drop before migrating again.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql=[
+                        'CREATE UNIQUE INDEX CONCURRENTLY "unique_aggregate_window" '
+                        'ON "patient_vitals_api_aggregate" ("patient_id", "start_time")',
+                        'ALTER TABLE "patient_vitals_api_aggregate" ADD CONSTRAINT "unique_aggregate_window" '
+                        'UNIQUE USING INDEX "unique_aggregate_window"',
+                    ],
+                    reverse_sql='ALTER TABLE "patient_vitals_api_aggregate" DROP CONSTRAINT "unique_aggregate_window"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='aggregate',
+                    constraint=models.UniqueConstraint(fields=('patient', 'start_time'), name='unique_aggregate_window'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='aggregationwatermark',
+            name='patient',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='aggregation_watermark', to='patient_vitals_api.patient'),
+        ),
+    ]
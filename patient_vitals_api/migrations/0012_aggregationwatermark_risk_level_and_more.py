@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient_vitals_api', '0011_aggregationwatermark_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregationwatermark',
+            name='risk_level',
+            field=models.CharField(blank=True, default='', help_text='Latest risk level; sets the re-evaluation cadence', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='aggregationwatermark',
+            name='scheduled_until',
+            field=models.DateTimeField(blank=True, help_text='Window end an evaluation is already queued for', null=True),
+        ),
+    ]
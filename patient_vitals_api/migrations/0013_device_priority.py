@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient_vitals_api', '0012_aggregationwatermark_risk_level_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='priority',
+            field=models.CharField(choices=[('normal', 'Normal'), ('critical', 'Critical')], default='normal', help_text='Critical devices bypass ingest rate limiting', max_length=10),
+        ),
+    ]
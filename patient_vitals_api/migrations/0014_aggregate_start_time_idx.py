@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:08
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The aggregate table keeps taking writes while the index builds;
+    # CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('patient_vitals_api', '0013_device_priority'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='aggregate',
+            index=models.Index(fields=['start_time'], name='aggregate_start_time_idx'),
+        ),
+    ]
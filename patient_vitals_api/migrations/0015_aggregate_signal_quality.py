@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient_vitals_api', '0014_aggregate_start_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregate',
+            name='signal_quality',
+            field=models.FloatField(blank=True, help_text='ECG signal-quality index, 0 (unusable) to 1', null=True),
+        ),
+    ]
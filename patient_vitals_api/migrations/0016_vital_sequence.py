@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Uploads keep landing while the unique index builds; CONCURRENTLY can't
+    # run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('patient_vitals_api', '0015_aggregate_signal_quality'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vital',
+            name='device_timestamp',
+            field=models.DateTimeField(blank=True, help_text='When the device took the reading', null=True),
+        ),
+        migrations.AddField(
+            model_name='vital',
+            name='sequence',
+            field=models.BigIntegerField(blank=True, help_text="Device's upload counter; a repeat is a retry", null=True),
+        ),
+        # Build the unique index without blocking writes, then attach it as
+        # the constraint, which only takes a brief lock. A failed build leaves
+        # an INVALID index to drop before migrating again.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql=[
+                        'CREATE UNIQUE INDEX CONCURRENTLY "unique_vital_device_sequence" '
+                        'ON "patient_vitals_api_vital" ("device_id", "sequence")',
+                        'ALTER TABLE "patient_vitals_api_vital" ADD CONSTRAINT "unique_vital_device_sequence" '
+                        'UNIQUE USING INDEX "unique_vital_device_sequence"',
+                    ],
+                    reverse_sql='ALTER TABLE "patient_vitals_api_vital" DROP CONSTRAINT "unique_vital_device_sequence"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='vital',
+                    constraint=models.UniqueConstraint(fields=('device', 'sequence'), name='unique_vital_device_sequence'),
+                ),
+            ],
+        ),
+    ]
@@ -27,6 +27,12 @@ class Device(models.Model):
     device_id = models.CharField(max_length=50, unique=True, help_text="ESP32 device ID or MAC address")
     assigned_to = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, blank=True, related_name="devices")
     active = models.BooleanField(default=True)
+
+    PRIORITY_CHOICES = (
+        ('normal', 'Normal'),
+        ('critical', 'Critical'),
+    )
+    priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='normal', help_text="Critical devices bypass ingest rate limiting")
     last_seen = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -48,9 +54,18 @@ class Vital(models.Model):
     diastolic = models.IntegerField(null=True, blank=True)
     resp = models.IntegerField(null=True, blank=True)
     motion_status = models.CharField(max_length=50, null=True, blank=True, help_text="e.g., 'Normal Activity'")
+    sequence = models.BigIntegerField(null=True, blank=True, help_text="Device's upload counter; a repeat is a retry")
+    device_timestamp = models.DateTimeField(null=True, blank=True, help_text="When the device took the reading")
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['patient', 'timestamp'], name='vital_patient_timestamp_idx'),
+            models.Index(fields=['timestamp'], name='vital_timestamp_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'sequence'], name='unique_vital_device_sequence'),
+        ]
 
     def __str__(self):
         return f"Vital for {self.device} at {self.timestamp}"
@@ -73,11 +88,28 @@ class Aggregate(models.Model):
     avg_accel_z = models.FloatField(null=True, blank=True)
     risk_level = models.CharField(max_length=20, choices=RISK_LEVEL_CHOICES, default='N/A')
     confidence = models.FloatField(null=True, blank=True, help_text="ML confidence score, e.g., 0.94", default=0)
+    signal_quality = models.FloatField(null=True, blank=True, help_text="ECG signal-quality index, 0 (unusable) to 1")
     summary = models.TextField(help_text="LLM-generated summary")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-start_time']
+        indexes = [
+            models.Index(fields=['start_time'], name='aggregate_start_time_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'start_time'], name='unique_aggregate_window'),
+        ]
+
+    def __str__(self):
+        return f"Aggregate for {self.patient} from {self.start_time} to {self.end_time}"
+
+class AggregationWatermark(models.Model):
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, related_name="aggregation_watermark")
+    window_end = models.DateTimeField(help_text="Every window ending at or before this time has been aggregated")
+    risk_level = models.CharField(max_length=20, blank=True, default='', help_text="Latest risk level; sets the re-evaluation cadence")
+    scheduled_until = models.DateTimeField(null=True, blank=True, help_text="Window end an evaluation is already queued for")
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"Aggregate for {self.patient} from {self.start_time} to {self.end_time}"
\ No newline at end of file
+        return f"Aggregated {self.patient} up to {self.window_end}"
@@ -0,0 +1,200 @@
+# pipeline.py
+"""
+The worker-side aggregation pipeline: loading vitals into frames, HRV, risk
+scoring and LLM summaries.
+
+This module pulls in the whole ML/LLM stack (numpy, pandas, neurokit2 with
+matplotlib and scipy, joblib/xgboost, openai). Only import it from inside
+task bodies or management commands, never at module level of anything the
+web or beat processes load. Workers import it once at start-up, see
+``tasks.preload_pipeline``.
+"""
+import time
+
+import neurokit2 as nk
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .aggregation import align, scoring_span, window_length
+from .archive import load_history
+from .models import Aggregate
+from .profiling import section
+from .risk_model import build_features, estimate_hrv, predict_risk_batch
+from .signal_quality import HIGH_ACTIVITY, segment_quality
+from .summarizer import generate_summary_for_patient
+from .trends import segment_trends, window_trends
+
+# Vital columns averaged per window, in the order they are loaded
+AVG_FIELDS = [
+    'heart_rate',
+    'spo2',
+    'temperature',
+    'resp',
+    'systolic',
+    'diastolic',
+    'accel_x',
+    'accel_y',
+    'accel_z',
+]
+
+
+def load_vitals_frame(start, end, patient_ids=None):
+    """
+    Load every vital in ``[start, end)`` with a single query, plus any
+    archived readings when the span reaches back into the cold tier.
+    """
+    return load_history(start, end, patient_ids=patient_ids, fields=['ecg', 'motion_status', *AVG_FIELDS])
+
+
+def iter_windows(frame, start, end, length=None, span=None):
+    """
+    Yield ``(patient_id, window_start, window_end, trends, quality, ecg,
+    heart_rates)`` for every patient/window pair of ``[start, end)`` with
+    readings in ``frame``, which must be sorted by patient and time.
+
+    Windows follow the grid of ``length`` but are clipped to ``[start, end)``,
+    so a span that starts off-grid (after a patient changes cadence) gets a
+    short first window instead of one that overlaps the previous run.
+
+    Everything else describes the ``span`` (default ``length``) of readings
+    ending with the window, so ``frame`` should start that far before the
+    first window; earlier rows only serve as history.
+
+    ``trends`` holds the ``trends`` statistics of every ``AVG_FIELDS`` vital,
+    computed for all windows in one pass. Means skip missing values, like
+    ``Avg`` does in SQL, and are ``None`` when a vital had no readings.
+    ``quality`` is the ECG signal-quality index (see ``signal_quality``),
+    also computed for all windows in one pass.
+    """
+    if frame.empty:
+        return
+    length = length or window_length()
+    span = span or length
+    timestamps = pd.to_datetime(frame['timestamp'], utc=True)
+    windows = timestamps.dt.floor(length).clip(lower=pd.Timestamp(start)).to_numpy('datetime64[ns]')
+    history = (timestamps < pd.Timestamp(start)).to_numpy()
+    patient_ids = frame['patient_id'].to_numpy()
+    seconds = timestamps.dt.as_unit('us').astype(np.int64).to_numpy() / 1e6
+
+    # Each patient/window pair is a contiguous run of the sorted frame
+    boundaries = np.ones(len(frame), dtype=bool)
+    boundaries[1:] = (
+        (patient_ids[1:] != patient_ids[:-1]) | (windows[1:] != windows[:-1]) | (history[1:] != history[:-1])
+    )
+    runs = np.flatnonzero(boundaries)
+    stops = np.append(runs[1:], len(frame))[~history[runs]]
+    firsts = runs[~history[runs]]
+    if not len(firsts):
+        return
+    patient_firsts = np.flatnonzero(np.append(True, patient_ids[1:] != patient_ids[:-1]))
+
+    # Each window's span reaches back into the patient's earlier rows
+    window_starts = [pd.Timestamp(windows[first]).tz_localize('UTC').to_pydatetime() for first in firsts]
+    window_ends = [min(align(window_start, length) + length, end) for window_start in window_starts]
+    lows = np.empty(len(firsts), dtype=int)
+    for window, (first, window_end) in enumerate(zip(firsts, window_ends)):
+        patient_first = patient_firsts[np.searchsorted(patient_firsts, first, side='right') - 1]
+        lows[window] = patient_first + np.searchsorted(
+            seconds[patient_first:first], (window_end - span).timestamp(),
+        )
+
+    # Spans may overlap, so stack each one's rows for the segmented reductions
+    sizes = stops - lows
+    starts = np.append(0, np.cumsum(sizes)[:-1])
+    rows = np.arange(sizes.sum()) + np.repeat(lows - starts, sizes)
+    trends = segment_trends(seconds[rows], frame[AVG_FIELDS].to_numpy(np.float64)[rows], starts)
+
+    ecg_column = frame['ecg'].to_numpy(np.float64)
+    heart_rate_column = frame['heart_rate'].to_numpy(np.float64)
+    quality = segment_quality(
+        ecg_column[rows],
+        frame[['accel_x', 'accel_y', 'accel_z']].to_numpy(np.float64)[rows],
+        (frame['motion_status'] == HIGH_ACTIVITY).to_numpy()[rows],
+        starts,
+        settings.ECG_MIN_SAMPLES,
+    )['quality']
+    for window, (low, stop) in enumerate(zip(lows, stops)):
+        ecg = ecg_column[low:stop]
+        ecg = ecg[~np.isnan(ecg) & (ecg != 0)]
+        heart_rates = heart_rate_column[low:stop]
+        heart_rates = heart_rates[~np.isnan(heart_rates) & (heart_rates != 0)]
+        yield (
+            int(patient_ids[stop - 1]), window_starts[window], window_ends[window],
+            window_trends(trends, window, AVG_FIELDS), float(quality[window]), ecg, heart_rates,
+        )
+
+
+def averages_from(trends):
+    return {f'avg_{field}': trend['mean'] for field, trend in trends.items()}
+
+
+def build_aggregates(patients, start, end, summarize=True, length=None):
+    """
+    Compute unsaved ``Aggregate`` rows for every window of ``[start, end)``
+    that has readings, each scored on the ``scoring_span`` ending with it.
+    All vitals needed are loaded in one query and every window is scored in
+    a single model call. HRV from the ECG is only computed for windows whose
+    signal quality reaches ``ECG_QUALITY_THRESHOLD``; the rest use the
+    heart-rate estimate.
+    """
+    by_id = {patient.id: patient for patient in patients}
+    length = length or window_length()
+    span = scoring_span(length)
+    with section("load vitals"):
+        # The first window's span starts this far back
+        frame = load_vitals_frame(align(start, length) + length - span, end, patient_ids=list(by_id))
+
+    windows = []
+    for patient_id, window_start, window_end, trends, quality, ecg, heart_rates in iter_windows(frame, start, end, length, span):
+        patient = by_id[patient_id]
+        averages = averages_from(trends)
+        with section(f"patient {patient_id}"):
+            usable = quality >= settings.ECG_QUALITY_THRESHOLD
+            hrv_value = compute_hrv(ecg if usable else ecg[:0], heart_rates, patient_id)
+            features = build_features(patient, averages, hrv_value)
+        windows.append((patient, window_start, window_end, trends, quality, averages, features))
+
+    with section("predict risk"):
+        predictions = predict_risk_batch([features for *_, features in windows])
+
+    # Summaries share one time budget; whatever doesn't fit gets a template
+    deadline = time.monotonic() + settings.SUMMARY_RUN_BUDGET_SECONDS
+    aggregates = []
+    for (patient, window_start, window_end, trends, quality, averages, _), (risk_level, confidence) in zip(windows, predictions):
+        summary = None
+        if summarize:
+            with section(f"patient {patient.id}"):
+                summary = generate_summary_for_patient(patient, risk_level, trends, span, deadline=deadline)
+        aggregates.append(Aggregate(
+            patient=patient,
+            start_time=window_start,
+            end_time=window_end,
+            avg_heart_rate=averages['avg_heart_rate'],
+            avg_spo2=averages['avg_spo2'],
+            avg_temperature=averages['avg_temperature'],
+            avg_accel_x=averages['avg_accel_x'],
+            avg_accel_y=averages['avg_accel_y'],
+            avg_accel_z=averages['avg_accel_z'],
+            risk_level=risk_level,
+            confidence=None if confidence is None else float(confidence),
+            signal_quality=quality,
+            summary=summary or "",
+        ))
+    return aggregates
+
+
+def compute_hrv(ecg_data, heart_rates, patient_id=None):
+    hrv_value = None
+    try:
+        if len(ecg_data):
+            signals, info = nk.ecg_process(ecg_data, sampling_rate=100)  # Adjust sampling_rate
+            r_peaks = info['ECG_R_Peaks']
+            if len(r_peaks) > 1:
+                hrv = nk.hrv(r_peaks, sampling_rate=100, show=False)
+                hrv_value = hrv['HRV_RMSSD'][0]  # RMSSD in ms
+    except Exception as e:
+        print(f"Error computing HRV for patient {patient_id}: {e}")
+    if not hrv_value:
+        hrv_value = estimate_hrv(heart_rates)
+    return hrv_value
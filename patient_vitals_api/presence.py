@@ -0,0 +1,106 @@
+# presence.py
+"""
+Device presence tracking.
+
+Uploads record a heartbeat in a Redis sorted set (device_id → epoch seconds)
+instead of writing ``Device.last_seen`` on every request. A periodic flush
+copies the heartbeats that changed since the last flush to Postgres in one
+batch, and a sweep reports devices that went quiet.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .models import Device
+from .redis_client import batch as redis_batch, get_redis
+
+LAST_SEEN_KEY = 'presence:last_seen'
+OFFLINE_KEY = 'presence:offline'
+FLUSHED_AT_KEY = 'presence:flushed_at'
+
+# Re-read a little before the previous flush so heartbeats that were stamped
+# just before it, but landed just after, are not missed
+FLUSH_OVERLAP_SECONDS = 5
+
+
+def to_datetime(score):
+    return datetime.fromtimestamp(float(score), tz=dt_timezone.utc)
+
+
+def record_heartbeat(device_id, batch=None):
+    """
+    Mark ``device_id`` as seen now, in ``batch`` when given (see
+    ``redis_client.batch``). Never fails the upload.
+    """
+    if not settings.DEVICE_PRESENCE_ENABLED:
+        return
+    if batch is None:
+        with redis_batch() as batch:
+            return record_heartbeat(device_id, batch)
+
+    def failed(e):
+        print(f"Error recording heartbeat for device {device_id}: {e}")
+
+    batch.queue('zadd', LAST_SEEN_KEY, {device_id: time.time()}, on_error=failed)
+    batch.queue('srem', OFFLINE_KEY, device_id)
+
+
+def flush_last_seen():
+    """Write heartbeats recorded since the previous flush to ``Device.last_seen``."""
+    client = get_redis()
+    flushed_at = float(client.get(FLUSHED_AT_KEY) or 0)
+    upto = time.time()
+    heartbeats = dict(client.zrangebyscore(
+        LAST_SEEN_KEY, flushed_at - FLUSH_OVERLAP_SECONDS, upto, withscores=True
+    ))
+
+    devices = list(Device.objects.filter(device_id__in=heartbeats))
+    for device in devices:
+        device.last_seen = to_datetime(heartbeats[device.device_id])
+    Device.objects.bulk_update(devices, ['last_seen'], batch_size=500)
+
+    client.set(FLUSHED_AT_KEY, upto)
+    return len(devices)
+
+
+def stale_heartbeats(offline_after=None):
+    """Map of device_id → last heartbeat for devices quiet for ``offline_after`` seconds."""
+    offline_after = settings.DEVICE_OFFLINE_AFTER_SECONDS if offline_after is None else offline_after
+    cutoff = time.time() - offline_after
+    stale = get_redis().zrangebyscore(LAST_SEEN_KEY, '-inf', cutoff, withscores=True)
+    return {device_id: to_datetime(score) for device_id, score in stale}
+
+
+def sweep_offline():
+    """Broadcast ``device_offline`` once for each device that has gone quiet."""
+    client = get_redis()
+    stale = stale_heartbeats()
+    if not stale:
+        return 0
+    already_reported = client.smembers(OFFLINE_KEY)
+    newly_offline = [device_id for device_id in stale if device_id not in already_reported]
+    if not newly_offline:
+        return 0
+    client.sadd(OFFLINE_KEY, *newly_offline)
+
+    channel_layer = get_channel_layer()
+    devices = Device.objects.filter(
+        device_id__in=newly_offline,
+        active=True,
+        assigned_to__isnull=False,
+    ).values_list('device_id', 'assigned_to_id')
+    for device_id, patient_id in devices:
+        async_to_sync(channel_layer.group_send)(
+            f'patient_{patient_id}',
+            {
+                'type': 'device.offline',
+                'data': {
+                    'device_id': device_id,
+                    'last_seen': stale[device_id].isoformat(),
+                },
+            }
+        )
+    return len(newly_offline)
@@ -0,0 +1,180 @@
+# profiling.py
+"""
+Opt-in profiling for uploads and Celery tasks.
+
+Nothing here runs unless ``PROFILING_ENABLED`` is set. When it is:
+
+* ``VitalsUploadView.post`` is profiled when a staff user sends the
+  ``X-Profile`` header, or anyone sends it set to ``PROFILING_SECRET``, and
+  for a random ``PROFILING_SAMPLE_RATE`` fraction of requests.
+* Tasks listed in ``PROFILING_TASKS`` are profiled from ``task_prerun`` to
+  ``task_postrun``; ``section()`` blocks inside them (one per patient in the
+  aggregation pipeline) add a wall-clock breakdown.
+
+Each profile writes ``<name>.pstats`` (cProfile, open with ``pstats`` or
+snakeviz), ``<name>.collapsed`` (wall-clock stack samples, one
+``frame;frame;frame count`` line per stack, ready for flamegraph.pl or
+speedscope) and, when sections were recorded, ``<name>.sections.json``, all
+in ``PROFILING_DIR``. Once that holds ``PROFILING_MAX_PROFILES`` profiles or
+``PROFILING_MAX_BYTES``, nothing more is profiled until it is cleared.
+"""
+import cProfile
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+
+_local = threading.local()
+_task_profiles = {}
+# Keeps names unique when profiles finish within the same second
+_sequence = count()
+
+
+class WallClockSampler(threading.Thread):
+    """Samples one thread's stack at a fixed interval, including time spent waiting."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit(os.sep, 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profile:
+    def __init__(self, label):
+        self.label = label
+        self.sections = defaultdict(float)
+        self.profiler = cProfile.Profile()
+        self.sampler = WallClockSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+
+    def start(self):
+        _local.profile = self
+        self.started = time.perf_counter()
+        self.sampler.start()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.sampler.stop()
+        self.elapsed = time.perf_counter() - self.started
+        _local.profile = None
+        return self.dump()
+
+    def dump(self):
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        name = (
+            f"{self.label}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_sequence)}"
+            f"-{int(self.elapsed * 1000)}ms"
+        )
+        base = os.path.join(settings.PROFILING_DIR, name)
+
+        self.profiler.dump_stats(f"{base}.pstats")
+        with open(f"{base}.collapsed", 'w') as collapsed:
+            for stack, samples in self.sampler.stacks.most_common():
+                collapsed.write(f"{stack} {samples}\n")
+        if self.sections:
+            with open(f"{base}.sections.json", 'w') as breakdown:
+                json.dump(
+                    dict(sorted(self.sections.items(), key=lambda item: item[1], reverse=True)),
+                    breakdown,
+                    indent=2,
+                )
+        return base
+
+
+def has_room():
+    """Whether ``PROFILING_DIR`` is below its profile count and size limits."""
+    try:
+        entries = [entry for entry in os.scandir(settings.PROFILING_DIR) if entry.is_file()]
+    except FileNotFoundError:
+        return True
+    profiles = sum(entry.name.endswith('.pstats') for entry in entries)
+    size = sum(entry.stat().st_size for entry in entries)
+    if profiles < settings.PROFILING_MAX_PROFILES and size < settings.PROFILING_MAX_BYTES:
+        return True
+    print(f"Not profiling: {settings.PROFILING_DIR} holds {profiles} profiles, {size} bytes")
+    return False
+
+
+def requested(request):
+    """An ``X-Profile`` header counts when it carries ``PROFILING_SECRET`` or comes from staff."""
+    value = request.META.get(settings.PROFILING_HEADER)
+    if value is None:
+        return False
+    if settings.PROFILING_SECRET and hmac.compare_digest(value.encode(), settings.PROFILING_SECRET.encode()):
+        return True
+    return request.user.is_staff
+
+
+@contextmanager
+def section(label):
+    """Add the wall time of this block to the active profile's breakdown."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[label] += time.perf_counter() - started
+
+
+def profile_view(view_method):
+    """Profile a view method on demand; a single settings check when disabled."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not settings.PROFILING_ENABLED or not (
+            requested(request) or random.random() < settings.PROFILING_SAMPLE_RATE
+        ) or not has_room():
+            return view_method(self, request, *args, **kwargs)
+
+        profile = Profile(f"{type(self).__name__}.{view_method.__name__}")
+        profile.start()
+        try:
+            return view_method(self, request, *args, **kwargs)
+        finally:
+            print(f"Profile written to {profile.stop()}")
+    return wrapper
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, task=None, **kwargs):
+    if not settings.PROFILING_ENABLED or task.name not in settings.PROFILING_TASKS or not has_room():
+        return
+    profile = Profile(task.name.rsplit('.', 1)[-1])
+    _task_profiles[task_id] = profile
+    profile.start()
+
+
+@task_postrun.connect
+def stop_task_profile(task_id=None, **kwargs):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is not None:
+        print(f"Profile written to {profile.stop()}")
@@ -0,0 +1,162 @@
+# ratelimit.py
+"""
+Admission control for vitals uploads.
+
+A single Lua script decides, in one Redis round trip and before the upload
+touches the database, whether a request may proceed:
+
+1. Devices in ``CRITICAL_DEVICES_KEY`` are always admitted.
+2. Each device has a token bucket refilled at ``INGEST_RATE_PER_SECOND`` up
+   to ``INGEST_BURST`` tokens; an empty bucket is rejected.
+3. All uploads share ``INGEST_MAX_CONCURRENCY`` in-flight slots; when they
+   are taken the request is shed. Slots are timestamped so a crashed request
+   frees its slot after ``INGEST_SLOT_TTL_SECONDS``.
+
+Rejections are counted in the metrics hash by the script itself. If Redis is
+unreachable uploads are admitted, since losing vitals is worse than losing
+the limiter.
+"""
+import time
+import uuid
+from collections.abc import Mapping
+from functools import wraps
+
+import redis
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+from .metrics import COUNTERS_KEY
+from .models import Device
+from .redis_client import get_redis
+
+CRITICAL_DEVICES_KEY = 'ratelimit:critical'
+BUCKET_KEY = 'ratelimit:bucket:{}'
+INFLIGHT_KEY = 'ratelimit:inflight'
+
+ADMITTED = 1
+RATE_LIMITED = 0
+SHED = -1
+
+ADMIT_SCRIPT = """
+local critical_key, bucket_key, inflight_key, counters_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local device_id = ARGV[1]
+local now = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local burst = tonumber(ARGV[4])
+local max_inflight = tonumber(ARGV[5])
+local slot_ttl = tonumber(ARGV[6])
+local slot = ARGV[7]
+
+if redis.call('SISMEMBER', critical_key, device_id) == 1 then
+    redis.call('HINCRBY', counters_key, 'ingest_exempt', 1)
+    return {1, 0, 0}
+end
+
+local state = redis.call('HMGET', bucket_key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+if tokens < 1 then
+    redis.call('HINCRBY', counters_key, 'ingest_rate_limited', 1)
+    return {0, math.ceil((1 - tokens) / rate * 1000), 0}
+end
+
+redis.call('ZREMRANGEBYSCORE', inflight_key, '-inf', now - slot_ttl)
+if redis.call('ZCARD', inflight_key) >= max_inflight then
+    redis.call('HINCRBY', counters_key, 'ingest_shed', 1)
+    return {-1, 1000, 0}
+end
+
+redis.call('ZADD', inflight_key, now, slot)
+redis.call('HSET', bucket_key, 'tokens', tokens - 1, 'ts', now)
+redis.call('EXPIRE', bucket_key, math.ceil(burst / rate) + 1)
+return {1, 0, 1}
+"""
+
+_admit_script = None
+
+
+def admit(device_id):
+    """
+    Returns ``(outcome, retry_after_seconds, slot)``. ``slot`` must be passed
+    to ``release`` when the request finishes; it is ``None`` when no slot was
+    taken.
+    """
+    global _admit_script
+    client = get_redis()
+    if _admit_script is None:
+        _admit_script = client.register_script(ADMIT_SCRIPT)
+
+    slot = uuid.uuid4().hex
+    outcome, retry_after_ms, took_slot = _admit_script(
+        keys=[CRITICAL_DEVICES_KEY, BUCKET_KEY.format(device_id), INFLIGHT_KEY, COUNTERS_KEY],
+        args=[
+            device_id,
+            time.time(),
+            settings.INGEST_RATE_PER_SECOND,
+            settings.INGEST_BURST,
+            settings.INGEST_MAX_CONCURRENCY,
+            settings.INGEST_SLOT_TTL_SECONDS,
+            slot,
+        ],
+    )
+    return int(outcome), int(retry_after_ms) / 1000, slot if took_slot else None
+
+
+def release(slot):
+    if slot is None:
+        return
+    try:
+        get_redis().zrem(INFLIGHT_KEY, slot)
+    except redis.RedisError as e:
+        print(f"Error releasing ingest slot: {e}")
+
+
+def admission_control(view_method):
+    """Reject uploads with 429 and ``Retry-After`` before the view runs."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        # A body that isn't a JSON object names no device; the serializer rejects it
+        if not settings.INGEST_RATE_LIMIT_ENABLED or not isinstance(request.data, Mapping):
+            return view_method(self, request, *args, **kwargs)
+
+        device_id = str(request.data.get('device_id', ''))
+        try:
+            outcome, retry_after, slot = admit(device_id)
+        except redis.RedisError as e:
+            print(f"Admission control unavailable, admitting upload: {e}")
+            outcome, retry_after, slot = ADMITTED, 0, None
+
+        if outcome == RATE_LIMITED:
+            raise Throttled(wait=retry_after, detail="Device is sending too fast.")
+        if outcome == SHED:
+            raise Throttled(wait=retry_after, detail="Server is busy, retry shortly.")
+
+        try:
+            return view_method(self, request, *args, **kwargs)
+        finally:
+            release(slot)
+    return wrapper
+
+
+def sync_critical_devices():
+    """Rebuild the exempt set from ``Device.priority``."""
+    device_ids = list(Device.objects.filter(priority='critical').values_list('device_id', flat=True))
+    pipe = get_redis().pipeline()
+    pipe.delete(CRITICAL_DEVICES_KEY)
+    if device_ids:
+        pipe.sadd(CRITICAL_DEVICES_KEY, *device_ids)
+    pipe.execute()
+    return len(device_ids)
+
+
+def update_critical_device(device, removed=False):
+    if not settings.INGEST_RATE_LIMIT_ENABLED:
+        return
+    try:
+        if device.priority == 'critical' and not removed:
+            get_redis().sadd(CRITICAL_DEVICES_KEY, device.device_id)
+        else:
+            get_redis().srem(CRITICAL_DEVICES_KEY, device.device_id)
+    except redis.RedisError as e:
+        print(f"Error updating critical device {device.device_id}: {e}")
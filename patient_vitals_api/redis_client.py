@@ -0,0 +1,199 @@
+# redis_client.py
+"""
+The one way to reach Redis (``REDIS_URL``) from application code.
+
+``get_redis()`` returns the process's client. It draws from a blocking
+connection pool of at most ``REDIS_MAX_CONNECTIONS``. When every
+connection is busy, a command waits up to ``REDIS_POOL_TIMEOUT`` for one and
+then fails with ``redis.ConnectionError``, like any other Redis outage, so
+callers keep failing open.
+
+``batch()`` queues commands from several places and sends them in one
+round trip. Each queued command gets a ``Reply`` to read after the batch
+runs, and one command's error doesn't fail the others.
+
+Every round trip and every wait for a pooled connection is timed. ``stats()``
+reports the totals for this process, and ``MetricsView`` includes them.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.round_trip_seconds = 0.0
+        self.slowest_round_trip = 0.0
+        self.checkouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def round_trip(self, seconds):
+        with self.lock:
+            self.round_trips += 1
+            self.round_trip_seconds += seconds
+            self.slowest_round_trip = max(self.slowest_round_trip, seconds)
+
+    def checkout(self, seconds, ok=True):
+        with self.lock:
+            self.checkout_wait_seconds += seconds
+            if not ok:
+                self.checkout_timeouts += 1
+                return
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def checkin(self):
+        with self.lock:
+            self.in_use -= 1
+
+    def snapshot(self, max_connections):
+        with self.lock:
+            return {
+                'round_trips': self.round_trips,
+                'mean_round_trip_ms': self.round_trip_seconds / self.round_trips * 1000 if self.round_trips else None,
+                'slowest_round_trip_ms': self.slowest_round_trip * 1000,
+                'checkouts': self.checkouts,
+                'mean_checkout_wait_ms': self.checkout_wait_seconds / self.checkouts * 1000 if self.checkouts else None,
+                'checkout_timeouts': self.checkout_timeouts,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'max_connections': max_connections,
+                'saturation': self.peak_in_use / max_connections,
+            }
+
+
+STATS = PoolStats()
+
+
+class InstrumentedPool(redis.BlockingConnectionPool):
+    def reset(self):
+        # Also runs in a forked child, which starts with no connections
+        super().reset()
+        with STATS.lock:
+            STATS.in_use = 0
+
+    def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.ConnectionError:
+            STATS.checkout(time.perf_counter() - started, ok=False)
+            raise
+        STATS.checkout(time.perf_counter() - started)
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        STATS.checkin()
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            STATS.round_trip(time.perf_counter() - started)
+
+
+class InstrumentedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            STATS.round_trip(time.perf_counter() - started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def pool_options():
+    return {
+        'max_connections': settings.REDIS_MAX_CONNECTIONS,
+        'timeout': settings.REDIS_POOL_TIMEOUT,
+        'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': settings.REDIS_SOCKET_TIMEOUT,
+        'health_check_interval': settings.REDIS_HEALTH_CHECK_INTERVAL,
+        'decode_responses': True,
+    }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Shared client for ``REDIS_URL``, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                pool = InstrumentedPool.from_url(settings.REDIS_URL, **pool_options())
+                _client = InstrumentedRedis(connection_pool=pool)
+    return _client
+
+
+class Reply:
+    def __init__(self, on_error=None):
+        self.value = None
+        self.error = None
+        self.on_error = on_error
+
+    def resolve(self, value):
+        if isinstance(value, Exception):
+            self.error = value
+            if self.on_error is not None:
+                self.on_error(value)
+        else:
+            self.value = value
+
+    def get(self):
+        """The command's result; raises its ``redis.RedisError`` if it failed."""
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Batch:
+    def __init__(self, client):
+        self.pipe = client.pipeline(transaction=False)
+        self.replies = []
+
+    def queue(self, command, *args, on_error=None, **kwargs):
+        """Queue ``client.<command>(*args, **kwargs)``; ``on_error`` is called with its error, if any."""
+        getattr(self.pipe, command)(*args, **kwargs)
+        reply = Reply(on_error)
+        self.replies.append(reply)
+        return reply
+
+    def execute(self):
+        if not self.replies:
+            return
+        try:
+            values = self.pipe.execute(raise_on_error=False)
+        except redis.RedisError as e:
+            values = [e] * len(self.replies)
+        for reply, value in zip(self.replies, values):
+            reply.resolve(value)
+
+
+@contextmanager
+def batch():
+    """Send every command queued in the block in one round trip when it ends."""
+    pending = Batch(get_redis())
+    yield pending
+    pending.execute()
+
+
+def stats():
+    return STATS.snapshot(settings.REDIS_MAX_CONNECTIONS)
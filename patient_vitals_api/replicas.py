@@ -0,0 +1,151 @@
+# replicas.py
+"""
+Read-replica routing.
+
+Reads go to the primary unless they run inside a ``read_scope()``:
+
+* ``ReplicaRoutingMiddleware`` opens one for every GET/HEAD/OPTIONS request,
+  which covers the dashboard, the offline-devices list and admin browsing.
+  Uploads and other writes stay on the primary.
+* ``aggregate_patients`` and ``backfill_aggregates`` open one around the
+  history scans of the aggregation pipeline.
+
+Inside a scope, the first write pins the rest of the scope to the primary,
+so code always reads what it just wrote. The middleware carries the pin over
+to the client's next requests with a short-lived cookie, so a redirect after
+an admin save doesn't show the old row.
+
+A replica is only used while its replication lag, measured at most every
+``REPLICA_LAG_CHECK_SECONDS``, is within ``REPLICA_MAX_LAG_SECONDS``, and
+while it is streaming from the primary. When no replica qualifies, or none
+is configured, reads fall back to the primary.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PIN_COOKIE = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# NULL when the replica isn't streaming from the primary: it has replayed
+# all it received, but that may be long ago. Otherwise zero when it has
+# replayed everything it received, so an idle primary doesn't look like lag.
+# Without pg_read_all_stats (or pg_monitor) the receiver's status reads as
+# NULL, so a running receiver is then taken to be streaming.
+LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (
+        SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming'
+    ) THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+_scope = ContextVar('replica_read_scope', default=None)
+_lag = {}
+
+
+class ReadScope:
+    def __init__(self, replica, pinned):
+        self.replica = replica
+        self.pinned = pinned
+        self.wrote = False
+
+
+@contextmanager
+def read_scope(replica=True, pinned=False):
+    """Let reads in this block use a replica, until the block writes."""
+    outer = _scope.get()
+    scope = ReadScope(replica, pinned or (outer is not None and outer.pinned))
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        if outer is not None and scope.wrote:
+            outer.pinned = outer.wrote = True
+
+
+def measure_lag(alias):
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_QUERY)
+            (lag,) = cursor.fetchone()
+    except DatabaseError as e:
+        print(f"Replica {alias} unavailable: {e}")
+        return float('inf')
+    if lag is None:
+        print(f"Replica {alias} is not streaming from the primary")
+        return float('inf')
+    return float(lag)
+
+
+def replica_lag(alias):
+    """Seconds ``alias`` is behind the primary, re-measured every ``REPLICA_LAG_CHECK_SECONDS``."""
+    checked_at, lag = _lag.get(alias, (None, None))
+    if checked_at is None or time.monotonic() - checked_at > settings.REPLICA_LAG_CHECK_SECONDS:
+        lag = measure_lag(alias)
+        _lag[alias] = (time.monotonic(), lag)
+        if settings.REPLICA_MAX_LAG_SECONDS < lag < float('inf'):
+            print(f"Replica {alias} is {lag:.1f}s behind; reading from the primary")
+    return lag
+
+
+def healthy_replicas():
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if replica_lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS
+    ]
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        scope = _scope.get()
+        if scope is None or not scope.replica or scope.pinned or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        scope = _scope.get()
+        if scope is not None:
+            scope.pinned = scope.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with read_scope(
+            replica=request.method in SAFE_METHODS,
+            pinned=PIN_COOKIE in request.COOKIES,
+        ) as scope:
+            response = self.get_response(request)
+        if scope.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,112 @@
+# risk_model.py
+"""
+The XGBoost risk model: feature building and batch scoring.
+
+Needs pandas, numpy, joblib, scikit-learn and xgboost but none of the ECG or
+LLM stack, so both the aggregation pipeline and the live scorer in web
+processes (see ``live_risk``) use it. Import it lazily outside workers.
+"""
+import os
+from functools import lru_cache
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+def estimate_hrv(heart_rates):
+    """Rough HRV from successive heart rates, for when there is no usable ECG."""
+    if len(heart_rates) > 1:
+        return np.std(np.diff(heart_rates)) * 1000 / 5
+    return None
+
+
+def build_features(patient, averages, hrv_value):
+    avg_systolic = averages['avg_systolic']
+    avg_diastolic = averages['avg_diastolic']
+
+    bmi = patient.weight / (patient.height ** 2)
+    vital_map = None
+    dpp = None
+    if avg_systolic is not None and avg_diastolic is not None:
+        vital_map = (avg_systolic + 2 * avg_diastolic) / 3
+        dpp = avg_systolic - avg_diastolic
+
+    gender_map = {'male': 0, 'female': 1}
+    gender_encoded = gender_map.get(patient.gender.lower(), 0)
+
+    return {
+        'Heart Rate': averages['avg_heart_rate'] or 0,
+        'Respiratory Rate': averages['avg_resp'] or 0,
+        'Body Temperature': averages['avg_temperature'] or 0,
+        'Oxygen Saturation': averages['avg_spo2'] or 0,
+        'Systolic Blood Pressure': avg_systolic or 0,
+        'Diastolic Blood Pressure': avg_diastolic or 0,
+        'Age': patient.age,
+        'Gender': gender_encoded,
+        'Weight (kg)': patient.weight,
+        'Height (m)': patient.height,
+        'Derived_HRV': hrv_value,
+        'Derived_Pulse_Pressure': dpp,
+        'Derived_BMI': bmi,
+        'Derived_MAP': vital_map,
+    }
+
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), 'ml_model', 'xgboost_model_without_original_risk.pkl')
+SCALER_PATH = os.path.join(os.path.dirname(__file__), 'ml_model', 'scaler_without_original_risk.pkl')
+
+FEATURE_COLUMNS = [
+    'Heart Rate',
+    'Respiratory Rate',
+    'Body Temperature',
+    'Oxygen Saturation',
+    'Systolic Blood Pressure',
+    'Diastolic Blood Pressure',
+    'Age',
+    'Gender',
+    'Weight (kg)',
+    'Height (m)',
+    'Derived_HRV',
+    'Derived_Pulse_Pressure',
+    'Derived_BMI',
+    'Derived_MAP',
+]
+
+RISK_MAPPING = {0: 'Low', 1: 'Moderate', 2: 'High'}
+
+
+@lru_cache(maxsize=1)
+def load_risk_model():
+    return joblib.load(MODEL_PATH), joblib.load(SCALER_PATH)
+
+
+def predict_risk_batch(features_list):
+    """Score many feature dicts with one scaler and one model call."""
+    if not features_list:
+        return []
+    risk_model, scaler = load_risk_model()
+
+    input_df = pd.DataFrame(features_list)[FEATURE_COLUMNS]
+    input_scaled = scaler.transform(input_df)
+
+    predictions = risk_model.predict(input_scaled)
+    probabilities = None
+    if hasattr(risk_model, 'predict_proba'):
+        probabilities = risk_model.predict_proba(input_scaled)
+
+    results = []
+    for row, prediction in enumerate(predictions):
+        prediction = int(prediction)
+        confidence = None
+        if probabilities is not None:
+            # Get the probability for the predicted class
+            confidence = probabilities[row][prediction]
+        results.append((RISK_MAPPING.get(prediction, 'Unknown'), confidence))
+    return results
+
+
+def predict_risk(features):
+    risk_level, confidence = predict_risk_batch([features])[0]
+    print("The model output: ", risk_level, confidence)
+    return risk_level, confidence
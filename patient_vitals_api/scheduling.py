@@ -0,0 +1,39 @@
+# scheduling.py
+"""
+Risk-adaptive re-evaluation cadence.
+
+Each patient is re-scored on a cadence picked from their latest risk level:
+High-risk patients every minute, stable Low-risk patients far less often.
+The cadence only sets how often; every score still covers at least
+``SCORING_WINDOW_SECONDS`` of readings (see ``aggregation.scoring_span``).
+Their evaluations also go to separate Celery queues with broker priorities,
+so a backlog of routine work can never delay a deteriorating patient.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+
+# Cadence used before a patient has been scored, or for unknown labels
+DEFAULT_TIER = 'Moderate'
+
+
+def tier_for(risk_level):
+    return risk_level if risk_level in settings.REEVALUATION_INTERVALS else DEFAULT_TIER
+
+
+def evaluation_interval(risk_level):
+    return timedelta(seconds=settings.REEVALUATION_INTERVALS[tier_for(risk_level)])
+
+
+def route_for(risk_level):
+    """Celery ``apply_async`` routing options for a patient's evaluation."""
+    tier = tier_for(risk_level)
+    return {
+        'queue': settings.REEVALUATION_QUEUES[tier],
+        'priority': settings.REEVALUATION_PRIORITIES[tier],
+    }
+
+
+def batch_size_for(risk_level):
+    # Critical patients are evaluated one per task so they run in parallel
+    return 1 if tier_for(risk_level) == 'High' else settings.REEVALUATION_BATCH_SIZE
@@ -17,9 +17,12 @@ class VitalsUploadSerializer(serializers.Serializer):
     diastolic = serializers.IntegerField(required=False)
     resp = serializers.IntegerField(required=False)
     motion_status = serializers.CharField(max_length=50, required=False)
+    # Per-device counter that only grows; a repeated value marks a retry
+    sequence = serializers.IntegerField(required=False, min_value=0)
+    device_timestamp = serializers.DateTimeField(required=False)
 
     def validate(self, data):
-        device = Device.objects.filter(device_id=data['device_id']).first()
+        device = Device.objects.select_related('assigned_to').filter(device_id=data['device_id']).first()
         if not device:
             raise serializers.ValidationError("Invalid device ID.")
         if not device.assigned_to:
@@ -42,4 +45,11 @@ class PatientDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
         fields = '__all__'
-    
\ No newline at end of file
+
+class OfflineDeviceSerializer(serializers.ModelSerializer):
+    patient_id = serializers.CharField(source='assigned_to.patient_id', default=None)
+    room = serializers.CharField(source='assigned_to.room', default=None)
+
+    class Meta:
+        model = Device
+        fields = ['device_id', 'assigned_to', 'patient_id', 'room', 'last_seen']
@@ -0,0 +1,100 @@
+# signal_quality.py
+"""
+ECG signal-quality index for many windows at once, so HRV (the most
+expensive step of aggregation) only runs on windows it can use.
+
+Like ``trends``, every check is a segmented NumPy reduction over the rows of
+all windows. Per window:
+
+* ``flatline``: fraction of consecutive ECG samples that don't change
+  (a detached lead or a stuck ADC)
+* ``clipping``: fraction of samples pinned at the window's minimum or
+  maximum (an amplifier at its rail)
+* ``kurtosis``: a clean ECG is peaky, well above a normal distribution's 3,
+  while noise and baseline wander are not
+* ``motion``: the larger of the accelerometer magnitude's variability and
+  the share of readings reported as high activity
+
+``quality`` combines them into one score from 0 (unusable) to 1. It is 0
+when a window has fewer than ``ECG_MIN_SAMPLES`` ECG samples.
+"""
+import numpy as np
+
+# Consecutive samples closer than this count as flat
+FLATLINE_EPSILON = 1e-6
+# Samples within this fraction of the window's range from either end are clipped
+CLIPPING_TOLERANCE = 0.01
+# Kurtosis at which the ECG counts as fully clean
+CLEAN_KURTOSIS = 5.0
+# Standard deviation of the acceleration magnitude (m/s²) that counts as full motion
+MOTION_STD_LIMIT = 2.0
+HIGH_ACTIVITY = 'High Activity'
+
+
+def segment_quality(ecg, accel, high_activity, starts, min_samples):
+    """
+    ``ecg`` is the ECG column (NaN or 0 for no sample), ``accel`` the
+    ``(rows, 3)`` accelerometer matrix and ``high_activity`` a boolean per
+    row, for windows starting at the ascending row offsets ``starts``.
+    Returns ``{stat: (windows,) array}``.
+    """
+    rows = len(ecg)
+    lengths = np.diff(np.append(starts, rows))
+
+    def per_window(array):
+        return np.add.reduceat(array, starts)
+
+    def per_row(array):
+        return np.repeat(array, lengths)
+
+    valid = ~np.isnan(ecg) & (ecg != 0)
+    samples = per_window(valid.astype(np.float64))
+    values = np.where(valid, ecg, 0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = per_window(values) / samples
+        centered = np.where(valid, ecg - per_row(mean), 0.0)
+        m2 = per_window(centered ** 2) / samples
+        m4 = per_window(centered ** 4) / samples
+        kurtosis = np.where(m2 > 0, m4 / m2 ** 2, 0.0)
+
+        # Pairs of consecutive samples within the same window
+        window_of_row = per_row(np.arange(len(starts)))
+        pairs = valid[1:] & valid[:-1] & (window_of_row[1:] == window_of_row[:-1])
+        flat = pairs & (np.abs(np.diff(values)) < FLATLINE_EPSILON)
+        pair_windows = window_of_row[1:]
+        pair_count = np.bincount(pair_windows, weights=pairs, minlength=len(starts))
+        flatline = np.where(pair_count > 0, np.bincount(pair_windows, weights=flat, minlength=len(starts)) / pair_count, 1.0)
+
+        low = np.minimum.reduceat(np.where(valid, ecg, np.inf), starts)
+        high = np.maximum.reduceat(np.where(valid, ecg, -np.inf), starts)
+        margin = per_row((high - low) * CLIPPING_TOLERANCE)
+        railed = valid & ((np.abs(ecg - per_row(low)) <= margin) | (np.abs(ecg - per_row(high)) <= margin))
+        clipping = np.where(samples > 0, per_window(railed.astype(np.float64)) / samples, 1.0)
+
+        magnitude = np.sqrt(np.sum(accel ** 2, axis=1))
+        moving = ~np.isnan(magnitude)
+        moving_count = per_window(moving.astype(np.float64))
+        magnitude_mean = per_window(np.where(moving, magnitude, 0.0)) / moving_count
+        magnitude_std = np.sqrt(per_window(np.where(moving, magnitude - per_row(magnitude_mean), 0.0) ** 2) / moving_count)
+        motion = np.maximum(
+            np.clip(np.nan_to_num(magnitude_std) / MOTION_STD_LIMIT, 0, 1),
+            per_window(high_activity.astype(np.float64)) / lengths,
+        )
+
+    quality = (
+        (1 - flatline)
+        * (1 - clipping)
+        * np.clip((kurtosis - 3) / (CLEAN_KURTOSIS - 3), 0, 1)
+        * (1 - motion)
+    )
+    quality = np.where(samples >= min_samples, quality, 0.0)
+
+    return {
+        'samples': samples,
+        'flatline': flatline,
+        'clipping': clipping,
+        'kurtosis': kurtosis,
+        'motion': motion,
+        'quality': quality,
+    }
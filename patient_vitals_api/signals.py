@@ -0,0 +1,30 @@
+# signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Aggregate, Device, Patient
+from .ratelimit import update_critical_device
+from .snapshots import refresh_snapshot
+
+
+@receiver(post_save, sender=Device)
+def device_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: update_critical_device(instance))
+
+
+@receiver(post_delete, sender=Device)
+def device_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: update_critical_device(instance, removed=True))
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: refresh_snapshot(instance.id))
+
+
+# No post_delete: any receiver stops Django from deleting aggregates in one
+# query. Code that deletes them calls refresh_snapshots once for the batch.
+@receiver(post_save, sender=Aggregate)
+def aggregate_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: refresh_snapshot(instance.patient_id))
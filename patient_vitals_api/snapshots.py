@@ -0,0 +1,115 @@
+# snapshots.py
+"""
+Pre-rendered patient snapshots.
+
+The parts of a live broadcast that only change when a ``Patient`` or an
+``Aggregate`` is saved (profile, aggregate history and the latest
+risk/confidence/summary) are encoded to JSON once, at save time, and kept in
+Redis. An upload then costs one GET plus encoding its own new readings, and
+the two JSON objects are spliced together instead of being re-serialized.
+"""
+import json
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Aggregate, Patient
+from .redis_client import get_redis
+from .serializers import AggregateSerializer, PatientDataSerializer
+
+SNAPSHOT_KEY = 'patient:{}:snapshot'
+AGGREGATE_HISTORY = 100
+
+
+def encode(data):
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+
+
+def build_snapshot(patient, aggregates=None):
+    # By window, newest first: a backfilled window gets a higher id than newer ones
+    if aggregates is None:
+        aggregates = list(Aggregate.objects.filter(patient=patient).order_by('-start_time')[:AGGREGATE_HISTORY])
+    latest = aggregates[0] if aggregates else None
+    return encode({
+        "confidence": (latest.confidence or 0) * 100 if latest else 0,
+        "risk_level": latest.risk_level if latest else "N/A",
+        "summary": latest.summary if latest else "",
+        "aggregates": AggregateSerializer(aggregates, many=True).data,
+        **PatientDataSerializer(patient).data,
+    })
+
+
+def refresh_snapshots(patient_ids):
+    """
+    Rebuild the snapshots of several patients with two queries and one Redis
+    round trip, however many patients there are.
+    """
+    if not settings.PATIENT_SNAPSHOT_CACHE_ENABLED or not patient_ids:
+        return
+    patient_ids = set(patient_ids)
+    patients = Patient.objects.filter(id__in=patient_ids)
+    history = defaultdict(list)
+    ranked = Aggregate.objects.filter(patient_id__in=patient_ids).annotate(
+        rank=Window(RowNumber(), partition_by=F('patient_id'), order_by=F('start_time').desc())
+    ).filter(rank__lte=AGGREGATE_HISTORY).order_by('patient_id', '-start_time')
+    for aggregate in ranked:
+        history[aggregate.patient_id].append(aggregate)
+
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for patient in patients:
+            patient_ids.discard(patient.id)
+            pipe.set(
+                SNAPSHOT_KEY.format(patient.id),
+                build_snapshot(patient, history[patient.id]),
+                ex=settings.PATIENT_SNAPSHOT_TTL_SECONDS,
+            )
+        # Whatever is left was deleted
+        for patient_id in patient_ids:
+            pipe.delete(SNAPSHOT_KEY.format(patient_id))
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error refreshing snapshots: {e}")
+
+
+def refresh_snapshot(patient_id):
+    refresh_snapshots([patient_id])
+
+
+def queue_snapshot(patient, batch):
+    """Read ``patient``'s cached snapshot in ``batch``; pass the reply to ``get_snapshot``."""
+    if not settings.PATIENT_SNAPSHOT_CACHE_ENABLED:
+        return None
+    return batch.queue('get', SNAPSHOT_KEY.format(patient.id))
+
+
+def get_snapshot(patient, cached=None):
+    """
+    Encoded snapshot for ``patient``, rebuilt and cached on a miss. ``cached``
+    is the reply from ``queue_snapshot`` when the read was batched.
+    """
+    if not settings.PATIENT_SNAPSHOT_CACHE_ENABLED:
+        return build_snapshot(patient)
+    key = SNAPSHOT_KEY.format(patient.id)
+    try:
+        snapshot = get_redis().get(key) if cached is None else cached.get()
+    except redis.RedisError as e:
+        print(f"Error reading snapshot for patient {patient.id}: {e}")
+        return build_snapshot(patient)
+    if snapshot is None:
+        snapshot = build_snapshot(patient)
+        try:
+            get_redis().set(key, snapshot, ex=settings.PATIENT_SNAPSHOT_TTL_SECONDS)
+        except redis.RedisError:
+            pass
+    return snapshot
+
+
+def merge(*encoded):
+    """Splice JSON objects into one, without decoding them."""
+    members = [fragment[1:-1] for fragment in encoded if fragment not in ('{}', '')]
+    return '{' + ', '.join(members) + '}'
@@ -0,0 +1,229 @@
+# summarizer.py
+"""
+Window summaries: an LLM summary when OpenAI is healthy, a deterministic
+template otherwise.
+
+Every OpenAI call has a hard deadline, ``SUMMARY_TIMEOUT_SECONDS``, with no
+SDK retries. A run also has ``SUMMARY_RUN_BUDGET_SECONDS`` for all of its
+windows, and once that is spent the remaining windows get templates.
+
+A process-wide circuit breaker watches the last ``SUMMARY_BREAKER_WINDOW``
+calls. A call is bad when it fails, times out, or takes longer than
+``SUMMARY_SLOW_CALL_SECONDS``. When at least ``SUMMARY_BREAKER_FAILURE_RATE``
+of the calls are bad, the breaker opens. While it is open, summaries come
+from the template. After ``SUMMARY_BREAKER_COOLDOWN_SECONDS`` a single trial
+call decides whether it closes again.
+
+Template summaries start with ``TEMPLATE_TAG``, so they can be told apart
+(and regenerated) later.
+
+Both kinds of summary are built from the window's ``trends`` (see
+``pipeline.iter_windows``). Neither touches the database, so a slow LLM
+costs at most the run budget and never holds up risk scoring.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+
+from django.conf import settings
+from openai import OpenAI
+
+from . import metrics
+
+TEMPLATE_TAG = '[template] '
+
+SYSTEM_PROMPT = (
+    "You are a medical assistant. Write a brief, straight-to-the-point summary of patient vitals in the form of a single paragraph. "
+    "Focus only on changes and trends over the last period of time. "
+    "Avoid bullet points or lists and keep the response concise. The word count should be under 30 words."
+)
+
+# Vitals described in summaries: (field, label, unit, change worth mentioning)
+SUMMARY_VITALS = [
+    ('heart_rate', 'Heart Rate', ' bpm', 5),
+    ('systolic', 'Systolic BP', ' mmHg', 10),
+    ('diastolic', 'Diastolic BP', ' mmHg', 5),
+    ('spo2', 'SpO₂', '%', 2),
+    ('temperature', 'Temperature', '°F', 0.5),
+    ('resp', 'Respiratory Rate', '/min', 3),
+]
+
+
+def has_trend(trends):
+    return max(trend['count'] for trend in trends.values()) >= 2
+
+
+def describe_trend(label, unit, trend):
+    if not trend['count']:
+        return f"- {label}: no readings"
+    line = f"- {label}: {trend['first']:.1f}{unit} → {trend['last']:.1f}{unit} ({trend['delta']:+.1f})"
+    if trend['slope'] is not None:
+        line += f", trend {trend['slope']:+.2f}/min"
+    line += f", variability ±{trend['std']:.1f}"
+    if trend['missing']:
+        line += f", {trend['missing']:.0%} of readings missing"
+    return line
+
+
+def build_summary_prompt(patient, trends, period):
+    """The LLM prompt for one window, or ``None`` with too few readings for a trend."""
+    if not has_trend(trends):
+        return None
+    minutes = round(period.total_seconds() / 60)
+    trend = "\n".join(
+        describe_trend(label, unit, trends[field])
+        for field, label, unit, _ in SUMMARY_VITALS
+    )
+    bio = f"Patient is a {patient.age}-year-old {patient.gender.lower()} weighing {patient.weight}kg and {patient.height}m tall."
+    return f"""
+    {bio}
+
+    Based on the following vital signs trend, give a concise medical-style summary of the patient's current condition and advice for next steps. Be professional and informative.
+
+    The patient's vital sign changes over the last {minutes} minutes are:
+{trend}
+    """
+
+
+def template_summary(risk_level, trends, period):
+    """A deterministic summary from the same trends, tagged with ``TEMPLATE_TAG``."""
+    if not has_trend(trends):
+        return None
+    minutes = round(period.total_seconds() / 60)
+    changes = []
+    missing = []
+    for field, label, unit, threshold in SUMMARY_VITALS:
+        trend = trends[field]
+        if not trend['count']:
+            missing.append(label)
+        elif abs(trend['delta']) >= threshold:
+            direction = 'rising' if trend['delta'] > 0 else 'falling'
+            changes.append(f"{label} {direction} {trend['first']:.0f}→{trend['last']:.0f}{unit}")
+        else:
+            changes.append(f"{label} stable at {trend['mean']:.0f}{unit}")
+    text = f"{risk_level} risk over the last {minutes} min. " + "; ".join(changes) + "."
+    if missing:
+        text += f" No readings for {', '.join(missing)}."
+    return TEMPLATE_TAG + text
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, window, failure_rate, slow_call_seconds, cooldown_seconds, min_calls=5):
+        self.calls = deque(maxlen=window)
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.min_calls = min(min_calls, window)
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record(self, ok, seconds):
+        bad = not ok or seconds > self.slow_call_seconds
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if bad:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self.calls.clear()
+                    print("Summary circuit breaker closed")
+                return
+            self.calls.append(bad)
+            if (
+                self.state == self.CLOSED
+                and len(self.calls) >= self.min_calls
+                and sum(self.calls) / len(self.calls) >= self.failure_rate
+            ):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trial_running = False
+        print(f"Summary circuit breaker open for {self.cooldown_seconds}s")
+        metrics.incr('summary_breaker_opened')
+
+
+@lru_cache(maxsize=1)
+def breaker():
+    return CircuitBreaker(
+        window=settings.SUMMARY_BREAKER_WINDOW,
+        failure_rate=settings.SUMMARY_BREAKER_FAILURE_RATE,
+        slow_call_seconds=settings.SUMMARY_SLOW_CALL_SECONDS,
+        cooldown_seconds=settings.SUMMARY_BREAKER_COOLDOWN_SECONDS,
+    )
+
+
+@lru_cache(maxsize=1)
+def openai_client():
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+
+@lru_cache(maxsize=1)
+def executor():
+    # Calls that overrun the deadline finish here without blocking the run
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix='summary')
+
+
+def request_summary(prompt, timeout):
+    response = openai_client().with_options(timeout=timeout).chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=100,
+        temperature=0.5
+    )
+    return response.choices[0].message.content.strip()
+
+
+def generate_summary_for_patient(patient, risk_level, trends, period, deadline=None):
+    """
+    Summarize one window from its ``trends``, which cover ``period`` of
+    readings. Falls back to ``template_summary`` when the breaker is open,
+    the call fails or overruns, or ``deadline`` (a ``time.monotonic()``
+    value) leaves no time for a call.
+    """
+    full_prompt = build_summary_prompt(patient, trends, period)
+    if full_prompt is None:
+        return  # Not enough data to compute trends
+
+    timeout = settings.SUMMARY_TIMEOUT_SECONDS
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+    if timeout <= 0 or not breaker().allow():
+        return template_summary(risk_level, trends, period)
+
+    started = time.monotonic()
+    try:
+        summary = executor().submit(request_summary, full_prompt, timeout).result(timeout=timeout)
+    except TimeoutError:
+        print(f"Summary for patient {patient.id} timed out after {timeout:.1f}s")
+        breaker().record(False, time.monotonic() - started)
+        return template_summary(risk_level, trends, period)
+    except Exception as e:
+        print(f"Error generating summary for patient {patient.id}: {e}")
+        breaker().record(False, time.monotonic() - started)
+        return template_summary(risk_level, trends, period)
+    breaker().record(True, time.monotonic() - started)
+    return summary
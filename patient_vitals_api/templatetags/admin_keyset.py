@@ -0,0 +1,59 @@
+# admin_keyset.py
+from datetime import date
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.db.models import Max, Min
+from django.utils import timezone
+
+register = template.Library()
+
+
+class PeriodQuerySet:
+    """
+    Stands in for ``cl.queryset`` in Django's ``date_hierarchy``: the
+    years/months/days offered are every period between the first and last
+    row, found with two index lookups, rather than a DISTINCT over all rows.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def aggregate(self, **kwargs):
+        return self.queryset.aggregate(**kwargs)
+
+    def datetimes(self, field_name, kind):
+        bounds = self.queryset.order_by().aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        first, last = (
+            timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+            for value in (bounds['first'], bounds['last'])
+        )
+        periods = []
+        current = first.replace(month=1, day=1) if kind == 'year' else first.replace(day=1) if kind == 'month' else first
+        while current <= last:
+            periods.append(current)
+            if kind == 'year':
+                current = current.replace(year=current.year + 1)
+            elif kind == 'month':
+                current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+            else:
+                current = date.fromordinal(current.toordinal() + 1)
+        return periods
+
+    dates = datetimes
+
+
+class PeriodChangeList:
+    def __init__(self, cl):
+        self._cl = cl
+        self.queryset = PeriodQuerySet(cl.queryset)
+
+    def __getattr__(self, name):
+        return getattr(self._cl, name)
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def indexed_date_hierarchy(cl):
+    return date_hierarchy(PeriodChangeList(cl))
@@ -1,3 +1,1212 @@
-from django.test import TestCase
+"""
+Performance regression suite.
 
-# Create your tests here.
+Query-count budgets guard against N+1 regressions in the hot paths: each is
+measured at two population sizes and must not grow with the number of
+patients. Timing benchmarks compare against ``perf_baselines.json`` (one
+entry per database vendor); record new baselines with
+
+    UPDATE_PERF_BASELINES=1 python manage.py test patient_vitals_api
+
+Everything runs offline: the OpenAI client is stubbed, the channel layer is
+in-memory and the Redis-backed features are switched off.
+"""
+import io
+import json
+import os
+import random
+import runpy
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+import fakeredis
+import numpy
+import pandas
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import (
+    archive, db_pool, downsampling, live_risk, metrics, pipeline, presence, profiling, ratelimit, redis_client, replicas, signal_quality,
+    snapshots, summarizer, tasks, trends,
+)
+from .aggregation import last_closed_boundary
+from .management.commands import backfill_aggregates, generate_population
+from .management.commands.generate_population import explicit_timestamps
+from .models import Aggregate, AggregationWatermark, Device, Patient, Vital
+from .scheduling import evaluation_interval, route_for
+
+BASELINES_PATH = Path(__file__).with_name('perf_baselines.json')
+# Allowed slowdown over the stored baseline before a benchmark fails
+PERF_TOLERANCE = float(os.environ.get('PERF_TOLERANCE', 3.0))
+
+UPLOAD_QUERY_BUDGET = 6
+PATIENT_LIST_QUERY_BUDGET = 1
+DISPATCH_QUERY_BUDGET = 3
+AGGREGATION_QUERY_BUDGET = 5
+# Postgres adds the row estimate that decides whether to count exactly
+ADMIN_CHANGELIST_QUERY_BUDGET = 7
+
+OFFLINE_SETTINGS = dict(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    INGEST_RATE_LIMIT_ENABLED=False,
+    PATIENT_SNAPSHOT_CACHE_ENABLED=False,
+    DEVICE_PRESENCE_ENABLED=False,
+    PROFILING_ENABLED=False,
+    LIVE_RISK_ENABLED=False,
+    UPLOAD_DEDUPE_ENABLED=False,
+)
+
+
+@contextmanager
+def stub_llm():
+    """Replace only the OpenAI client; prompts are still built from real data."""
+    client = mock.Mock()
+    client.with_options.return_value.chat.completions.create.return_value.choices = [
+        mock.Mock(message=mock.Mock(content="Stub summary."))
+    ]
+    breaker = summarizer.CircuitBreaker(window=20, failure_rate=0.5, slow_call_seconds=5, cooldown_seconds=60)
+    with mock.patch.object(summarizer, 'openai_client', return_value=client), \
+            mock.patch.object(summarizer, 'breaker', return_value=breaker):
+        yield
+
+
+def make_population(patients, vitals_per_patient, end=None, interval=timedelta(seconds=2), seed=0):
+    """
+    Create ``patients`` patients, each with an assigned device and
+    ``vitals_per_patient`` readings spaced ``interval`` apart, ending at
+    ``end``. Readings are drawn from a seeded generator so runs are repeatable.
+    """
+    rng = random.Random(seed)
+    end = end or timezone.now()
+    offset = Patient.objects.count()
+    Patient.objects.bulk_create([
+        Patient(
+            patient_id=f"PT-TEST-{offset + index:05d}",
+            name=f"Test Patient {offset + index}",
+            age=rng.randint(20, 90),
+            room=f"ICU-{index % 40}",
+            weight=rng.uniform(50, 110),
+            height=rng.uniform(1.5, 1.95),
+            gender=rng.choice(['Male', 'Female']),
+            condition="Synthetic load",
+        )
+        for index in range(patients)
+    ])
+    # Not every backend returns primary keys from bulk_create
+    created = list(Patient.objects.order_by('-id')[:patients])[::-1]
+    Device.objects.bulk_create([
+        Device(device_id=f"ESP-TEST-{patient.patient_id}", assigned_to=patient)
+        for patient in created
+    ])
+    devices = {device.assigned_to_id: device for device in Device.objects.filter(assigned_to__in=created)}
+
+    vitals = []
+    for patient in created:
+        device = devices[patient.id]
+        for step in range(vitals_per_patient):
+            vitals.append(Vital(
+                patient=patient,
+                device=device,
+                timestamp=end - interval * (vitals_per_patient - step),
+                heart_rate=rng.randint(60, 100),
+                spo2=rng.randint(94, 100),
+                temperature=rng.uniform(97, 99),
+                ecg=rng.uniform(-0.2, 0.2),
+                accel_x=rng.uniform(-1, 1),
+                accel_y=rng.uniform(-1, 1),
+                accel_z=rng.uniform(9, 10),
+                systolic=rng.randint(110, 130),
+                diastolic=rng.randint(70, 85),
+                resp=rng.randint(14, 20),
+                motion_status=rng.choice(['Normal Activity', 'Low Activity', 'High Activity']),
+            ))
+    with explicit_timestamps():
+        Vital.objects.bulk_create(vitals, batch_size=1000)
+    return created
+
+
+def upload_payload(device_id):
+    return {
+        'device_id': device_id,
+        'heart_rate': 72,
+        'spo2': 98,
+        'temperature': 98.2,
+        'ecg': 0.1,
+        'accel_x': 0.1,
+        'accel_y': -0.2,
+        'accel_z': 9.8,
+        'systolic': 120,
+        'diastolic': 80,
+        'resp': 16,
+        'motion_status': 'Normal Activity',
+    }
+
+
+def inherited_pool_count():
+    """Pools a process pool worker sees; module level so it pickles."""
+    return len(getattr(type(connections['default']), '_connection_pools', None) or {})
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class QueryBudgetTests(TestCase):
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(context.captured_queries)
+
+    def upload_queries(self):
+        device = Device.objects.order_by('id').first()
+        return self.count_queries(lambda: self.assertEqual(
+            self.client.post(
+                '/api/vitals/upload/',
+                data=json.dumps(upload_payload(device.device_id)),
+                content_type='application/json',
+            ).status_code,
+            201,
+        ))
+
+    def test_upload_queries_do_not_grow_with_population(self):
+        make_population(2, 20)
+        small = self.upload_queries()
+        make_population(20, 20)
+        large = self.upload_queries()
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, UPLOAD_QUERY_BUDGET)
+
+    def test_patient_list_queries_do_not_grow_with_population(self):
+        make_population(2, 1)
+        small = self.count_queries(lambda: self.client.get('/api/patients/'))
+        make_population(20, 1)
+        large = self.count_queries(lambda: self.client.get('/api/patients/'))
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, PATIENT_LIST_QUERY_BUDGET)
+
+    def test_dispatch_queries_do_not_grow_with_population(self):
+        with mock.patch.object(tasks.aggregate_patients, 'apply_async'):
+            make_population(2, 1)
+            small = self.count_queries(tasks.aggregate_vitals)
+            AggregationWatermark.objects.all().delete()
+            make_population(20, 1)
+            large = self.count_queries(tasks.aggregate_vitals)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, DISPATCH_QUERY_BUDGET)
+
+    def aggregation_queries(self, patients):
+        # Readings covering the patients' next window
+        length = evaluation_interval('')
+        end = last_closed_boundary()
+        ids = [patient.id for patient in patients]
+        AggregationWatermark.objects.bulk_create([
+            AggregationWatermark(patient_id=patient_id, window_end=end - length) for patient_id in ids
+        ])
+        with stub_llm():
+            return self.count_queries(lambda: tasks.aggregate_patients(ids))
+
+    def test_aggregation_queries_do_not_grow_with_population(self):
+        end = last_closed_boundary()
+        small = self.aggregation_queries(make_population(2, 60, end=end))
+        large = self.aggregation_queries(make_population(20, 60, end=end))
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, AGGREGATION_QUERY_BUDGET)
+        self.assertEqual(Aggregate.objects.filter(summary="Stub summary.").count(), 22)
+
+    def test_backfill_deletes_do_not_grow_with_aggregates(self):
+        patient = make_population(1, 1)[0]
+        end = last_closed_boundary()
+
+        def replace(windows):
+            Aggregate.objects.bulk_create([
+                Aggregate(patient=patient, start_time=end - timedelta(minutes=5 * step),
+                          end_time=end - timedelta(minutes=5 * (step - 1)), summary='')
+                for step in range(1, windows + 1)
+            ])
+            with mock.patch.object(backfill_aggregates, 'build_aggregates', return_value=[]), \
+                    self.captureOnCommitCallbacks() as callbacks:
+                queries = self.count_queries(
+                    lambda: backfill_aggregates.backfill_chunk(end - timedelta(days=1), end, [patient.id], False)
+                )
+            self.assertEqual(callbacks, [])
+            return queries
+
+        self.assertEqual(replace(6), replace(60))
+        self.assertFalse(Aggregate.objects.exists())
+
+    def test_retried_upload_is_stored_once(self):
+        make_population(1, 0)
+        device = Device.objects.get()
+        payload = json.dumps({**upload_payload(device.device_id), 'sequence': 41, 'device_timestamp': '2025-01-01T00:00:00Z'})
+
+        def upload():
+            return self.client.post('/api/vitals/upload/', data=payload, content_type='application/json')
+
+        self.assertEqual(upload().status_code, 201)
+        with mock.patch('patient_vitals_api.views.get_channel_layer') as channel_layer:
+            self.assertEqual(self.count_queries(lambda: self.assertEqual(upload().json()['status'], 'duplicate')), 2)
+        channel_layer.assert_not_called()
+        # Redis says the sequence is new, the unique constraint still catches it
+        with override_settings(UPLOAD_DEDUPE_ENABLED=True), \
+                mock.patch('patient_vitals_api.dedupe.get_redis') as get_redis:
+            get_redis.return_value.zadd.return_value = 1
+            self.assertEqual(upload().json()['status'], 'duplicate')
+        self.assertEqual(Vital.objects.filter(device=device).count(), 1)
+
+    def test_vital_admin_queries_do_not_grow_with_population(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        url = '/admin/patient_vitals_api/vital/'
+        make_population(2, 40)
+        small = self.count_queries(lambda: self.assertEqual(self.client.get(url).status_code, 200))
+        make_population(20, 40)
+        large = self.count_queries(lambda: self.assertEqual(self.client.get(url).status_code, 200))
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, ADMIN_CHANGELIST_QUERY_BUDGET)
+
+    def page_through_vital_admin(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            cl = response.context['cl']
+            seen += [vital.pk for vital in cl.result_list]
+            url = cl.next_page_query and '/admin/patient_vitals_api/vital/' + cl.next_page_query
+        return seen
+
+    def test_vital_admin_pages_by_keyset(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        make_population(3, 40)
+        seen = self.page_through_vital_admin('/admin/patient_vitals_api/vital/')
+        self.assertEqual(seen, list(Vital.objects.order_by('-timestamp', '-pk').values_list('pk', flat=True)))
+
+    def test_vital_admin_searches_one_patient(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        patient = make_population(3, 120)[1]
+        seen = self.page_through_vital_admin(f'/admin/patient_vitals_api/vital/?q={patient.patient_id}')
+        vitals = Vital.objects.filter(patient=patient).order_by('-timestamp', '-pk')
+        self.assertEqual(seen, list(vitals.values_list('pk', flat=True)))
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class LatencyBenchmarks(TestCase):
+    """Median wall time of the hot paths against stored baselines."""
+
+    repeat = 5
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+        cls.measured = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.environ.get('UPDATE_PERF_BASELINES') and cls.measured:
+            cls.baselines.setdefault(connection.vendor, {}).update(cls.measured)
+            BASELINES_PATH.write_text(json.dumps(cls.baselines, indent=2, sort_keys=True) + '\n')
+        super().tearDownClass()
+
+    def benchmark(self, name, func):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        median = sorted(timings)[len(timings) // 2]
+        self.measured[name] = round(median, 6)
+
+        baseline = self.baselines.get(connection.vendor, {}).get(name)
+        if baseline is None:
+            self.skipTest(f"No {connection.vendor} baseline for {name}; record one with UPDATE_PERF_BASELINES=1")
+        self.assertLessEqual(
+            median, baseline * PERF_TOLERANCE,
+            f"{name} took {median * 1000:.1f} ms, baseline {baseline * 1000:.1f} ms",
+        )
+
+    def test_upload_latency(self):
+        make_population(50, 100)
+        device = Device.objects.order_by('id').first()
+        payload = json.dumps(upload_payload(device.device_id))
+        self.benchmark('upload', lambda: self.client.post(
+            '/api/vitals/upload/', data=payload, content_type='application/json',
+        ))
+
+    def test_patient_list_latency(self):
+        make_population(200, 1)
+        self.benchmark('patient_list', lambda: self.client.get('/api/patients/'))
+
+    def test_aggregation_latency(self):
+        end = last_closed_boundary()
+        patients = make_population(50, 150, end=end)
+        ids = [patient.id for patient in patients]
+
+        def run():
+            AggregationWatermark.objects.all().delete()
+            tasks.aggregate_patients(ids)
+
+        with stub_llm():
+            self.benchmark('aggregation', run)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0', 'replica_1'], REPLICA_MAX_LAG_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    # setUp replaces it with fixed lags
+    measure_lag = staticmethod(replicas.measure_lag)
+
+    def setUp(self):
+        self.lags = {'replica_0': 0.0, 'replica_1': 0.0}
+        patches = [
+            mock.patch.object(replicas, '_lag', {}),
+            mock.patch.object(replicas, 'measure_lag', lambda alias: self.lags[alias]),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_reads_use_primary_outside_a_scope(self):
+        self.assertEqual(router.db_for_read(Vital), 'default')
+
+    def test_reads_in_scope_use_a_replica_until_a_write(self):
+        with replicas.read_scope():
+            self.assertIn(router.db_for_read(Vital), ['replica_0', 'replica_1'])
+            self.assertEqual(router.db_for_write(Vital), 'default')
+            self.assertEqual(router.db_for_read(Vital), 'default')
+        with replicas.read_scope():
+            self.assertNotEqual(router.db_for_read(Vital), 'default')
+
+    def test_lagging_replicas_are_skipped(self):
+        self.lags['replica_0'] = 30.0
+        with replicas.read_scope():
+            self.assertEqual(router.db_for_read(Vital), 'replica_1')
+            replicas._lag.clear()
+            self.lags['replica_1'] = float('inf')
+            self.assertEqual(router.db_for_read(Vital), 'default')
+
+    def test_replica_not_streaming_counts_as_unavailable(self):
+        replica = mock.MagicMock(vendor='postgresql')
+        replica.cursor.return_value.__enter__.return_value.fetchone.return_value = (None,)
+        with mock.patch.object(replicas, 'connections', {'replica_0': replica}):
+            self.assertEqual(self.measure_lag('replica_0'), float('inf'))
+
+    def test_middleware_pins_the_client_after_a_write(self):
+        factory = RequestFactory()
+        middleware = replicas.ReplicaRoutingMiddleware(lambda request: (
+            router.db_for_write(Vital) if request.method == 'POST' else None,
+            HttpResponse(router.db_for_read(Vital)),
+        )[1])
+
+        self.assertNotEqual(middleware(factory.get('/api/patients/')).content, b'default')
+        response = middleware(factory.post('/api/vitals/upload/'))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+
+        factory.cookies[replicas.PIN_COOKIE] = '1'
+        self.assertEqual(middleware(factory.get('/api/patients/')).content, b'default')
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class ArchiveTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(VITALS_ARCHIVE_DIR=directory.name, VITALS_ARCHIVE_AFTER_DAYS=30)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.end = last_closed_boundary(timezone.now() - timedelta(days=40))
+        self.start = self.end - timedelta(days=2)
+        self.patients = make_population(3, 1000, end=self.end, interval=timedelta(minutes=1))
+        # Missing readings must survive the round trip
+        Vital.objects.filter(id__in=Vital.objects.values('id')[:10]).update(heart_rate=None, motion_status=None)
+        # Only some devices send upload counters and their own clock
+        Vital.objects.filter(id__in=Vital.objects.values('id')[:1500]).update(
+            sequence=F('id'), device_timestamp=F('timestamp') - timedelta(seconds=3),
+        )
+
+    def assert_round_trip(self):
+        before = archive.load_history(self.start, self.end)
+        self.assertEqual(before['sequence'].notna().sum(), 1500)
+        self.assertEqual(before['device_timestamp'].notna().sum(), 1500)
+        self.assertEqual(archive.archive_closed_days(), len(before))
+        self.assertFalse(Vital.objects.exists())
+        self.assertTrue(before.equals(archive.load_history(self.start, self.end)))
+
+    @override_settings(VITALS_ARCHIVE_COMPRESS=True)
+    def test_compressed_archive_reads_back_unchanged(self):
+        self.assert_round_trip()
+
+    def test_archive_is_memory_mapped_by_default(self):
+        self.assert_round_trip()
+        _, path = archive.archived_days(self.start, self.end)[0]
+        self.assertIsInstance(archive.read_day(path)['ecg'], numpy.memmap)
+
+    def test_days_archived_without_upload_counters_still_load(self):
+        archive.archive_closed_days()
+        _, path = archive.archived_days(self.start, self.end)[0]
+        arrays = archive.read_day(path)
+        dropped = numpy.isfinite(arrays.pop('sequence')).sum()
+        del arrays['device_timestamp']
+        archive.write_day(path, arrays)
+        history = archive.load_history(self.start, self.end)
+        self.assertEqual(len(history), 3000)
+        self.assertEqual(history['sequence'].notna().sum(), 1500 - dropped)
+        self.assertEqual(history['device_timestamp'].notna().sum(), 1500 - dropped)
+
+    def test_late_rows_are_merged_into_the_archived_day(self):
+        archive.archive_closed_days()
+        patient = self.patients[0]
+        late = Vital.objects.create(patient=patient, device=patient.devices.get(), heart_rate=77)
+        Vital.objects.filter(id=late.id).update(timestamp=self.end - timedelta(seconds=30))
+
+        archive.archive_closed_days()
+        history = archive.load_history(self.start, self.end, patient_ids=[patient.id])
+        self.assertEqual(len(history), 1001)
+        self.assertIn(late.id, history['id'].tolist())
+
+    def test_aggregation_reads_archived_vitals(self):
+        archive.archive_closed_days()
+        with stub_llm():
+            aggregates = pipeline.build_aggregates(self.patients, self.end - timedelta(hours=1), self.end)
+        self.assertEqual(len(aggregates), 3 * 12)
+
+
+class SchedulingTests(SimpleTestCase):
+    def test_plain_worker_consumes_every_evaluation_queue(self):
+        from patient_vitals_backend.celery import app
+
+        routed = {route_for(tier)['queue'] for tier in settings.REEVALUATION_INTERVALS}
+        # Without -Q a worker consumes exactly the declared queues
+        self.assertLessEqual(routed | {app.conf.task_default_queue}, set(app.amqp.queues))
+
+
+class ParseMomentTests(SimpleTestCase):
+    def test_dates_and_datetimes_default_to_utc(self):
+        self.assertEqual(backfill_aggregates.parse_moment('2025-02-28').isoformat(), '2025-02-28T00:00:00+00:00')
+        self.assertEqual(
+            backfill_aggregates.parse_moment('2025-02-28T06:30:00+01:00').isoformat(), '2025-02-28T06:30:00+01:00',
+        )
+
+    def test_impossible_dates_are_command_errors(self):
+        for value in ['2025-02-30', '2025-02-30T00:00:00', 'yesterday']:
+            with self.assertRaises(CommandError, msg=value):
+                backfill_aggregates.parse_moment(value)
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class ScoringWindowTests(TestCase):
+    def test_frequent_windows_are_scored_on_the_trailing_span(self):
+        end = last_closed_boundary()
+        patient = make_population(1, 300, end=end)[0]  # ten minutes
+        Vital.objects.update(heart_rate=60)
+        Vital.objects.filter(timestamp__gte=end - timedelta(minutes=1)).update(heart_rate=120)
+
+        with override_settings(SCORING_WINDOW_SECONDS=300):
+            (high,) = pipeline.build_aggregates([patient], end - timedelta(minutes=1), end, summarize=False,
+                                                length=evaluation_interval('High'))
+            backfill_aggregates.backfill_chunk(end - timedelta(minutes=5), end, [patient.id], False)
+        self.assertEqual((high.start_time, high.end_time), (end - timedelta(minutes=1), end))
+        # One minute at 120 among five
+        self.assertAlmostEqual(high.avg_heart_rate, 72)
+        # A backfilled window ending at the same time covers the same span
+        backfilled = Aggregate.objects.get(patient=patient)
+        self.assertEqual(backfilled.start_time, end - timedelta(minutes=5))
+        self.assertAlmostEqual(backfilled.avg_heart_rate, high.avg_heart_rate)
+        self.assertEqual(backfilled.risk_level, high.risk_level)
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class BackfillTests(TestCase):
+    def setUp(self):
+        self.end = last_closed_boundary()
+        # Twenty minutes up to now, so the newest windows are still open
+        self.patient = make_population(1, 600)[0]
+
+    def test_window_written_meanwhile_is_overwritten(self):
+        bulk_create = Aggregate.objects.bulk_create
+
+        def racing_bulk_create(aggregates, **kwargs):
+            # aggregate_patients commits the newest window after the DELETE
+            Aggregate.objects.create(
+                patient=self.patient, start_time=aggregates[-1].start_time, end_time=self.end,
+                risk_level='Low', confidence=0.5, summary='concurrent',
+            )
+            return bulk_create(aggregates, **kwargs)
+
+        with mock.patch.object(Aggregate.objects, 'bulk_create', racing_bulk_create):
+            written = backfill_aggregates.backfill_chunk(self.end - timedelta(minutes=10), self.end, [self.patient.id], False)
+        self.assertEqual(Aggregate.objects.count(), written)
+        self.assertFalse(Aggregate.objects.filter(summary='concurrent').exists())
+
+    def test_open_windows_are_left_to_aggregation(self):
+        call_command(
+            'backfill_aggregates', (self.end - timedelta(minutes=10)).isoformat(),
+            (timezone.now() + timedelta(hours=1)).isoformat(),
+            patients=[self.patient.patient_id], workers=1, stdout=io.StringIO(),
+        )
+        self.assertTrue(Aggregate.objects.exists())
+        self.assertLessEqual(Aggregate.objects.latest('end_time').end_time, last_closed_boundary())
+
+
+class TrendTests(SimpleTestCase):
+    fields = ['heart_rate', 'spo2']
+
+    def test_segments_match_per_window_reference(self):
+        rng = numpy.random.default_rng(0)
+        seconds = numpy.concatenate([numpy.arange(30) * 2.0, 600 + numpy.arange(20) * 3.0])
+        values = rng.normal(80, 5, size=(50, 2))
+        values[rng.random(values.shape) < 0.2] = numpy.nan
+        values[30:, 1] = numpy.nan  # a window with no SpO2 at all
+        result = trends.segment_trends(seconds, values, numpy.array([0, 30]))
+
+        for window, rows in enumerate([slice(0, 30), slice(30, 50)]):
+            for column, field in enumerate(self.fields):
+                stats = trends.window_trends(result, window, self.fields)[field]
+                y = values[rows, column]
+                t = seconds[rows]
+                present = ~numpy.isnan(y)
+                self.assertEqual(stats['count'], present.sum())
+                self.assertAlmostEqual(stats['missing'], 1 - present.mean())
+                if not present.any():
+                    self.assertIsNone(stats['mean'])
+                    self.assertIsNone(stats['slope'])
+                    continue
+                self.assertAlmostEqual(stats['mean'], y[present].mean())
+                self.assertAlmostEqual(stats['std'], y[present].std())
+                self.assertEqual(stats['first'], y[present][0])
+                self.assertEqual(stats['last'], y[present][-1])
+                self.assertAlmostEqual(stats['slope'], numpy.polyfit(t[present] / 60, y[present], 1)[0])
+
+    def test_summary_prompt_tolerates_missing_vitals(self):
+        patient = Patient(age=70, gender='Female', weight=60, height=1.6)
+        values = numpy.array([[72, numpy.nan], [75, numpy.nan], [numpy.nan, numpy.nan]])
+        window = trends.window_trends(
+            trends.segment_trends(numpy.array([0.0, 30.0, 60.0]), values, numpy.array([0])), 0, self.fields,
+        )
+        window.update({field: dict.fromkeys(trends.STATS) | {'count': 0.0} for field in ['systolic', 'diastolic', 'temperature', 'resp']})
+
+        prompt = summarizer.build_summary_prompt(patient, window, timedelta(minutes=1))
+        self.assertIn("Heart Rate: 72.0 bpm → 75.0 bpm (+3.0), trend +6.00/min", prompt)
+        self.assertIn("33% of readings missing", prompt)
+        self.assertIn("SpO₂: no readings", prompt)
+
+
+class SignalQualityTests(SimpleTestCase):
+    samples = 500
+
+    def clean_ecg(self, rng):
+        # A beat every 0.8 s at 100 Hz over a little sensor noise
+        t = numpy.arange(self.samples)
+        return 0.5 + numpy.exp(-((t % 80 - 40) ** 2) / 4.0) + rng.normal(0, 0.02, self.samples)
+
+    def test_only_clean_still_windows_pass(self):
+        rng = numpy.random.default_rng(0)
+        clean = self.clean_ecg(rng)
+        windows = {
+            'clean': clean,
+            'flatline': numpy.full(self.samples, 0.5),
+            'clipped': numpy.clip(rng.normal(0, 3, self.samples), -1, 1),
+            'noise': rng.normal(0, 1, self.samples),
+            'moving': clean,
+            'short': clean[:50],
+        }
+        ecg = numpy.concatenate(list(windows.values()))
+        accel = numpy.tile([0.0, 0.0, 9.8], (len(ecg), 1))
+        high_activity = numpy.zeros(len(ecg), dtype=bool)
+        starts = numpy.cumsum([0] + [len(values) for values in windows.values()])[:-1]
+        moving = slice(starts[4], starts[5])
+        accel[moving, 2] += rng.normal(0, 4, self.samples)
+        high_activity[moving] = True
+
+        quality = dict(zip(windows, signal_quality.segment_quality(ecg, accel, high_activity, starts, 100)['quality']))
+        self.assertGreater(quality['clean'], 0.8)
+        for name in ['flatline', 'clipped', 'noise', 'moving', 'short']:
+            self.assertLess(quality[name], 0.2, name)
+
+    @override_settings(ECG_QUALITY_THRESHOLD=0.5)
+    def test_hrv_skips_unusable_windows(self):
+        start = timezone.now().replace(second=0, microsecond=0)
+        frame = pandas.DataFrame({
+            'id': range(self.samples),
+            'patient_id': 1,
+            'timestamp': pandas.date_range(start, periods=self.samples, freq='10ms'),
+            'ecg': numpy.random.default_rng(0).normal(0, 1, self.samples),
+            'motion_status': 'Normal Activity',
+            **{field: 80.0 for field in pipeline.AVG_FIELDS},
+        })
+        patient = Patient(id=1, age=70, gender='Female', weight=60, height=1.6)
+        with mock.patch.object(pipeline, 'load_vitals_frame', return_value=frame), \
+                mock.patch.object(pipeline.nk, 'ecg_process') as ecg_process, \
+                mock.patch.object(pipeline, 'predict_risk_batch', return_value=[('Low', 0.9)]):
+            (aggregate,) = pipeline.build_aggregates([patient], start, start + timedelta(minutes=5), summarize=False)
+        ecg_process.assert_not_called()
+        self.assertLess(aggregate.signal_quality, 0.5)
+
+    def test_synthetic_ecg_fails_the_gate_only_when_moving(self):
+        rng = numpy.random.default_rng(0)
+        activity = numpy.repeat([1.0, 2.4], self.samples)
+        ecg = generate_population.synthesize_ecg(rng, numpy.full(len(activity), 72.0), activity)
+        accel = numpy.zeros((len(activity), 3))
+        accel[:, 0] = rng.normal(0, 0.1 + 0.8 * activity)
+        accel[:, 2] = 9.8
+        resting, moving = signal_quality.segment_quality(ecg, accel, activity > 1.6, [0, self.samples], 100)['quality']
+        self.assertGreater(resting, 0.8)
+        self.assertLess(moving, 0.2)
+
+    @override_settings(ECG_MIN_SAMPLES=100, ECG_QUALITY_THRESHOLD=0.5, SCORING_WINDOW_SECONDS=300)
+    def test_high_risk_window_with_good_ecg_is_usable(self):
+        # Ten minutes of clean readings every 2 s; a one-minute window holds 30
+        end = last_closed_boundary()
+        rows = 300
+        frame = pandas.DataFrame({
+            'id': range(rows),
+            'patient_id': 1,
+            'timestamp': pandas.date_range(end=end - timedelta(seconds=2), periods=rows, freq='2s'),
+            'ecg': generate_population.synthesize_ecg(numpy.random.default_rng(0), numpy.full(rows, 72.0), numpy.ones(rows)),
+            'motion_status': 'Normal Activity',
+            **{field: 80.0 for field in pipeline.AVG_FIELDS},
+            'accel_x': 0.0, 'accel_y': 0.0, 'accel_z': 9.8,
+        })
+
+        def load(start, stop, patient_ids=None):
+            return frame[(frame['timestamp'] >= start) & (frame['timestamp'] < stop)].reset_index(drop=True)
+
+        patient = Patient(id=1, age=70, gender='Female', weight=60, height=1.6)
+        with mock.patch.object(pipeline, 'load_vitals_frame', side_effect=load), \
+                mock.patch.object(pipeline.nk, 'ecg_process', side_effect=ValueError) as ecg_process, \
+                mock.patch.object(pipeline, 'predict_risk_batch', return_value=[('High', 0.9)]):
+            (aggregate,) = pipeline.build_aggregates(
+                [patient], end - timedelta(minutes=1), end, summarize=False, length=evaluation_interval('High'),
+            )
+        self.assertGreaterEqual(aggregate.signal_quality, 0.5)
+        # HRV was attempted from the ECG rather than skipped
+        ecg_process.assert_called_once()
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class DownsamplingTests(TestCase):
+    def test_lttb_keeps_the_waveform_peaks(self):
+        rng = numpy.random.default_rng(0)
+        beats = numpy.arange(0, 10000, 80)
+        ecg = rng.normal(0, 0.02, 10000)
+        ecg[beats] = 1.0
+        kept = downsampling.lttb(numpy.arange(len(ecg)), ecg, 500)
+        self.assertEqual(len(kept), 500)
+        self.assertEqual([kept[0], kept[-1]], [0, len(ecg) - 1])
+        self.assertTrue(numpy.all(numpy.diff(kept) > 0))
+        self.assertTrue(set(beats[1:-1]) <= set(kept))
+
+    def test_min_max_keeps_every_extreme(self):
+        values = numpy.full(10000, 97.0)
+        values[[1234, 8765]] = [82.0, 100.0]
+        kept = downsampling.min_max(values, 100)
+        self.assertLessEqual(len(kept), 100)
+        self.assertIn(1234, kept)
+        self.assertIn(8765, kept)
+
+    def test_history_payload_follows_max_points_not_span(self):
+        end = last_closed_boundary()
+        (patient,) = make_population(1, 3000, end=end)
+        Vital.objects.filter(id=Vital.objects.order_by('id')[10].id).update(spo2=70)
+        url = f'/api/patients/{patient.id}/history/'
+        params = {'start': (end - timedelta(hours=2)).isoformat(), 'end': end.isoformat(), 'fields': 'spo2,ecg'}
+
+        response = self.client.get(url, {**params, 'max_points': 200})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['readings'], 3000)
+        self.assertEqual(set(body['series']), {'spo2', 'ecg'})
+        for series in body['series'].values():
+            self.assertLessEqual(len(series['values']), 200)
+            self.assertEqual(len(series['timestamps']), len(series['values']))
+        self.assertIn(70, body['series']['spo2']['values'])
+
+        self.assertEqual(len(self.client.get(url, {**params, 'max_points': 5000}).json()['series']['ecg']['values']), 3000)
+        for bad in [
+            {'max_points': 2}, {'max_points': 'wide'}, {'fields': 'mood'}, {'start': end.isoformat()},
+            {'start': '2025-02-30T00:00:00'},
+        ]:
+            self.assertEqual(self.client.get(url, {**params, **bad}).status_code, 400, bad)
+        self.assertEqual(self.client.get('/api/patients/0/history/').status_code, 404)
+
+
+@override_settings(**{
+    **OFFLINE_SETTINGS,
+    'INGEST_RATE_LIMIT_ENABLED': True,
+    'INGEST_RATE_PER_SECOND': 1,
+    'INGEST_BURST': 2,
+    'INGEST_MAX_CONCURRENCY': 64,
+    'INGEST_SLOT_TTL_SECONDS': 30,
+})
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.clock = 1_000_000.0
+        for patcher in [
+            mock.patch.object(ratelimit, 'get_redis', return_value=self.redis),
+            mock.patch.object(ratelimit, '_admit_script', None),
+            mock.patch.object(ratelimit.time, 'time', lambda: self.clock),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.device = Device.objects.get(assigned_to=make_population(1, 1)[0])
+
+    def upload(self, device_id=None):
+        return self.client.post(
+            '/api/vitals/upload/',
+            data=json.dumps(upload_payload(device_id or self.device.device_id)),
+            content_type='application/json',
+        )
+
+    def test_empty_bucket_is_rejected_until_it_refills(self):
+        self.assertEqual([self.upload().status_code for _ in range(2)], [201, 201])
+        rejected = self.upload()
+        self.assertEqual(rejected.status_code, 429)
+        self.assertEqual(rejected['Retry-After'], '1')
+        self.assertEqual(self.redis.hget(metrics.COUNTERS_KEY, 'ingest_rate_limited'), '1')
+
+        self.clock += 0.5
+        self.assertEqual(self.upload().status_code, 429)
+        self.clock += 0.5
+        self.assertEqual(self.upload().status_code, 201)
+        self.assertEqual(self.upload().status_code, 429)
+        # Other devices have their own bucket
+        other = Device.objects.get(assigned_to=make_population(1, 1)[0])
+        self.assertEqual(self.upload(other.device_id).status_code, 201)
+
+    @override_settings(INGEST_MAX_CONCURRENCY=1)
+    def test_slot_is_released_when_the_view_raises(self):
+        request = mock.Mock(data={'device_id': self.device.device_id})
+
+        @ratelimit.admission_control
+        def failing_view(view, request):
+            self.assertEqual(self.redis.zcard(ratelimit.INFLIGHT_KEY), 1)
+            raise RuntimeError("view failed")
+
+        with self.assertRaises(RuntimeError):
+            failing_view(None, request)
+        self.assertEqual(self.redis.zcard(ratelimit.INFLIGHT_KEY), 0)
+        self.assertEqual(self.upload().status_code, 201)
+
+    @override_settings(INGEST_MAX_CONCURRENCY=0)
+    def test_critical_devices_bypass_the_limits(self):
+        shed = self.upload()
+        self.assertEqual(shed.status_code, 429)
+        self.assertIn('busy', shed.json()['detail'])
+
+        self.device.priority = 'critical'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.save()
+        self.assertEqual([self.upload().status_code for _ in range(5)], [201] * 5)
+        self.assertEqual(self.redis.hget(metrics.COUNTERS_KEY, 'ingest_exempt'), '5')
+
+    def test_body_that_is_not_an_object_is_a_bad_request(self):
+        response = self.client.post('/api/vitals/upload/', data='[1]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(**{**OFFLINE_SETTINGS, 'DEVICE_PRESENCE_ENABLED': True, 'DEVICE_OFFLINE_AFTER_SECONDS': 60})
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server, decode_responses=True)
+        self.clock = 1_000_000.0
+        for patcher in [
+            mock.patch.object(presence, 'get_redis', return_value=self.redis),
+            mock.patch.object(redis_client, 'get_redis', return_value=self.redis),
+            mock.patch.object(presence.time, 'time', lambda: self.clock),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patients = make_population(3, 1)
+        self.devices = list(Device.objects.filter(assigned_to__in=patients).order_by('id'))
+
+    def heartbeat(self, device, at):
+        self.clock = at
+        presence.record_heartbeat(device.device_id)
+
+    def test_heartbeats_are_flushed_in_one_bulk_update(self):
+        for offset, device in enumerate(self.devices):
+            self.heartbeat(device, 1_000_000.0 + offset)
+        self.clock = 1_000_010.0
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(presence.flush_last_seen(), 3)
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        for offset, device in enumerate(self.devices):
+            device.refresh_from_db()
+            self.assertEqual(device.last_seen, presence.to_datetime(1_000_000.0 + offset))
+
+        # Only heartbeats since the previous flush are written again
+        self.heartbeat(self.devices[0], 1_000_100.0)
+        self.assertEqual(presence.flush_last_seen(), 1)
+
+    def test_quiet_devices_are_listed_and_reported_once(self):
+        quiet, recent, _ = self.devices
+        self.heartbeat(quiet, 1_000_000.0)
+        self.heartbeat(recent, 1_000_100.0)
+        self.clock = 1_000_130.0
+
+        listed = self.client.get('/api/devices/offline/').json()
+        self.assertEqual([device['device_id'] for device in listed], [quiet.device_id])
+        self.assertEqual(listed[0]['patient_id'], quiet.assigned_to.patient_id)
+        self.assertEqual(self.client.get('/api/devices/offline/', {'seconds': 200}).json(), [])
+        self.assertEqual(self.client.get('/api/devices/offline/', {'seconds': 'soon'}).status_code, 400)
+
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(f'patient_{quiet.assigned_to_id}', 'dashboard')
+        self.assertEqual(presence.sweep_offline(), 1)
+        message = async_to_sync(layer.receive)('dashboard')
+        self.assertEqual(message['type'], 'device.offline')
+        self.assertEqual(message['data']['device_id'], quiet.device_id)
+        self.assertEqual(presence.sweep_offline(), 0)
+        # An upload brings it back, and a later silence is reported again
+        self.heartbeat(quiet, 1_000_140.0)
+        self.clock = 1_000_300.0
+        self.assertEqual(presence.sweep_offline(), 2)
+
+    def test_view_falls_back_to_flushed_last_seen_when_redis_is_down(self):
+        quiet, recent, _ = self.devices
+        Device.objects.filter(id=quiet.id).update(last_seen=timezone.now() - timedelta(minutes=5))
+        Device.objects.filter(id=recent.id).update(last_seen=timezone.now())
+        self.server.connected = False
+
+        response = self.client.get('/api/devices/offline/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([device['device_id'] for device in response.json()], [quiet.device_id])
+
+
+@override_settings(**{**OFFLINE_SETTINGS, 'PROFILING_ENABLED': True, 'PROFILING_SAMPLE_RATE': 0,
+                      'PROFILING_SECRET': 'let-me-profile', 'PROFILING_MAX_PROFILES': 2})
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        overridden = override_settings(PROFILING_DIR=directory.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.device = Device.objects.get(assigned_to=make_population(1, 1)[0])
+
+    def upload(self, **headers):
+        response = self.client.post(
+            '/api/vitals/upload/', data=json.dumps(upload_payload(self.device.device_id)),
+            content_type='application/json', headers=headers,
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def profiles(self):
+        return len(list(self.directory.glob('*.pstats')))
+
+    def test_header_needs_the_secret_or_staff(self):
+        self.upload(x_profile='1')
+        self.upload(x_profile='wrong-secret')
+        self.assertEqual(self.profiles(), 0)
+        self.upload(x_profile='let-me-profile')
+        self.assertEqual(self.profiles(), 1)
+
+        self.client.force_login(User.objects.create_user('nurse', password='nurse'))
+        self.upload(x_profile='1')
+        self.assertEqual(self.profiles(), 1)
+        self.client.force_login(User.objects.create_user('ops', password='ops', is_staff=True))
+        self.upload(x_profile='1')
+        self.assertEqual(self.profiles(), 2)
+
+    def test_profiling_stops_at_the_directory_limits(self):
+        for _ in range(3):
+            self.upload(x_profile='let-me-profile')
+        self.assertEqual(self.profiles(), 2)
+
+        with override_settings(PROFILING_MAX_PROFILES=100, PROFILING_MAX_BYTES=1):
+            self.upload(x_profile='let-me-profile')
+        self.assertEqual(self.profiles(), 2)
+        for path in self.directory.iterdir():
+            path.unlink()
+        self.assertTrue(profiling.has_room())
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class SnapshotTests(TestCase):
+    def add_aggregates(self, patient, *windows):
+        # Created in the given order, so ids don't follow start_time
+        for start_time, risk_level in windows:
+            Aggregate.objects.create(
+                patient=patient, start_time=start_time, end_time=start_time + timedelta(minutes=5),
+                risk_level=risk_level, summary=risk_level,
+            )
+
+    def test_latest_window_wins_over_a_backfilled_one(self):
+        patient = make_population(1, 1)[0]
+        end = last_closed_boundary(timezone.now())
+        self.add_aggregates(patient, (end, 'High'), (end - timedelta(hours=1), 'Low'))
+
+        self.assertEqual(json.loads(snapshots.build_snapshot(patient))['risk_level'], 'High')
+        client = fakeredis.FakeRedis()
+        with override_settings(PATIENT_SNAPSHOT_CACHE_ENABLED=True), \
+                mock.patch.object(snapshots, 'get_redis', return_value=client):
+            snapshots.refresh_snapshots([patient.id])
+        cached = json.loads(client.get(snapshots.SNAPSHOT_KEY.format(patient.id)))
+        self.assertEqual(cached['risk_level'], 'High')
+        self.assertEqual([aggregate['risk_level'] for aggregate in cached['aggregates']], ['High', 'Low'])
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class GeneratePopulationTests(TestCase):
+    def test_appends_patients_with_devices_and_sequenced_vitals(self):
+        end = last_closed_boundary(timezone.now())
+        for patients in [2, 1]:
+            call_command('generate_population', patients=patients, days=0.01, end=end.isoformat(), stdout=io.StringIO())
+
+        rows = 432  # 0.01 days every 2 s
+        self.assertEqual(Device.objects.filter(assigned_to__patient_id__startswith='SYN-').count(), 3)
+        self.assertEqual(Vital.objects.count(), 3 * rows)
+        vitals = Vital.objects.filter(patient__patient_id='SYN-000002').order_by('timestamp')
+        self.assertEqual(list(vitals.values_list('sequence', flat=True)), list(range(rows)))
+        self.assertEqual(vitals.last().timestamp, end)
+        self.assertEqual(vitals.last().device.device_id, 'SYN-ESP-000002')
+
+
+@override_settings(**OFFLINE_SETTINGS)
+class LiveRiskTests(TestCase):
+    def setUp(self):
+        settings = override_settings(LIVE_RISK_ENABLED=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.layer = get_channel_layer()
+
+    def start_batcher(self, predict):
+        patcher = mock.patch('patient_vitals_api.risk_model.predict_risk_batch', side_effect=predict)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        batcher = live_risk.RiskBatcher(max_batch=64)
+        patcher = mock.patch.object(live_risk, 'batcher', return_value=batcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return batcher
+
+    def listen(self, patient):
+        async_to_sync(self.layer.group_add)(f'patient_{patient.id}', f'dashboard-{patient.id}')
+
+    def receive(self, patient):
+        return async_to_sync(self.layer.receive)(f'dashboard-{patient.id}')
+
+    def wait_for_scores(self, batcher, count):
+        deadline = time.monotonic() + 5
+        while batcher.scored < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(batcher.scored, count)
+
+    def test_waiting_readings_share_a_model_call(self):
+        patients = make_population(8, 20)
+        calls = []
+
+        def predict(features_list):
+            calls.append(len(features_list))
+            # The readings arriving during a call make up the next batch
+            time.sleep(0.2)
+            return [('Low', 0.5)] * len(features_list)
+
+        batcher = self.start_batcher(predict)
+        for patient in patients:
+            self.listen(patient)
+            live_risk.submit(patient, Vital.objects.filter(patient=patient).last(), [70, 72, None, 75])
+        self.wait_for_scores(batcher, 8)
+
+        self.assertEqual(sum(calls), 8)
+        self.assertLess(len(calls), 8)
+        for patient in patients:
+            message = self.receive(patient)
+            self.assertEqual(message['type'], 'risk.update')
+            self.assertEqual(message['data']['patient_id'], patient.id)
+            self.assertEqual(message['data']['provisional_confidence'], 50.0)
+
+    def test_upload_is_broadcast_before_it_is_scored(self):
+        patient = make_population(1, 20)[0]
+        device = Device.objects.get(assigned_to=patient)
+        scoring = threading.Event()
+
+        def predict(features_list):
+            scoring.wait(5)
+            return [('High', 0.9)] * len(features_list)
+
+        batcher = self.start_batcher(predict)
+        self.listen(patient)
+        response = self.client.post(
+            '/api/vitals/upload/', data=json.dumps(upload_payload(device.device_id)), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.receive(patient)['type'], 'vitals.update')
+        self.assertEqual(batcher.scored, 0)
+
+        scoring.set()
+        self.wait_for_scores(batcher, 1)
+        update = self.receive(patient)['data']
+        self.assertEqual(update['provisional_risk_level'], 'High')
+        self.assertEqual(update['vital_id'], Vital.objects.filter(patient=patient).latest('id').id)
+
+
+class DatabasePoolTests(SimpleTestCase):
+    def test_stats_report_pool_waits(self):
+        pool = mock.Mock(min_size=2, max_size=10)
+        pool.get_stats.return_value = {
+            'pool_size': 10, 'pool_available': 0, 'requests_waiting': 3,
+            'requests_num': 200, 'requests_queued': 20, 'requests_wait_ms': 400, 'requests_errors': 1,
+            'connections_num': 10, 'connections_ms': 250,
+        }
+        with mock.patch.object(db_pool, 'pools', return_value={'default': pool}):
+            stats = db_pool.stats()['default']
+        self.assertEqual(stats['mean_wait_ms'], 2)
+        self.assertEqual(stats['mean_queued_wait_ms'], 20)
+        self.assertEqual(stats['mean_connect_ms'], 25)
+        self.assertEqual((stats['waiting'], stats['timeouts'], stats['bad_returns']), (3, 1, 0))
+
+    def test_backends_without_pools_report_nothing(self):
+        with mock.patch.object(db_pool, 'connections', {'default': object()}):
+            self.assertEqual(db_pool.stats(), {})
+
+    def test_backfill_workers_start_without_inherited_pools(self):
+        connections.close_all()
+        backend = type(connections['default'])
+        with mock.patch.object(backend, '_connection_pools', {'default': object()}, create=True), \
+                ProcessPoolExecutor(max_workers=1, initializer=backfill_aggregates.init_worker) as workers:
+            self.assertEqual(workers.submit(inherited_pool_count).result(), 0)
+
+
+class ChannelLayerSettingsTests(SimpleTestCase):
+    SETTINGS_PATH = Path(settings.BASE_DIR) / 'patient_vitals_backend' / 'settings.py'
+
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            for name in ('CHANNEL_LAYER_BACKEND', 'CHANNEL_REDIS_URLS'):
+                if name not in environ:
+                    os.environ.pop(name, None)
+            return runpy.run_path(str(self.SETTINGS_PATH))
+
+    def test_redis_lists_by_default(self):
+        config = self.load_settings(REDIS_URL='redis://cache:6379/0')['CHANNEL_LAYERS']['default']
+        self.assertEqual(config['BACKEND'], 'channels_redis.core.RedisChannelLayer')
+        self.assertEqual(config['CONFIG']['hosts'], ['redis://cache:6379/0'])
+
+    def test_pubsub_shards_across_hosts(self):
+        config = self.load_settings(
+            CHANNEL_LAYER_BACKEND='pubsub', CHANNEL_REDIS_URLS='redis://a:6379/0, rediss://b:6380/1,',
+        )['CHANNEL_LAYERS']['default']
+        self.assertEqual(config['BACKEND'], 'channels_redis.pubsub.RedisPubSubChannelLayer')
+        self.assertEqual(config['CONFIG']['hosts'], ['redis://a:6379/0', 'rediss://b:6380/1'])
+        # The backend accepts the config; connections open on first use
+        backend = import_string(config['BACKEND'])
+        self.assertIsInstance(backend(**config['CONFIG']), backend)
+
+
+class RedisBatchTests(SimpleTestCase):
+    def make_batch(self, execute):
+        client = mock.Mock()
+        client.pipeline.return_value.execute.side_effect = execute
+        return redis_client.Batch(client)
+
+    def test_replies_fail_independently(self):
+        errors = []
+        batch = self.make_batch(lambda raise_on_error: [1, redis.ResponseError('WRONGTYPE'), 'cached'])
+        added = batch.queue('zadd', 'key', {'device': 1.0})
+        wrong = batch.queue('srem', 'key', 'device', on_error=errors.append)
+        cached = batch.queue('get', 'snapshot')
+        batch.execute()
+
+        self.assertEqual(added.get(), 1)
+        self.assertEqual(cached.get(), 'cached')
+        self.assertRaises(redis.ResponseError, wrong.get)
+        self.assertEqual(len(errors), 1)
+
+    def test_outage_fails_every_reply(self):
+        def execute(raise_on_error):
+            raise redis.ConnectionError('No connection available.')
+
+        batch = self.make_batch(execute)
+        replies = [batch.queue('get', 'a'), batch.queue('get', 'b')]
+        batch.execute()
+        for reply in replies:
+            self.assertRaises(redis.ConnectionError, reply.get)
+
+    def test_pool_stats_track_saturation(self):
+        stats = redis_client.PoolStats()
+        stats.checkout(0.002)
+        stats.checkout(0.004)
+        stats.checkin()
+        stats.checkout(1.0, ok=False)
+        stats.round_trip(0.001)
+        snapshot = stats.snapshot(max_connections=4)
+        self.assertEqual((snapshot['in_use'], snapshot['peak_in_use'], snapshot['checkout_timeouts']), (1, 2, 1))
+        self.assertEqual(snapshot['saturation'], 0.5)
+        self.assertEqual(snapshot['round_trips'], 1)
+
+
+@override_settings(SUMMARY_TIMEOUT_SECONDS=1, SUMMARY_SLOW_CALL_SECONDS=0.5)
+class SummaryFallbackTests(SimpleTestCase):
+    def setUp(self):
+        self.patient = Patient(id=1, age=70, gender='Male', weight=80, height=1.8)
+        values = numpy.array([[70.0, 97.0], [90.0, 96.0]])
+        self.trends = trends.window_trends(
+            trends.segment_trends(numpy.array([0.0, 60.0]), values, numpy.array([0])), 0, ['heart_rate', 'spo2'],
+        )
+        self.trends.update({field: dict.fromkeys(trends.STATS) | {'count': 0.0} for field in ['systolic', 'diastolic', 'temperature', 'resp']})
+        self.create = mock.Mock()
+        client = mock.Mock()
+        client.with_options.return_value.chat.completions.create = self.create
+        self.breaker = summarizer.CircuitBreaker(window=4, failure_rate=0.5, slow_call_seconds=0.5, cooldown_seconds=60, min_calls=2)
+        for patch in [
+            mock.patch.object(summarizer, 'openai_client', return_value=client),
+            mock.patch.object(summarizer, 'breaker', return_value=self.breaker),
+            mock.patch.object(summarizer.metrics, 'incr'),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def summarize(self, **kwargs):
+        return summarizer.generate_summary_for_patient(self.patient, 'High', self.trends, timedelta(minutes=5), **kwargs)
+
+    def test_template_is_deterministic_and_tagged(self):
+        self.assertEqual(
+            summarizer.template_summary('High', self.trends, timedelta(minutes=5)),
+            "[template] High risk over the last 5 min. Heart Rate rising 70→90 bpm; SpO₂ stable at 96%. "
+            "No readings for Systolic BP, Diastolic BP, Temperature, Respiratory Rate.",
+        )
+
+    def test_errors_open_the_breaker(self):
+        self.create.side_effect = RuntimeError("503")
+        for _ in range(2):
+            self.assertTrue(self.summarize().startswith(summarizer.TEMPLATE_TAG))
+        self.assertEqual(self.breaker.state, self.breaker.OPEN)
+
+        self.assertTrue(self.summarize().startswith(summarizer.TEMPLATE_TAG))
+        self.assertEqual(self.create.call_count, 2)
+
+    def test_hung_call_is_abandoned_at_the_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.create.side_effect = lambda **kwargs: release.wait(5)
+        started = time.monotonic()
+        self.assertTrue(self.summarize().startswith(summarizer.TEMPLATE_TAG))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_spent_run_budget_skips_the_call(self):
+        self.assertTrue(self.summarize(deadline=time.monotonic() - 1).startswith(summarizer.TEMPLATE_TAG))
+        self.create.assert_not_called()
+
+    def test_trial_call_closes_the_breaker(self):
+        self.breaker.cooldown_seconds = 0
+        self.breaker._open()
+        self.create.return_value.choices = [mock.Mock(message=mock.Mock(content="Heart rate rising."))]
+        self.assertEqual(self.summarize(), "Heart rate rising.")
+        self.assertEqual(self.breaker.state, self.breaker.CLOSED)
@@ -0,0 +1,84 @@
+# trends.py
+"""
+Trend features for every vital of many windows at once.
+
+Rows come in as one float matrix (one column per vital, NaN for a missing
+reading) plus the row offsets where each window starts. Every statistic is
+a segmented NumPy reduction over that matrix, so a whole aggregation run
+costs a handful of array passes however many windows and vitals it has.
+
+Per window and vital:
+
+* ``count`` / ``missing``: readings present, and the fraction of rows
+  without one
+* ``mean`` / ``std``: population mean and standard deviation
+* ``first`` / ``last`` / ``delta``: earliest and latest reading, and change
+* ``slope``: least-squares change per minute (needs two distinct times)
+
+Statistics that can't be computed from the readings are ``None``.
+"""
+import numpy as np
+
+STATS = ['count', 'missing', 'mean', 'std', 'first', 'last', 'delta', 'slope']
+
+
+def segment_trends(seconds, values, starts):
+    """
+    ``seconds`` is each row's time, ``values`` an ``(rows, vitals)`` matrix
+    and ``starts`` the ascending row offsets of each window (the first is 0;
+    rows are in time order within a window). Returns ``{stat: (windows,
+    vitals) array}``.
+    """
+    rows, columns = values.shape
+    lengths = np.diff(np.append(starts, rows))
+    valid = ~np.isnan(values)
+
+    def per_window(array):
+        return np.add.reduceat(array, starts, axis=0)
+
+    def per_row(array):
+        return np.repeat(array, lengths, axis=0)
+
+    count = per_window(valid.astype(np.float64))
+    times = np.broadcast_to(seconds[:, None], values.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = per_window(np.where(valid, values, 0.0)) / count
+        mean_time = per_window(np.where(valid, times, 0.0)) / count
+        # Centered second pass; keeps the sums small and the slope stable
+        dt = np.where(valid, times - per_row(mean_time), 0.0)
+        dy = np.where(valid, values - per_row(mean), 0.0)
+        sxx = per_window(dt * dt)
+        slope = np.where(sxx > 0, per_window(dt * dy) / sxx * 60, np.nan)
+        std = np.sqrt(per_window(dy * dy) / count)
+
+    index = np.arange(rows)[:, None]
+    first_index = np.minimum.reduceat(np.where(valid, index, rows), starts, axis=0)
+    last_index = np.maximum.reduceat(np.where(valid, index, -1), starts, axis=0)
+    present = count > 0
+    column = np.arange(columns)
+    first = np.where(present, values[np.minimum(first_index, rows - 1), column], np.nan)
+    last = np.where(present, values[np.maximum(last_index, 0), column], np.nan)
+
+    return {
+        'count': count,
+        'missing': 1 - count / lengths[:, None],
+        'mean': mean,
+        'std': std,
+        'first': first,
+        'last': last,
+        'delta': last - first,
+        'slope': slope,
+    }
+
+
+def window_trends(trends, window, fields):
+    """``{field: {stat: value}}`` for one window of ``segment_trends`` output."""
+    return {
+        field: {
+            stat: None if np.isnan(value) else float(value)
+            for stat in STATS
+            for value in [trends[stat][window, column]]
+        }
+        for column, field in enumerate(fields)
+    }
+
@@ -2,54 +2,79 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import VitalsUploadSerializer, PatientDataSerializer, AggregateSerializer
-from .models import Patient, Vital, Device, Aggregate
+from .serializers import VitalsUploadSerializer, PatientDataSerializer, OfflineDeviceSerializer
+from .models import Patient, Vital, Device
+from .dedupe import is_duplicate
+from .downsampling import MIN_POINTS, WAVEFORM_FIELDS, downsample
+from .presence import record_heartbeat, stale_heartbeats
+from .ratelimit import admission_control
+from .profiling import profile_view
+from .snapshots import get_snapshot, queue_snapshot
+from . import db_pool, live_risk, metrics, redis_client, snapshots
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta, timezone as dt_timezone
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import redis
-import joblib
-import random
 
-# Optional: Redis connection (configure as per your setup)
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)  # Adjust credentials
+DUPLICATE_RESPONSE = {'status': 'duplicate', 'message': 'Vitals already received'}
+
+HISTORY_FIELDS = [
+    'heart_rate', 'spo2', 'temperature', 'ecg', 'systolic', 'diastolic', 'resp', 'accel_x', 'accel_y', 'accel_z',
+]
 
 class VitalsUploadView(APIView):
+    @admission_control
+    @profile_view
     def post(self, request):
         serializer = VitalsUploadSerializer(data=request.data)
         if serializer.is_valid():
             validated_data = serializer.validated_data
-            validated_data.pop('patient')
-            device_id = validated_data.pop('device_id')
-
+            validated_data.pop('device_id')
+            # Already looked up (with the patient) while validating
+            device = validated_data.pop('device')
+            patient = validated_data.pop('patient')
 
-            device = Device.objects.get(device_id=device_id)
-            patient = device.assigned_to
-            validated_data.pop('device')
-            
-            # Save to Vital
-            vitals = Vital.objects.create(
-                device=device,
-                patient=patient,
-                **validated_data
-            )
+            # A retry of a stored reading is acknowledged without storing or
+            # broadcasting it again (see dedupe.py)
+            sequence = validated_data.get('sequence')
+            if sequence is None:
+                vitals = Vital.objects.create(device=device, patient=patient, **validated_data)
+            elif is_duplicate(device, sequence):
+                return Response(DUPLICATE_RESPONSE, status=status.HTTP_200_OK)
+            else:
+                try:
+                    with transaction.atomic():
+                        vitals = Vital.objects.create(device=device, patient=patient, **validated_data)
+                except IntegrityError:
+                    return Response(DUPLICATE_RESPONSE, status=status.HTTP_200_OK)
+            # Heartbeat and cached snapshot in one Redis round trip
+            with redis_client.batch() as batch:
+                record_heartbeat(device.device_id, batch)
+                cached_snapshot = queue_snapshot(patient, batch)
              
             # Update Redis cache for recent series (example for heart_rate and ecg)
             patient_id_str = str(patient.id)
-            confidence = 0
-            risk_level = "N/A"
-            summary = ""
             
             patient_vitals = Vital.objects.filter(patient=patient).order_by("-id")
-            hr_data = patient_vitals.values_list('heart_rate', flat=True)[:20]
+            hr_data = list(patient_vitals.values_list('heart_rate', flat=True)[:20])
             spo2_data = patient_vitals.values_list('spo2', flat=True)[:20]
-            ecg_data = patient_vitals.values_list('ecg', flat=True)[:200]
+            ecg_data = list(patient_vitals.values_list('ecg', flat=True)[:settings.LIVE_ECG_SAMPLES])
+            if len(ecg_data) > settings.LIVE_ECG_MAX_POINTS:
+                _, ecg_data = downsample(range(len(ecg_data)), ecg_data, settings.LIVE_ECG_MAX_POINTS, waveform=True)
 
-            aggregates = Aggregate.objects.filter(patient=patient)
-            if aggregates.exists():     
-                aggregates = aggregates.order_by('-id')[:100]
-                confidence = aggregates.first().confidence * 100
-                risk_level = aggregates.first().risk_level
-                summary = aggregates.first().summary
+            # Profile, aggregate history and latest risk are pre-encoded and
+            # only rebuilt when a Patient or Aggregate is saved
+            snapshot = get_snapshot(patient, cached_snapshot)
+            live = snapshots.encode({
+                "hr_data": hr_data,
+                "spo2_data": list(spo2_data),
+                "ecg_data": ecg_data,
+                **VitalsUploadSerializer(vitals).data,
+            })
             
             # Broadcast via WebSockets (assuming Channels set up)
             channel_layer = get_channel_layer()
@@ -57,19 +82,11 @@ class VitalsUploadView(APIView):
                 f'patient_{patient_id_str}',
                 {
                     'type': 'vitals.update',
-                    'data': {
-                        "confidence":  confidence,
-                        "risk_level": risk_level,
-                        "summary": summary,
-                        "hr_data": list(hr_data),
-                        "spo2_data": list(spo2_data),
-                        "ecg_data": list(ecg_data),
-                        "aggregates": AggregateSerializer(aggregates, many=True).data,
-                        **dict(PatientDataSerializer(patient).data),
-                        **dict(VitalsUploadSerializer(vitals).data)
-                    }
+                    'text': '{"type": "vitals_update", "data": ' + snapshots.merge(snapshot, live) + '}',
                 }
             )
+            # Scored in the background; a risk_update follows this broadcast
+            live_risk.submit(patient, vitals, hr_data)
             
             return Response({'status': 'success', 'message': 'Vitals uploaded successfully'}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -79,4 +96,108 @@ class PatientDataView(APIView):
         patient = Patient.objects.all()
         
         serializer = PatientDataSerializer(patient, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+class PatientHistoryView(APIView):
+    """
+    A patient's vitals between ``start`` and ``end`` (ISO 8601, UTC unless an
+    offset is given; the last ``HISTORY_DEFAULT_SECONDS`` by default), one
+    series per vital in ``fields`` (comma-separated; all by default). Each
+    series holds at most ``max_points`` points, so the payload follows the
+    chart's width rather than the span. Archived days are not included.
+    """
+    def get(self, request, patient_id):
+        params = request.query_params
+        try:
+            max_points = int(params.get('max_points', settings.SERIES_MAX_POINTS))
+        except ValueError:
+            return Response({'max_points': 'Must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not MIN_POINTS <= max_points <= settings.SERIES_MAX_POINTS_LIMIT:
+            return Response(
+                {'max_points': f'Must be between {MIN_POINTS} and {settings.SERIES_MAX_POINTS_LIMIT}.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fields = params['fields'].split(',') if params.get('fields') else HISTORY_FIELDS
+        unknown = [field for field in fields if field not in HISTORY_FIELDS]
+        if unknown:
+            return Response({'fields': f"Unknown: {', '.join(unknown)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        span = {}
+        for name in ['start', 'end']:
+            if name in params:
+                try:
+                    span[name] = parse_datetime(params[name])
+                except ValueError:
+                    # Well formed but impossible, e.g. February 30th
+                    span[name] = None
+                if span[name] is None:
+                    return Response({name: 'Must be an ISO 8601 datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+                if timezone.is_naive(span[name]):
+                    span[name] = timezone.make_aware(span[name], dt_timezone.utc)
+        end = span.get('end') or timezone.now()
+        start = span.get('start') or end - timedelta(seconds=settings.HISTORY_DEFAULT_SECONDS)
+        if not start < end <= start + timedelta(seconds=settings.HISTORY_MAX_SECONDS):
+            return Response(
+                {'end': f'Must be after start and at most {settings.HISTORY_MAX_SECONDS}s later.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not Patient.objects.filter(id=patient_id).exists():
+            return Response({'detail': 'Patient not found.'}, status=status.HTTP_404_NOT_FOUND)
+        rows = list(
+            Vital.objects.filter(patient_id=patient_id, timestamp__gte=start, timestamp__lt=end)
+            .order_by('timestamp', 'id')
+            .values_list('timestamp', *fields)
+        )
+        timestamps, *columns = zip(*rows) if rows else [()] * (len(fields) + 1)
+
+        series = {}
+        for field, values in zip(fields, columns):
+            points = downsample(timestamps, values, max_points, waveform=field in WAVEFORM_FIELDS)
+            series[field] = dict(zip(['timestamps', 'values'], points))
+        return Response({
+            'patient': patient_id,
+            'start': start,
+            'end': end,
+            'readings': len(rows),
+            'max_points': max_points,
+            'series': series,
+        }, status=status.HTTP_200_OK)
+
+class OfflineDevicesView(APIView):
+    def get(self, request):
+        try:
+            offline_after = int(request.query_params.get('seconds', settings.DEVICE_OFFLINE_AFTER_SECONDS))
+        except ValueError:
+            return Response({'seconds': 'Must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        devices = Device.objects.filter(active=True).select_related('assigned_to')
+        try:
+            stale = stale_heartbeats(offline_after)
+        except redis.RedisError:
+            # Fall back to the last flushed values
+            cutoff = timezone.now() - timedelta(seconds=offline_after)
+            devices = list(devices.filter(last_seen__lt=cutoff))
+        else:
+            devices = list(devices.filter(device_id__in=stale))
+            for device in devices:
+                device.last_seen = stale[device.device_id]
+
+        serializer = OfflineDeviceSerializer(devices, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+class MetricsView(APIView):
+    def get(self, request):
+        try:
+            counters = metrics.snapshot()
+        except redis.RedisError as e:
+            return Response(
+                {'error': str(e), 'redis': redis_client.stats(), 'database': db_pool.stats()},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        # Pool and round-trip figures are for the process serving this request
+        return Response(
+            {**counters, 'redis': redis_client.stats(), 'database': db_pool.stats()},
+            status=status.HTTP_200_OK,
+        )
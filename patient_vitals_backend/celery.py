@@ -1,9 +1,12 @@
 # patient_vitals_backend/celery.py
 import os
+import sys
 from celery import Celery
 
 # Set the default Django settings module for the 'celery' program
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'patient_vitals_backend.settings')
+# Sizes the database pools (see DB_POOL_SIZES); "celery worker -B" counts as a worker
+os.environ.setdefault('PROCESS_TYPE', 'beat' if 'beat' in sys.argv else 'worker')
 
 app = Celery('patient_vitals_backend')
 
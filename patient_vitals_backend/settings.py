@@ -13,7 +13,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
-from urllib.parse import urlparse
+from celery.schedules import crontab
+from kombu import Queue
 
 # Load .env file
 load_dotenv()
@@ -74,6 +75,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'patient_vitals_api.replicas.ReplicaRoutingMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -115,7 +117,7 @@ WSGI_APPLICATION = 'patient_vitals_backend.wsgi.application'
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "django.db.backends.postgresql",
         "NAME": os.environ.get("DB_NAME"),
         "USER": os.environ.get("DB_USER"),
         "PASSWORD": os.environ.get("DB_PASSWORD"),
@@ -124,41 +126,280 @@ DATABASES = {
     }
 }
 
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica-1,replica-2:5433. They share
+# the primary's name and credentials. Dashboard reads and aggregation scans
+# use them (see patient_vitals_api/replicas.py).
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    replica_host, _, replica_port = replica.strip().partition(':')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['patient_vitals_api.replicas.ReplicaRouter']
+# Replicas further behind than this are skipped. Keep it below
+# AGGREGATION_GRACE_SECONDS so a closed window is complete on the replica.
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', 5))
+# After a request writes, the client's next requests read from the primary
+# for this long
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 15))
+
+# Pooled Postgres connections (see patient_vitals_api/db_pool.py). Each
+# process keeps one pool per database, sized for its PROCESS_TYPE: "web"
+# (Daphne, the default), "worker" or "beat" (patient_vitals_backend/celery.py
+# picks these from the command line). A query waits up to DB_POOL_TIMEOUT
+# seconds for a free connection. Measure with benchmarks/db_pool.py.
+DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'true').lower() == 'true'
+PROCESS_TYPE = os.environ.get('PROCESS_TYPE', 'web')
+# (min_size, max_size) per process type
+DB_POOL_SIZES = {
+    'web': (int(os.environ.get('DB_POOL_WEB_MIN_SIZE', 2)), int(os.environ.get('DB_POOL_WEB_MAX_SIZE', 10))),
+    # Prefork children run one task at a time
+    'worker': (int(os.environ.get('DB_POOL_WORKER_MIN_SIZE', 1)), int(os.environ.get('DB_POOL_WORKER_MAX_SIZE', 2))),
+    'beat': (0, 1),
+}
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+# Connections are replaced after DB_POOL_MAX_LIFETIME seconds, and closed
+# after DB_POOL_MAX_IDLE seconds unused while the pool is above its minimum
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))
+if DB_POOL_ENABLED:
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE = DB_POOL_SIZES[PROCESS_TYPE]
+    for database in DATABASES.values():
+        # With a pool, every checkout is tested and replaced if broken
+        database['CONN_HEALTH_CHECKS'] = True
+        database['OPTIONS'] = {
+            **database.get('OPTIONS', {}),
+            'pool': {
+                'min_size': DB_POOL_MIN_SIZE,
+                'max_size': DB_POOL_MAX_SIZE,
+                'timeout': DB_POOL_TIMEOUT,
+                'max_lifetime': DB_POOL_MAX_LIFETIME,
+                'max_idle': DB_POOL_MAX_IDLE,
+            },
+        }
+
 # settings.py
 ASGI_APPLICATION = "patient_vitals_backend.asgi.application"
 
 redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
-parsed_url = urlparse(redis_url)
-hosts = [{
-    'host': parsed_url.hostname,
-    'port': parsed_url.port,
-    'password': parsed_url.password,
-}]
+REDIS_URL = redis_url
+# Connection pool per process for application code (see
+# patient_vitals_api/redis_client.py). Commands wait up to REDIS_POOL_TIMEOUT
+# seconds for a free connection before failing like an outage would.
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 1))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 2))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+# Channel layer used for the live dashboard broadcasts:
+#   "redis"  - a Redis list per connection; group_send pushes one copy per
+#              member, so its cost grows with the viewers of a patient
+#   "pubsub" - one PUBLISH per group_send; Redis delivers it once to every
+#              process with a viewer, which hands it to its own connections
+# Several comma-separated URLs in CHANNEL_REDIS_URLS shard channels and
+# groups across Redis hosts with either backend. Measure with
+# benchmarks/fanout.py.
+CHANNEL_LAYER_BACKENDS = {
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'redis')
+CHANNEL_REDIS_URLS = [url.strip() for url in os.environ.get('CHANNEL_REDIS_URLS', redis_url).split(',') if url.strip()]
 
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": CHANNEL_LAYER_BACKENDS[CHANNEL_LAYER_BACKEND],
         "CONFIG": {
-            "hosts": hosts
+            "hosts": CHANNEL_REDIS_URLS
         },
     },
 }
 
 # Celery Configuration
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL)
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', REDIS_URL)
+CELERY_REDIS_MAX_CONNECTIONS = REDIS_MAX_CONNECTIONS
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# Evaluations are routed to a critical and a routine queue (see
+# REEVALUATION_QUEUES). A plain worker consumes every queue declared here;
+# a dedicated worker for the critical one is optional, e.g.
+#   celery -A patient_vitals_backend worker -Q vitals_critical
+#   celery -A patient_vitals_backend worker -Q celery,vitals_routine
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_QUEUES = [
+    Queue('celery'),
+    Queue('vitals_critical'),
+    Queue('vitals_routine'),
+]
+# Redis emulates priorities with one list per step; 0 is served first
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+# Don't let a worker reserve a batch of routine tasks ahead of urgent ones
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 
 # Celery Beat Configuration
+# Runs are cheap when no window has closed, so poll every minute and let the
+# watermark decide what is due.
 CELERY_BEAT_SCHEDULE = {
-    'aggregate-vitals-every-5-minutes': {
+    'aggregate-vitals': {
         'task': 'patient_vitals_api.tasks.aggregate_vitals',
+        'schedule': 60.0,
+    },
+    'flush-device-presence': {
+        'task': 'patient_vitals_api.tasks.flush_device_presence',
+        'schedule': 30.0,
+    },
+    'sweep-offline-devices': {
+        'task': 'patient_vitals_api.tasks.sweep_offline_devices',
+        'schedule': 60.0,
+    },
+    'sync-critical-devices': {
+        'task': 'patient_vitals_api.tasks.sync_critical_devices',
         'schedule': 300.0,
     },
+    'archive-vitals': {
+        'task': 'patient_vitals_api.tasks.archive_vitals',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
+
+# Ingest admission control: a per-device token bucket plus a global cap on
+# in-flight uploads. Devices with priority "critical" are exempt.
+INGEST_RATE_LIMIT_ENABLED = os.environ.get('INGEST_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+INGEST_RATE_PER_SECOND = float(os.environ.get('INGEST_RATE_PER_SECOND', 2))
+INGEST_BURST = int(os.environ.get('INGEST_BURST', 10))
+INGEST_MAX_CONCURRENCY = int(os.environ.get('INGEST_MAX_CONCURRENCY', 64))
+# Slots held longer than this are assumed to belong to a crashed request
+INGEST_SLOT_TTL_SECONDS = int(os.environ.get('INGEST_SLOT_TTL_SECONDS', 30))
+
+# Pre-rendered patient snapshots are rebuilt on save; this only bounds how
+# long a stale one can survive a missed refresh
+PATIENT_SNAPSHOT_CACHE_ENABLED = os.environ.get('PATIENT_SNAPSHOT_CACHE_ENABLED', 'true').lower() == 'true'
+PATIENT_SNAPSHOT_TTL_SECONDS = int(os.environ.get('PATIENT_SNAPSHOT_TTL_SECONDS', 3600))
+
+# Provisional risk for every live reading (see patient_vitals_api/live_risk.py).
+# Each web process loads the risk model on its first upload and scores the
+# readings together, up to LIVE_RISK_MAX_BATCH. Uploads don't wait for it:
+# each score follows its vitals broadcast as a risk_update message. After
+# the first reading the scorer waits up to LIVE_RISK_LINGER_MS for more, so
+# fewer, larger model calls compete with uploads for the interpreter; that
+# delays only the risk_update. Off until benchmarks/live_risk.py shows it
+# costs uploads nothing under Daphne.
+LIVE_RISK_ENABLED = os.environ.get('LIVE_RISK_ENABLED', 'false').lower() == 'true'
+LIVE_RISK_MAX_BATCH = int(os.environ.get('LIVE_RISK_MAX_BATCH', 256))
+LIVE_RISK_LINGER_MS = float(os.environ.get('LIVE_RISK_LINGER_MS', 100))
+
+# Chart series (see patient_vitals_api/downsampling.py). History responses
+# return at most max_points points per vital: SERIES_MAX_POINTS unless the
+# client asks for another budget up to SERIES_MAX_POINTS_LIMIT. Spans default
+# to the last HISTORY_DEFAULT_SECONDS and cover at most HISTORY_MAX_SECONDS.
+SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS', 1000))
+SERIES_MAX_POINTS_LIMIT = int(os.environ.get('SERIES_MAX_POINTS_LIMIT', 10000))
+HISTORY_DEFAULT_SECONDS = int(os.environ.get('HISTORY_DEFAULT_SECONDS', 3600))
+HISTORY_MAX_SECONDS = int(os.environ.get('HISTORY_MAX_SECONDS', 7 * 24 * 3600))
+# Every broadcast carries the latest LIVE_ECG_SAMPLES ECG readings, reduced
+# to LIVE_ECG_MAX_POINTS when there are more
+LIVE_ECG_SAMPLES = int(os.environ.get('LIVE_ECG_SAMPLES', 200))
+LIVE_ECG_MAX_POINTS = int(os.environ.get('LIVE_ECG_MAX_POINTS', 200))
+
+# Opt-in profiling (see patient_vitals_api/profiling.py). Uploads are profiled
+# when they send an X-Profile header or by sampling; listed tasks every run.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_HEADER = 'HTTP_X_PROFILE'
+# The header only counts from staff users, or when its value is this secret
+PROFILING_SECRET = os.environ.get('PROFILING_SECRET', '')
+PROFILING_TASKS = os.environ.get(
+    'PROFILING_TASKS',
+    'patient_vitals_api.tasks.aggregate_vitals,patient_vitals_api.tasks.aggregate_patients',
+).split(',')
+PROFILING_DIR = os.environ.get('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+# Seconds between wall-clock stack samples
+PROFILING_SAMPLE_INTERVAL = float(os.environ.get('PROFILING_SAMPLE_INTERVAL', 0.005))
+# Profiling stops while PROFILING_DIR holds this many profiles or bytes
+PROFILING_MAX_PROFILES = int(os.environ.get('PROFILING_MAX_PROFILES', 200))
+PROFILING_MAX_BYTES = int(os.environ.get('PROFILING_MAX_BYTES', 500 * 1024 * 1024))
+
+# LLM summaries (see patient_vitals_api/summarizer.py). Each OpenAI call gets
+# SUMMARY_TIMEOUT_SECONDS and each aggregation run SUMMARY_RUN_BUDGET_SECONDS
+# in total; past either, or while the breaker is open, summaries come from a
+# template.
+SUMMARY_TIMEOUT_SECONDS = float(os.environ.get('SUMMARY_TIMEOUT_SECONDS', 8))
+SUMMARY_RUN_BUDGET_SECONDS = float(os.environ.get('SUMMARY_RUN_BUDGET_SECONDS', 30))
+# Calls slower than this count against the breaker like errors do
+SUMMARY_SLOW_CALL_SECONDS = float(os.environ.get('SUMMARY_SLOW_CALL_SECONDS', 4))
+SUMMARY_BREAKER_WINDOW = int(os.environ.get('SUMMARY_BREAKER_WINDOW', 20))
+SUMMARY_BREAKER_FAILURE_RATE = float(os.environ.get('SUMMARY_BREAKER_FAILURE_RATE', 0.5))
+SUMMARY_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('SUMMARY_BREAKER_COOLDOWN_SECONDS', 60))
+
+# ECG signal-quality gate (see patient_vitals_api/signal_quality.py). HRV is
+# only computed from the ECG of windows scoring at least the threshold with
+# at least ECG_MIN_SAMPLES samples; other windows estimate it from heart rate.
+# Samples are counted over the window's scoring span, so keep the minimum
+# below what SCORING_WINDOW_SECONDS holds at the upload rate (150 at 2 s).
+ECG_QUALITY_THRESHOLD = float(os.environ.get('ECG_QUALITY_THRESHOLD', 0.5))
+ECG_MIN_SAMPLES = int(os.environ.get('ECG_MIN_SAMPLES', 100))
+
+# Cold tier for raw vitals (see patient_vitals_api/archive.py). Days older
+# than VITALS_ARCHIVE_AFTER_DAYS move to per-patient, per-day files in
+# VITALS_ARCHIVE_DIR; put it on a persistent volume.
+VITALS_ARCHIVE_DIR = os.environ.get('VITALS_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+VITALS_ARCHIVE_AFTER_DAYS = int(os.environ.get('VITALS_ARCHIVE_AFTER_DAYS', 30))
+# Uncompressed files are memory-mapped on read, so a time-range read only
+# touches what it slices; compressed ones are smaller but read in full
+VITALS_ARCHIVE_COMPRESS = os.environ.get('VITALS_ARCHIVE_COMPRESS', 'false').lower() == 'true'
+
+# Heartbeats in Redis for last_seen tracking and offline detection
+DEVICE_PRESENCE_ENABLED = os.environ.get('DEVICE_PRESENCE_ENABLED', 'true').lower() == 'true'
+# A device with no upload for this long is reported offline
+DEVICE_OFFLINE_AFTER_SECONDS = int(os.environ.get('DEVICE_OFFLINE_AFTER_SECONDS', 60))
+
+# Per-device sequence high-water marks in Redis let retried uploads be
+# recognised without a database lookup (see patient_vitals_api/dedupe.py)
+UPLOAD_DEDUPE_ENABLED = os.environ.get('UPLOAD_DEDUPE_ENABLED', 'true').lower() == 'true'
+
+# Aggregation windows are aligned to multiples of this length
+AGGREGATION_WINDOW_SECONDS = int(os.environ.get('AGGREGATION_WINDOW_SECONDS', 300))
+# How long after a window ends before it is considered closed (late samples)
+AGGREGATION_GRACE_SECONDS = int(os.environ.get('AGGREGATION_GRACE_SECONDS', 30))
+# Windows older than this many lengths are left to backfill_aggregates
+AGGREGATION_MAX_CATCHUP_WINDOWS = int(os.environ.get('AGGREGATION_MAX_CATCHUP_WINDOWS', 288))
+
+# Every window is scored on at least the trailing SCORING_WINDOW_SECONDS of
+# readings, however short the window (see patient_vitals_api/aggregation.py)
+SCORING_WINDOW_SECONDS = int(os.environ.get('SCORING_WINDOW_SECONDS', AGGREGATION_WINDOW_SECONDS))
+
+# Re-evaluation cadence (and window length) per latest risk level, in seconds.
+# Keep these multiples of the beat interval above.
+REEVALUATION_INTERVALS = {
+    'High': int(os.environ.get('REEVALUATION_HIGH_SECONDS', 60)),
+    'Moderate': int(os.environ.get('REEVALUATION_MODERATE_SECONDS', AGGREGATION_WINDOW_SECONDS)),
+    'Low': int(os.environ.get('REEVALUATION_LOW_SECONDS', 900)),
+}
+REEVALUATION_QUEUES = {
+    'High': 'vitals_critical',
+    'Moderate': 'vitals_routine',
+    'Low': 'vitals_routine',
+}
+REEVALUATION_PRIORITIES = {
+    'High': 0,
+    'Moderate': 3,
+    'Low': 6,
 }
+# Routine patients are evaluated this many per task
+REEVALUATION_BATCH_SIZE = int(os.environ.get('REEVALUATION_BATCH_SIZE', 25))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -16,10 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from patient_vitals_api.views import VitalsUploadView, PatientDataView
+from patient_vitals_api.views import VitalsUploadView, PatientDataView, PatientHistoryView, OfflineDevicesView, MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/vitals/upload/', VitalsUploadView.as_view(), name='vitals-upload'),
     path('api/patients/', PatientDataView.as_view(), name='patient-data'),
+    path('api/patients/<int:patient_id>/history/', PatientHistoryView.as_view(), name='patient-history'),
+    path('api/devices/offline/', OfflineDevicesView.as_view(), name='offline-devices'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
 ]